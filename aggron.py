@@ -1,6 +1,7 @@
 import pandas as pd
 import re
 from styles import bough
+from styles import spill
 from datetime import datetime
 
 # =============================================================================
@@ -13,8 +14,6 @@ filename = 'datasets/' + name + '.xlsx'
 output = 'datasets/' + name + '_TotalTabsPlus' + '.xlsx'
 dirpath = 'C:/Users/Chris Valenzuela/Desktop/Programming/TotalTabsPlus/'
 
-xls = pd.ExcelFile(filename)
-
 global start, end, firstworksheet, lastworksheet
 firstworksheet = 2
 lastworksheet = None
@@ -30,7 +29,100 @@ TotalTabsDictionary['RowStubData'] = {}
 TotalTabsDictionary['TableLink'] = {}
 TotalTabsDictionary['Banner'] = []
 TotalTabsDictionary['BannerLetter'] = []
+TotalTabsDictionary['BannerColumn'] = {}
+
+# =============================================================================
+# Memory budget in bytes for the parsed tables (None = keep all in memory) and
+# the disk-backed store they spill into once the budget is used up
+# =============================================================================
+maxmemory = None
+spillstore = None
+
+# =============================================================================
+# Tables skipped because they have numerics/duplicate rows. Compiled once, see
+# bough.compile_skip_rules for the rule syntax
+# =============================================================================
+defaultskips = 'T56, T113, T114, T126, T127, T158, T159, T187-T190, T203-T206'
+skiprules = bough.compile_skip_rules(defaultskips)
+
+# =============================================================================
+# With autoskip on, every tab is pre-scanned by bough.classify_sheet and only
+# percentage tabs are aggregated. The decision per sheet lands in autoskipped
+# =============================================================================
+autoskip = False
+autoskipped = {}
+
+# =============================================================================
+# start/end above are only the usual offsets, every tab gets its own from
+# bough.detect_layout. Header analyses are cached by header fingerprint and
+# kept across workbooks, most studies only have a handful of distinct headers.
+# Every kept tab is still read in full, the cache only skips read_header
+# =============================================================================
+layoutcache = {}
+maxlayouts = 1000
+
+# =============================================================================
+# Banners read by bough.read_banner, interned by header fingerprint and by
+# content so tabs with the same banner share one set of lists
+# =============================================================================
+bannercache = {}
+
+
+# =============================================================================
+# Replaces the skip rules for the next aggr run. rules is anything
+# bough.compile_skip_rules takes, None puts the defaults back
+# =============================================================================
+def set_skip_rules(rules = None):
+    global skiprules
+    if rules is None:
+        rules = defaultskips
+    skiprules = bough.compile_skip_rules(rules)
+
+
+# =============================================================================
+# Empties TotalTabsDictionary in place so a long-running process can aggregate
+# another workbook. scraper holds a reference to this same dict, so it must not
+# be rebound.
+# =============================================================================
+def reset_totaltabs(memory = None):
+    global maxmemory, spillstore
+    maxmemory = memory
+    if spillstore is not None:
+        spillstore.close()
+        spillstore = None
+
+    for key in ['Table', 'Question', 'Stub', 'StubData', 'RowStubData', 'TableLink']:
+        TotalTabsDictionary[key] = {}
+    TotalTabsDictionary['Banner'] = []
+    TotalTabsDictionary['BannerLetter'] = []
+    TotalTabsDictionary['BannerColumn'] = {}
+    autoskipped.clear()
+
+    # =========================================================================
+    # StubData/RowStubData hold almost all of the parsed data, those are the
+    # ones that move to disk under a budget
+    # =========================================================================
+    if maxmemory is not None:
+        spillstore = spill.SpillStore(maxmemory)
+        TotalTabsDictionary['StubData'] = spillstore.mapping('StubData')
+        TotalTabsDictionary['RowStubData'] = spillstore.mapping('RowStubData')
+
 
+# =============================================================================
+# True if the tab should be aggregated. Without autoskip every tab is. The
+# pre-scan runs on the rows aggr already read (bough.sheet_rows)
+# =============================================================================
+def classify_tab(rows, sheet_name, layout):
+    if not autoskip:
+        return True
+
+    kind, reason = bough.classify_sheet(rows, layout['start'], layout['end'])
+    if kind == 'percentage':
+        return True
+
+    autoskipped[sheet_name] = kind + ': ' + reason
+    print('Skipping ' + sheet_name + ' (' + kind + ': ' + reason + ')')
+    return False
 
 
 def aggr(xls):
@@ -40,16 +132,16 @@ def aggr(xls):
     # Adding Dict to key "TableLink". Where key = "Table Number"
     # =========================================================================
     for indexsheet in xls.sheet_names[0:1]:
-        df = pd.read_excel(filename, sheet_name = indexsheet)
+        df = pd.read_excel(xls, sheet_name = indexsheet)
         df = df.loc[4:].copy()
         for o, links in enumerate(df['Client: ']):
             o += 1
 
             # =================================================================
             # skipping these tables because they have numerics/duplicate rows
-            # using "skip_tabs" function in bough file 
+            # using the compiled "skiprules" 
             # =================================================================
-            if bough.skip_tabs(o, '56, 113, 114, 126, 127, 158, 159, 187, 188, 189, 190, 203, 204, 205, 206'):
+            if bough.keep_tab(o, skiprules):
                 TotalTabsDictionary['TableLink'][o] = links
     
 
@@ -59,22 +151,46 @@ def aggr(xls):
     # =========================================================================
     for i, sheet_name in enumerate(xls.sheet_names[firstworksheet:lastworksheet]):
 
-        # =====================================================================
-        # each sheet = df
-        # returns two arrays: Banner and Letter representing each banner
-        # TODO what if there is no letter below the banner?
-        # TODO might be better to make a dict of arrays so each tab has 
-        # its own stat test ?
-        # =====================================================================
-        df = pd.read_excel(filename, sheet_name = sheet_name)
-        TotalTabsDictionary['Banner'], TotalTabsDictionary['BannerLetter'] = bough.rowaggregator(df, start)
-
         # =====================================================================
         # TableNumber - search for a number in the worksheet if it exists 
-        # then we consider it a table
+        # then we consider it a table. Skipped tabs are decided from the
+        # sheet name alone so they are never read. Kept tabs are parsed once,
+        # layout, pre-scan, banner and df all come from that one read
         # =====================================================================
         TableNumber = re.search(r"\d", sheet_name)
-        if TableNumber and bough.skip_tabs(sheet_name, 'T56, T113, T114, T126, T127, T158, T159, T187, T188, T189, T190, T203, T204, T205, T206'):
+        layout = None
+        if TableNumber and bough.keep_tab(sheet_name, skiprules):
+            if len(layoutcache) > maxlayouts:
+                layoutcache.clear()
+                bannercache.clear()
+            raw = pd.read_excel(xls, sheet_name = sheet_name, header = None)
+            rows = bough.sheet_rows(raw)
+            layout = bough.detect_layout(rows, layoutcache)
+
+        if layout is not None and classify_tab(rows, sheet_name, layout):
+
+            # =================================================================
+            # layout holds Excel rows, pandas uses row 1 as the header so
+            # df index = Excel row - 2
+            # =================================================================
+            bannerrow = layout['banner'] - 2
+            stubstart = layout['start']
+            stubend = layout['end']
+
+            # =================================================================
+            # Banner and Letter arrays come from the banner rows only, shared
+            # by every tab with the same header. Letters are '.' when the tab
+            # has no letter row
+            # TODO might be better to make a dict of arrays so each tab has 
+            # its own stat test ?
+            # =================================================================
+            banner = bough.read_banner(rows, layout, bannercache)
+            TotalTabsDictionary['Banner'] = banner['names']
+            TotalTabsDictionary['BannerLetter'] = banner['letters']
+            TotalTabsDictionary['BannerColumn'] = banner['columns']
+
+            # each sheet = df, same frame read_excel gives with row 1 as header
+            df = bough.sheet_frame(raw)
             
             # =================================================================
             # TableNumber - initialize, each table gets key, value
@@ -88,7 +204,7 @@ def aggr(xls):
             # Question - initialize, each Question gets key = table number, 
             # value = Question name 
             # =================================================================
-            title = sheetdf.loc[1][0]
+            title = sheetdf.loc[layout['title'] - 2].iloc[0]
             title = title.split(" ")[0]
             TotalTabsDictionary['Question'][str(TableNumber)] = title
         
@@ -96,7 +212,7 @@ def aggr(xls):
             # Grab first col, drop all NaN. To loop through stubs only 
             # TODO we might be able to simplify this
             # =================================================================
-            columnsheetdf = sheetdf['Unnamed: 0'].copy().dropna(how='all')
+            columnsheetdf = sheetdf[sheetdf.columns[0]].copy().dropna(how='all')
             totalrowcount = len(columnsheetdf.index)
             
             
@@ -110,22 +226,31 @@ def aggr(xls):
                 # pinpointing what row stub we want then appending to an array
                 # TotalTabsDictionary['Stub']['TableNumber'] = []
                 # =============================================================
-                if j > start - 1 and j < totalrowcount - end:
+                if j > stubstart - 1 and j < totalrowcount - stubend:
                     TotalTabsDictionary['Stub'][str(TableNumber)].append(row)
             
             # StubData initialize
             # create a dict in a dict that holds an array for each column of the tableset/bannerpoint
-            TotalTabsDictionary['StubData'][str(TableNumber)] = {}        
+            # built up locally and stored once finished, the store may be disk backed
+            stubdata = {}
             for bannerpoint in TotalTabsDictionary['Banner']:
-                TotalTabsDictionary['StubData'][str(TableNumber)][str(bannerpoint)] = []       
+                stubdata[str(bannerpoint)] = []
             
-            newdf = df.loc[start:][1:].copy()
-            newdf.set_index('Unnamed: 0', inplace= True)
+            newdf = df.loc[bannerrow:][1:].copy()
+            newdf.set_index(df.columns[0], inplace= True)
             newdf.dropna(inplace = True, how='all')
             
-            # rename the columns of the new dataframe 
-            for x in range(0, len(newdf.columns)):
-                newdf = newdf.rename(columns={f'Unnamed: {x + 1}': TotalTabsDictionary['Banner'][x]})
+            # =================================================================
+            # a data row wider than the banner leaves columns the banner read
+            # did not see, parse the banner from the full sheet instead
+            # =================================================================
+            if len(newdf.columns) != len(TotalTabsDictionary['Banner']):
+                TotalTabsDictionary['Banner'], TotalTabsDictionary['BannerLetter'] = bough.rowaggregator(df, bannerrow)
+                TotalTabsDictionary['BannerColumn'] = dict(zip(TotalTabsDictionary['BannerLetter'], TotalTabsDictionary['Banner']))
+
+            # rename the columns of the new dataframe, by position since the
+            # names pandas gives them depend on the sheet
+            newdf.columns = TotalTabsDictionary['Banner']
 
             for cols in newdf.columns:
                 # list comprehension 
@@ -171,14 +296,16 @@ def aggr(xls):
     #                         print("0 below: " + str(newdf[cols][bannerpoint]))
     #                         print("1 below: " + str(newdf[cols].shift(periods = -1)[bannerpoint]))
 
-                TotalTabsDictionary['StubData'][str(TableNumber)][str(cols)] = bannerpointdata
+                stubdata[str(cols)] = bannerpointdata
+
+            TotalTabsDictionary['StubData'][str(TableNumber)] = stubdata
             
             
             # RowStubData initialize
-            TotalTabsDictionary['RowStubData'][str(TableNumber)] = {}
+            rowstubdata = {}
             for j, rowineachtable in enumerate(columnsheetdf):
-                if j > start - 1 and j < totalrowcount - end:
-                    TotalTabsDictionary['RowStubData'][str(TableNumber)][str(rowineachtable)] = []
+                if j > stubstart - 1 and j < totalrowcount - stubend:
+                    rowstubdata[str(rowineachtable)] = []
         
             for  rows in (newdf.index):
                 if str(rows) != "nan" and str(rows) != 'Base' and str(rows) != 'Unweighted Base' and str(rows) != 'Mean':
@@ -187,14 +314,34 @@ def aggr(xls):
                             if str(newdf[cols].shift(-2)[rows]) != "nan":
                                 
                                 rowdatawithstats = str("{:.2%}".format(newdf[cols].shift(-1)[rows])) + " " + str((newdf[cols].shift(-2)[rows]) )
-                                TotalTabsDictionary['RowStubData'][str(TableNumber)][str(rows)].append(rowdatawithstats)
+                                rowstubdata[str(rows)].append(rowdatawithstats)
                             else:
     #                             print(type(rows))
     #                             print(rows)
     #                             print(TotalTabsDictionary['RowStubData'][str(TableNumber)])
-                                TotalTabsDictionary['RowStubData'][str(TableNumber)][str(rows)].append( "{:.2%}".format(newdf[cols].shift(-1)[rows]))                      
+                                rowstubdata[str(rows)].append( "{:.2%}".format(newdf[cols].shift(-1)[rows]))                      
                         else:
-                            TotalTabsDictionary['RowStubData'][str(TableNumber)][str(rows)].append(newdf[cols].shift(-1)[rows])
+                            rowstubdata[str(rows)].append(newdf[cols].shift(-1)[rows])
 
+            TotalTabsDictionary['RowStubData'][str(TableNumber)] = rowstubdata
 
 
+
+
+
+# =============================================================================
+# Same result as aggr, from tabs computed straight from the data instead of a
+# tab workbook (dimensions_tools.crosstab_totaltabs). Empties and refills
+# TotalTabsDictionary in place (the memory budget stays) so scraper/makeup
+# run on it unchanged. No skip rules here, the stubs passed to crosstab_ddf
+# already are the tables wanted
+# =============================================================================
+def aggr_tabs(tabs):
+    reset_totaltabs(maxmemory)
+    TotalTabsDictionary['Banner'] = tabs['Banner']
+    TotalTabsDictionary['BannerLetter'] = tabs['BannerLetter']
+    TotalTabsDictionary['BannerColumn'] = tabs['BannerColumn']
+
+    for key in ['Table', 'Question', 'Stub', 'StubData', 'RowStubData', 'TableLink']:
+        for table, value in tabs[key].items():
+            TotalTabsDictionary[key][table] = value
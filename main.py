@@ -1,59 +1,124 @@
+import os
+import sys
+import json
+import argparse
 import pandas as pd
+import aggron
 from aggron import *
 from scraper import *
 from style import *
+from styles import bough, spill
 
 from datetime import datetime
 # from aggron import TotalTabsDictionary
-# import os 
+# import os
 # dir_path = os.path.dirname(os.path.realpath(__file__))
 # print(dir_path)
 
-totaltabsdf = {}
-newcolumns = ['Table', 'Question', 'Stub']
 
 # =============================================================================
 # Grabbing the stat testing from the first table "T1". Adding to array stattest
 # =============================================================================
-statsdf = pd.read_excel(filename, sheet_name = 'T1')
-statsdf = statsdf.loc[4:].copy()
-stattest = []
-for statistics in statsdf['Unnamed: 0']:
-    
-    # =========================================================================
-    # Looking for the Stat test row
-    # =========================================================================
-    if str(statistics).find('Statistics:') != -1:
-        stattest = statistics.split(":")[3].split(",")[:-1]
+def get_stattest(xls):
+    statsdf = pd.read_excel(xls, sheet_name = 'T1')
+    statsdf = statsdf.loc[4:].copy()
+    stattest = []
+    for statistics in statsdf['Unnamed: 0']:
 
         # =====================================================================
-        # sometimes a programmer can enter ',' at the end of T_Banners and 
-        # sometimes they wont. This is a work around for both case
+        # Looking for the Stat test row
         # =====================================================================
-        if str(statistics.split(":")[3].split(",")[-1]).find('/') != -1:
-            lastitersplit = statistics.split(":")[3].split(",")[-1].split(" ")
-            for iter, space in enumerate(lastitersplit):
-                if space.find('/') != -1:
-                    stattest.append(lastitersplit[iter])
-        
+        if str(statistics).find('Statistics:') != -1:
+            stattest = statistics.split(":")[3].split(",")[:-1]
 
-def main():
+            # =================================================================
+            # sometimes a programmer can enter ',' at the end of T_Banners and
+            # sometimes they wont. This is a work around for both case
+            # =================================================================
+            if str(statistics.split(":")[3].split(",")[-1]).find('/') != -1:
+                lastitersplit = statistics.split(":")[3].split(",")[-1].split(" ")
+                for iter, space in enumerate(lastitersplit):
+                    if space.find('/') != -1:
+                        stattest.append(lastitersplit[iter])
 
-    # =========================================================================
-    # Runs Aggron file which aggregates data from all tabs
-    # =========================================================================
-    print('============ Starting Data Aggron File =================')
-    start_time_aggron = datetime.utcnow()
-    aggr(xls)
-    end_time_aggron     = datetime.utcnow()
-    elapsed_time_aggron = end_time_aggron - start_time_aggron
-    print("Elapsed Aggron time: " + str(elapsed_time_aggron))
-    print('============ Completed Data Aggron File =================\n')
+    return stattest
+
+
+# =============================================================================
+# Runs aggr -> scraper -> makeup for one workbook and returns a report with the
+# elapsed time of each stage. Safe to call repeatedly in the same process, the
+# aggregation dictionary and the output columns are reset on every call.
+# maxmemory (bytes or a size like '2G') caps the parsed tables aggr holds in
+# memory, anything past it is spilled to disk and read back by the scraper.
+# It only bounds the aggr stage: the scraper still builds the whole
+# TotalTabPlus sheet as one DataFrame and makeup loads the input workbook, so
+# the peak of a run is that sheet plus the workbook, whatever the budget.
+# skiprules replaces the default list of skipped tables, see
+# bough.compile_skip_rules. autoskip pre-scans every tab and skips the ones
+# that are not percentage tables, the report lists what was skipped and why.
+# =============================================================================
+def run_pipeline(inputfile, outputfile, maxmemory = None, skiprules = None, autoskip = False):
+    report = {}
+    report['input'] = inputfile
+    report['output'] = outputfile
+    report['started'] = datetime.utcnow().isoformat()
+
+    if maxmemory is not None:
+        maxmemory = spill.parse_size(maxmemory)
+    reset_totaltabs(maxmemory)
+    set_skip_rules(skiprules)
+    aggron.autoskip = autoskip
+
+    xls = pd.ExcelFile(inputfile)
+    try:
+        stattest = get_stattest(xls)
+
+        # =====================================================================
+        # Runs Aggron file which aggregates data from all tabs
+        # =====================================================================
+        print('============ Starting Data Aggron File =================')
+        start_time_aggron = datetime.utcnow()
+        aggr(xls)
+        end_time_aggron     = datetime.utcnow()
+        elapsed_time_aggron = end_time_aggron - start_time_aggron
+        print("Elapsed Aggron time: " + str(elapsed_time_aggron))
+        print('============ Completed Data Aggron File =================\n')
+
+        report['elapsed'] = {}
+        report['elapsed']['aggron'] = elapsed_time_aggron.total_seconds()
+        scrape_and_makeup(report, stattest, inputfile, outputfile)
+        if autoskip:
+            report['autoskipped'] = dict(autoskipped)
+
+        # spillstore is rebound on every reset, read it off the module
+        if aggron.spillstore is not None:
+            report['spilled_tables'] = aggron.spillstore.spilled
+
+    finally:
+        # =====================================================================
+        # Close the workbook and drop the spill file however the run ends, a
+        # failing stage must not leave a temp sqlite behind
+        # =====================================================================
+        xls.close()
+        if aggron.spillstore is not None:
+            reset_totaltabs()
+
+    return report
+
+
+# =============================================================================
+# The scraper and makeup stages, on whatever aggr or aggr_tabs left in
+# TotalTabsDictionary. inputfile None makes a new workbook. Fills in the
+# report's table/row counts and stage times
+# =============================================================================
+def scrape_and_makeup(report, stattest, inputfile, outputfile):
+    totaltabsdf = {}
+    newcolumns = ['Table', 'Question', 'Stub']
 
     # =========================================================================
     # Runs Scraper file which organizes data per powerpoint
     # =========================================================================
-    
+
     print('============ Startinng Scraping File =================')
     start_time_scraper = datetime.utcnow()
     totaltabsdfnew = scraper(totaltabsdf, newcolumns, stattest)
@@ -61,21 +126,147 @@ def main():
     elapsed_time_scraper = end_time_scraper - start_time_scraper
     print("Elapsed Scraper time: " + str(elapsed_time_scraper))
     print('============ Completed Scraping File =================\n')
-    
+
     # =========================================================================
     # Runs Styler file which does hyperlinks, openpyxl etc...
     # =========================================================================
 
     print('============ Starting Makeup File =================')
     start_time_makeup = datetime.utcnow()
-    makeup(totaltabsdfnew, newcolumns)
+    makeup(totaltabsdfnew, newcolumns, inputfile, outputfile)
     end_time_makeup     = datetime.utcnow()
     elapsed_time_makeup = end_time_makeup - start_time_makeup
     print("Elapsed Makeup time: " + str(elapsed_time_makeup))
     print('============ Completed Makeup File =================\n')
 
-    
-        
+    report['tables'] = len(TotalTabsDictionary['Table'])
+    report['rows'] = len(totaltabsdfnew.index)
+    report['elapsed']['scraper'] = elapsed_time_scraper.total_seconds()
+    report['elapsed']['makeup'] = elapsed_time_makeup.total_seconds()
+    report['elapsed']['total'] = sum(report['elapsed'].values())
+    return report
+
+
+# =============================================================================
+# dimensions_tools imports the other modules in styles/ as top level modules
+# (and win32com), so it is only loaded for a DDF run
+# =============================================================================
+def load_dimensions_tools():
+    stylesdir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'styles')
+    if stylesdir not in sys.path:
+        sys.path.insert(0, stylesdir)
+    import dimensions_tools
+    return dimensions_tools
+
+
+# =============================================================================
+# Table spec of a DDF run, a JSON file like
+#   {"stubs":  ["Q1", "Q2"],
+#    "banner": [{"name": "Total", "letter": "A"},
+#               {"name": "Male", "letter": "B", "var": "Gender", "cats": ["Male"]},
+#               {"name": "Female", "letter": "C", "var": "Gender", "cats": ["Female"]}],
+#    "groups": ["B/C"],
+#    "weight": "Weight",
+#    "language": "en-US"}
+# groups, weight and language are optional, see dimensions_tools.crosstab_ddf
+# =============================================================================
+def load_table_spec(path):
+    with open(path) as f:
+        spec = json.load(f)
+    for key in ['stubs', 'banner']:
+        if key not in spec:
+            raise ValueError(path + ' has no "' + key + '"')
+    return spec
+
+
+# =============================================================================
+# run_pipeline for a DDF/MDD pair instead of a tab workbook: the tables in
+# specfile are crosstabbed straight from the data, put in TotalTabsDictionary
+# by aggr_tabs, and scraper/makeup write them to a new workbook. The stat test
+# groups are the spec's groups, there is no T1 to read them from
+# =============================================================================
+def run_ddf_pipeline(ddffile, mddfile, specfile, outputfile, maxmemory = None):
+    report = {}
+    report['input'] = ddffile
+    report['mdd'] = mddfile
+    report['output'] = outputfile
+    report['started'] = datetime.utcnow().isoformat()
+
+    dimensions_tools = load_dimensions_tools()
+    spec = load_table_spec(specfile)
+    language = spec.get('language', 'en-us')
+
+    if maxmemory is not None:
+        maxmemory = spill.parse_size(maxmemory)
+    reset_totaltabs(maxmemory)
+
+    try:
+        # =====================================================================
+        # Crosstabs from the data, in place of the Aggron stage
+        # =====================================================================
+        print('============ Starting Crosstab =================')
+        start_time_crosstab = datetime.utcnow()
+        mdd_info = dimensions_tools.parse_mdd_cached(mddfile, languages = [language])
+        tables = dimensions_tools.crosstab_ddf(ddffile, mdd_info, spec['stubs'], spec['banner'],
+                                               weight = spec.get('weight'), groups = spec.get('groups'),
+                                               language = language)
+        tabs = dimensions_tools.crosstab_totaltabs(tables, spec['banner'], spec.get('groups'))
+        aggr_tabs(tabs)
+        end_time_crosstab     = datetime.utcnow()
+        elapsed_time_crosstab = end_time_crosstab - start_time_crosstab
+        print("Elapsed Crosstab time: " + str(elapsed_time_crosstab))
+        print('============ Completed Crosstab =================\n')
+
+        report['elapsed'] = {}
+        report['elapsed']['crosstab'] = elapsed_time_crosstab.total_seconds()
+        scrape_and_makeup(report, tabs['StatTest'], None, outputfile)
+
+        if aggron.spillstore is not None:
+            report['spilled_tables'] = aggron.spillstore.spilled
+
+    finally:
+        if aggron.spillstore is not None:
+            reset_totaltabs()
+
+    return report
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = 'Builds the TotalTabPlus sheet for an LRW tab workbook.')
+    parser.add_argument('input', nargs = '?', default = filename, help = 'tab workbook (default: ' + filename + ')')
+    parser.add_argument('--output', help = 'output workbook (default: <input>_TotalTabsPlus.xlsx)')
+    parser.add_argument('--max-memory', help = "memory budget for the parsed tables, e.g. '2G'. Tables past it are spilled to disk. The output sheet itself is still built in memory")
+    parser.add_argument('--skip', help = "tables to skip instead of the default list, e.g. 'T56, T187-T190, re:^T3'")
+    parser.add_argument('--skip-file', help = "file with more tables to skip, one or more rules per line, a 're:' rule runs to the end of its line")
+    parser.add_argument('--auto-skip', action = 'store_true', help = 'pre-scan every tab and skip numeric/duplicate-stub tables')
+    parser.add_argument('--ddf', help = 'crosstab this DDF instead of reading a tab workbook, needs --mdd and --tables')
+    parser.add_argument('--mdd', help = 'metadata of the --ddf file')
+    parser.add_argument('--tables', help = 'JSON spec of the stubs, banner and stat test groups of a --ddf run')
+    args = parser.parse_args(argv)
+
+    if args.ddf is not None or args.mdd is not None:
+        if args.ddf is None or args.mdd is None or args.tables is None:
+            parser.error('--ddf, --mdd and --tables go together')
+        outputfile = args.output
+        if outputfile is None:
+            outputfile = os.path.splitext(args.ddf)[0] + '_TotalTabsPlus' + '.xlsx'
+        run_ddf_pipeline(args.ddf, args.mdd, args.tables, outputfile, args.max_memory)
+        return
+
+    skiprules = None
+    if args.skip is not None or args.skip_file is not None:
+        skiprules = bough.split_skip_rules(args.skip if args.skip is not None else defaultskips)
+        if args.skip_file is not None:
+            skiprules.extend(bough.load_skip_rules(args.skip_file))
+
+    outputfile = args.output
+    if outputfile is None:
+        outputfile = os.path.splitext(args.input)[0] + '_TotalTabsPlus' + '.xlsx'
+
+    run_pipeline(args.input, outputfile, args.max_memory, skiprules, args.auto_skip)
+
+
+
 if __name__ == "__main__":
     start_time = datetime.utcnow()
     main()
@@ -24,17 +24,16 @@ def scraper(totaltabsdf, newcolumns, stattest):
                 totaltabsdf['TableLink'].append(TotalTabsDictionary['TableLink'][int(key)])
         # make sure to include invidual bases
         [totaltabsdf['Stub'].append(x) for x in TotalTabsDictionary['Stub'][key] if (str(x) != 'Base' and str(x) != 'Unweighted Base' and str(x) != 'Mean')]
+        stubdata = TotalTabsDictionary['StubData'][key]
         for bannerpoint in TotalTabsDictionary['Banner']:
-            [ totaltabsdf[bannerpoint].append(x) for x in TotalTabsDictionary['StubData'][key][bannerpoint] ]
+            [ totaltabsdf[bannerpoint].append(x) for x in stubdata[bannerpoint] ]
         
     # ================== Creating Banner point stuff =======================
         
-    colordict = {}
+    # stat letter -> banner point, built once per banner in aggr
+    colordict = TotalTabsDictionary['BannerColumn']
     bannerlettername = []
 
-    for p, bannerletter in enumerate(TotalTabsDictionary['BannerLetter']):
-        colordict[bannerletter] = TotalTabsDictionary['Banner'][p]
-
     
     for batch in stattest:
         Letter = batch.strip().split('/')
@@ -54,15 +53,16 @@ def scraper(totaltabsdf, newcolumns, stattest):
         totaltabsdf["Max Diff " + str(i)] = []
         
     
-    for table in TotalTabsDictionary['RowStubData']:
-        for stub in TotalTabsDictionary['RowStubData'][table]: 
-    #         minimum = TotalTabsDictionary['RowStubData'][table][stub][banner[0]][:-1]
+    # items() so a disk backed RowStubData is read back once per table
+    for table, rowstubdata in TotalTabsDictionary['RowStubData'].items():
+        for stub in rowstubdata: 
+    #         minimum = rowstubdata[stub][banner[0]][:-1]
             for x, banner in enumerate(bannerlettername):
                 
                 if str(stub) != 'Base' and str(stub) != 'Unweighted Base' and str(stub) != 'Mean':
                     x += 1
                     max_value = None
-                    cleancell = bough.thedeleter(str(TotalTabsDictionary['RowStubData'][table][stub][banner[0]].strip('%')))
+                    cleancell = bough.thedeleter(str(rowstubdata[stub][banner[0]].strip('%')))
                     if cleancell != '-' and cleancell != '*' and cleancell != '':
                         minimum = cleancell
                     else:
@@ -71,12 +71,12 @@ def scraper(totaltabsdf, newcolumns, stattest):
                     
                     for bannerpoint in banner:
 
-                        cleancell2 = bough.thedeleter(str(TotalTabsDictionary['RowStubData'][table][stub][bannerpoint]))
+                        cleancell2 = bough.thedeleter(str(rowstubdata[stub][bannerpoint]))
                         
                         
                         if cleancell2 != "-" and cleancell2 != "*" and cleancell2 != '':
                             
-                            cleancell3 = bough.thedeleter(TotalTabsDictionary['RowStubData'][table][stub][bannerpoint].strip("%"))
+                            cleancell3 = bough.thedeleter(rowstubdata[stub][bannerpoint].strip("%"))
                             ''' Maximum '''
                             if (max_value is None or float(cleancell3) > max_value):
                                 max_value = float(cleancell3)
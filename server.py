@@ -0,0 +1,192 @@
+import os
+import re
+import sys
+import json
+import hashlib
+import argparse
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from watcher import output_paths, process_job
+
+# =============================================================================
+# Local HTTP job service wrapping the pipeline. Binds to localhost only.
+#
+#   POST /jobs               body = the .xlsx workbook  -> {"job": id, ...}
+#   GET  /jobs/<id>          job status
+#   GET  /jobs/<id>/output   the TotalTabsPlus workbook
+#   GET  /jobs/<id>/report   run report with the per-stage timings
+#
+# The job id is the sha256 of the uploaded bytes, so uploading the same file
+# again returns the finished job straight from the cache in the work dir.
+#
+#   python server.py --port 8050 --workers 2 --max-queue 8
+#   curl --data-binary @datasets/LEGOExample.xlsx http://127.0.0.1:8050/jobs
+# =============================================================================
+
+xlsxtype = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
+# Job ids are sha256 hex digests; anything else never touches the work dir
+jobid_pattern = re.compile(r'[0-9a-f]{64}')
+
+
+class JobService:
+    """
+    Keeps track of the jobs and owns the worker pool. At most `workers` jobs
+    run at once and at most `max_queue` more wait behind them; anything past
+    that is refused so the caller can retry later.
+    """
+
+    def __init__(self, workdir, workers = 1, max_queue = 8):
+        self.workdir = workdir
+        self.workers = workers
+        self.max_queue = max_queue
+        self.jobs = {}
+        self.lock = threading.Lock()
+        self.pool = ProcessPoolExecutor(max_workers = workers)
+        os.makedirs(workdir, exist_ok = True)
+
+    def paths(self, jobid):
+        inputfile = os.path.join(self.workdir, jobid, 'input.xlsx')
+        outputfile, reportfile = output_paths(inputfile)
+        return inputfile, outputfile, reportfile
+
+    # =========================================================================
+    # The report on disk is the cache: a finished job survives a restart
+    # =========================================================================
+    def cached_report(self, jobid):
+        reportfile = self.paths(jobid)[2]
+        if not os.path.isfile(reportfile):
+            return None
+        with open(reportfile, 'r') as f:
+            return json.load(f)
+
+    def status(self, jobid):
+        with self.lock:
+            future = self.jobs.get(jobid)
+        if future is not None and not future.done():
+            return 'running' if future.running() else 'queued'
+
+        report = self.cached_report(jobid)
+        if report is None:
+            return None
+        return 'done' if report.get('status') == 'ok' else 'error'
+
+    # =========================================================================
+    # Returns (jobid, status). status is None when the queue is full
+    # =========================================================================
+    def submit(self, data):
+        jobid = hashlib.sha256(data).hexdigest()
+
+        with self.lock:
+            future = self.jobs.get(jobid)
+            if future is not None and not future.done():
+                return jobid, 'running' if future.running() else 'queued'
+
+            report = self.cached_report(jobid)
+            if report is not None and report.get('status') == 'ok':
+                return jobid, 'done'
+
+            active = len([f for f in self.jobs.values() if not f.done()])
+            if active >= self.workers + self.max_queue:
+                return jobid, None
+
+            inputfile = self.paths(jobid)[0]
+            os.makedirs(os.path.dirname(inputfile), exist_ok = True)
+            with open(inputfile, 'wb') as f:
+                f.write(data)
+
+            stat = os.stat(inputfile)
+            self.jobs[jobid] = self.pool.submit(process_job, inputfile, (stat.st_size, stat.st_mtime_ns))
+
+        return jobid, 'queued'
+
+    def shutdown(self):
+        self.pool.shutdown(wait = False, cancel_futures = True)
+
+
+class JobHandler(BaseHTTPRequestHandler):
+
+    service = None
+
+    def send_json(self, code, body):
+        data = json.dumps(body, indent = 4).encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def send_file(self, path, contenttype):
+        with open(path, 'rb') as f:
+            data = f.read()
+        self.send_response(200)
+        self.send_header('Content-Type', contenttype)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        if self.path.rstrip('/') != '/jobs':
+            return self.send_json(404, {'error': 'not found'})
+
+        length = int(self.headers.get('Content-Length') or 0)
+        if not length:
+            return self.send_json(400, {'error': 'empty upload, send the workbook as the request body'})
+
+        jobid, status = self.service.submit(self.rfile.read(length))
+        if status is None:
+            return self.send_json(503, {'error': 'job queue is full, try again later'})
+
+        self.send_json(200 if status == 'done' else 202, {'job': jobid, 'status': status})
+
+    def do_GET(self):
+        parts = [x for x in self.path.split('/') if x]
+        if len(parts) < 2 or parts[0] != 'jobs' or len(parts) > 3:
+            return self.send_json(404, {'error': 'not found'})
+
+        jobid = parts[1]
+        if not jobid_pattern.fullmatch(jobid):
+            return self.send_json(404, {'error': 'not found'})
+
+        status = self.service.status(jobid)
+        if status is None:
+            return self.send_json(404, {'error': 'unknown job ' + jobid})
+
+        if len(parts) == 2:
+            return self.send_json(200, {'job': jobid, 'status': status})
+
+        inputfile, outputfile, reportfile = self.service.paths(jobid)
+        if parts[2] == 'report' and status in ['done', 'error']:
+            return self.send_file(reportfile, 'application/json')
+        if parts[2] == 'output' and status == 'done':
+            return self.send_file(outputfile, xlsxtype)
+        if parts[2] in ['report', 'output']:
+            return self.send_json(409, {'job': jobid, 'status': status})
+
+        self.send_json(404, {'error': 'not found'})
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = 'Local HTTP service that runs TotalTabPlus on uploaded workbooks.')
+    parser.add_argument('--port', type = int, default = 8050)
+    parser.add_argument('--workdir', default = 'jobs', help = 'where uploads, outputs and reports are kept')
+    parser.add_argument('--workers', type = int, default = 1, help = 'workbooks processed at the same time')
+    parser.add_argument('--max-queue', type = int, default = 8, help = 'jobs allowed to wait for a worker')
+    args = parser.parse_args(argv)
+
+    JobHandler.service = JobService(args.workdir, args.workers, args.max_queue)
+    httpd = ThreadingHTTPServer(('127.0.0.1', args.port), JobHandler)
+    print('Serving on http://127.0.0.1:' + str(httpd.server_address[1]))
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        print('Stopped')
+    finally:
+        httpd.server_close()
+        JobHandler.service.shutdown()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
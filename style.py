@@ -1,18 +1,25 @@
 
 from scraper import *
-from openpyxl import load_workbook
+from openpyxl import Workbook, load_workbook
 from openpyxl.styles import Font
 from openpyxl.formatting.rule import ColorScaleRule
 from openpyxl.utils import get_column_letter
 
-def makeup(totaltabsdf, newcolumns):
+# inputfile None writes the TotalTabPlus sheet to a new workbook of its own,
+# for tables that did not come from a tab workbook (there are no T sheets to
+# link to then, so the TableLink column stays plain text)
+def makeup(totaltabsdf, newcolumns, inputfile = filename, outputfile = output):
 
     #======================  Styling and openpyxl ===============================
-    book = load_workbook(filename)
     finalsheetname = "TotalTabPlus"
-    book.create_sheet(finalsheetname,index = 2)
-
-    writer = pd.ExcelWriter(output, engine='openpyxl') 
+    if inputfile is None:
+        book = Workbook()
+        book.active.title = finalsheetname
+    else:
+        book = load_workbook(inputfile)
+        book.create_sheet(finalsheetname,index = 2)
+
+    writer = pd.ExcelWriter(outputfile, engine='openpyxl') 
     writer.book = book
     writer.sheets = dict((ws.title, ws) for ws in book.worksheets)
 
@@ -39,16 +46,25 @@ def makeup(totaltabsdf, newcolumns):
                                     end_type='percentile', end_value=100, end_color='00aa00')
                                     )
         
-    for x, col in enumerate(totaltabsdf):    
-        #Font colorized all the cells with data and not max diff. 
-        if col != 'Table' and col != 'Question' and col != 'Stub' and col != 'TableLink' and col.find('Max Diff') == -1:
-            for y, rowdata in enumerate(totaltabsdf[col]):
-                ws[get_column_letter(x + 2) + str(y + 2)].font = Font( color = bough.color_font(str(rowdata))) 
+    #Font colorized all the cells with data and not max diff. Black where
+    # the cell has stat letters, grey otherwise (see bough.color_font). The
+    # masks are worked out per column and two fonts are shared by all cells
+    datacolumns = [col for col in totaltabsdf if col != 'Table' and col != 'Question' and col != 'Stub' and col != 'TableLink' and str(col).find('Max Diff') == -1]
+    masks = bough.letter_masks(totaltabsdf, datacolumns)
+    lettersfont = Font(color = '000000')
+    nolettersfont = Font(color = '808080')
+    for x, col in enumerate(totaltabsdf):
+        if col in masks:
+            for y, hasletters in enumerate(masks[col]):
+                ws.cell(row = y + 2, column = x + 2).font = lettersfont if hasletters else nolettersfont
 
 
 
 
     # ============== Creating hyper links for the "Table Link" Column ========================
+    if inputfile is None:
+        writer.save()
+        return
 
     rownumber = len(newcolumns)
 
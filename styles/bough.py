@@ -1,6 +1,13 @@
 
+import re
+import hashlib
+from bisect import bisect_right
 from typing import List
 
+import numpy as np
+import pandas as pd
+from pandas.io.parsers import TextParser
+
 
 #question: when i -> [] i get an a weird Use List[T] to indicate a list type or Union[T1, T2] to indicate a union type error. but it still runs and works properly
 # not sure what the difference is 
@@ -10,10 +17,11 @@ def rowaggregator(df, start) -> List:
     row = df.loc[start:start+1].copy()
 
     row.dropna(inplace = True, how = 'all')
-    row.drop(['Unnamed: 0'], axis = 1, inplace = True)
+    row.drop([row.columns[0]], axis = 1, inplace = True)
     for x in row.columns:
         banner = row[x][start]
-        stattest = row[x][start+1]
+        # no letter row when stat testing is off, dropna took it out
+        stattest = row[x][start+1] if start+1 in row.index else float('nan')
         rowarray.append(banner)
         if str(stattest) == 'nan':
             rowarraystat.append(".")
@@ -34,18 +42,35 @@ def thedeleter(string):
     return string
 
 
+# any stat letter or marker, "abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ+~-*"
+letterpattern = re.compile(r'[A-Za-z+~*-]')
+
+
 def letterfinder(sting):
-    sting = str(sting)
-    greenred = False
-    letterstring = "abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ+~-*" 
-    for x in letterstring:
-        #exists 
-        if sting.find(x) != -1:
-            greenred = True
-            break
-        else:
-            greenred = False
-    return greenred
+    return letterpattern.search(str(sting)) is not None
+
+
+def letter_mask(values):
+    """
+    letterfinder for a whole column at once, returns a numpy bool array.
+    values is a Series or anything pandas can make one from
+    """
+    values = pd.Series(values, dtype = object)
+    if values.empty:
+        return np.zeros(0, dtype = bool)
+    return values.astype(str).str.contains(letterpattern, regex = True).to_numpy(dtype = bool)
+
+
+def letter_masks(df, columns = None):
+    """
+    letter_mask for each column in columns (default all), keyed by column
+    """
+    if columns is None:
+        columns = df.columns
+    masks = {}
+    for col in columns:
+        masks[col] = letter_mask(df[col])
+    return masks
 
 def color_positive_green(sting):
     """
@@ -85,4 +110,397 @@ def skip_tabs(tab ,tabdelim):
         else:
             continue
     
-    return True 
\ No newline at end of file
+    return True 
+
+
+def split_skip_rules(text):
+    """
+    Splits a comma separated skip list into rules. A 're:' rule takes the rest
+    of the text, commas included, so 'T56, T187-T190, re:^T2[0-9]{2,3}$' is
+    three rules; put regex rules last or on their own line.
+    """
+    head, marker, regex = text.partition('re:')
+    rules = [x.strip() for x in head.split(',') if x.strip() != '']
+    if marker:
+        rules.append(marker + regex.strip())
+    return rules
+
+
+def compile_skip_rules(rules):
+    """
+    Compiles a skip list once so every check after that is a set lookup.
+    rules is a comma separated string (see split_skip_rules) or a list of
+    strings, each one being
+        T56 or 56           - a single table
+        T187-T190           - an inclusive range of tables
+        re:^T2[0-9]{2}$     - a regex searched in the sheet name
+    Tables are matched on their number, so 'T56' also skips index entry 56.
+    Raises ValueError on a rule that is none of these.
+    """
+    if isinstance(rules, str):
+        rules = split_skip_rules(rules)
+
+    numbers = set()
+    ranges = []
+    patterns = []
+    for rule in rules:
+        rule = str(rule).strip()
+        if rule == '':
+            continue
+
+        if rule.startswith('re:'):
+            try:
+                patterns.append(re.compile(rule[3:].strip()))
+            except re.error as e:
+                raise ValueError('bad skip rule ' + repr(rule) + ': ' + str(e))
+            continue
+
+        bounds = re.fullmatch(r'[A-Za-z]*\s*(\d+)\s*-\s*[A-Za-z]*\s*(\d+)', rule)
+        single = re.fullmatch(r'[A-Za-z]*\s*(\d+)', rule)
+        if bounds:
+            low, high = sorted([int(bounds.group(1)), int(bounds.group(2))])
+            ranges.append([low, high])
+        elif single:
+            numbers.add(int(single.group(1)))
+        else:
+            raise ValueError('bad skip rule ' + repr(rule) + ', expected T56, T187-T190 or re:<pattern>')
+
+    # =========================================================================
+    # merge overlapping ranges so a lookup is one bisect
+    # =========================================================================
+    merged = []
+    for low, high in sorted(ranges):
+        if merged and low <= merged[-1][1] + 1:
+            merged[-1][1] = max(merged[-1][1], high)
+        else:
+            merged.append([low, high])
+
+    compiled = {}
+    compiled['numbers'] = numbers
+    compiled['starts'] = [x[0] for x in merged]
+    compiled['ends'] = [x[1] for x in merged]
+    compiled['patterns'] = patterns
+    return compiled
+
+
+def load_skip_rules(path):
+    """
+    Reads skip rules from a text file, one or more per line as in
+    split_skip_rules. '#' starts a comment outside a regex rule, a 're:' rule
+    runs to the end of its line untouched
+    """
+    rules = []
+    with open(path, 'r') as f:
+        for line in f:
+            head, marker, regex = line.partition('re:')
+            head, comment, _ = head.partition('#')
+            if comment:
+                marker, regex = '', ''
+            rules.extend(split_skip_rules(head + marker + regex))
+    return rules
+
+
+def keep_tab(tab, compiled):
+    """
+    Same answer as skip_tabs (True = keep the tab) against compiled rules.
+    tab is a table number or a sheet name like 'T56'
+    """
+    tab = str(tab).strip()
+    number = re.search(r'\d+', tab)
+    if number:
+        number = int(number.group())
+        if number in compiled['numbers']:
+            return False
+        i = bisect_right(compiled['starts'], number) - 1
+        if i >= 0 and number <= compiled['ends'][i]:
+            return False
+
+    for pattern in compiled['patterns']:
+        if pattern.search(tab):
+            return False
+
+    return True
+
+
+def sheet_rows(raw):
+    """
+    Rows of a tab read with read_excel(header = None) as tuples, None for
+    blank cells. rows[r - 1] is Excel row r
+    """
+    return [tuple(row) for row in raw.astype(object).where(raw.notna(), None).values.tolist()]
+
+
+def sheet_frame(raw):
+    """
+    The dataframe read_excel gives for the same tab with row 1 as the header,
+    built from raw so the sheet is only parsed once
+    """
+    if raw.empty:
+        return pd.DataFrame()
+    return TextParser(raw.astype(object).where(raw.notna(), '').values.tolist(), header = 0).read()
+
+
+def classify_sheet(rows, start, end, samples = 5):
+    """
+    Pre-scan of one tab from its rows (see sheet_rows) that looks at the stub
+    column and a few data rows only.
+    Returns (kind, reason) where kind is
+        'percentage' - regular tab, every stub has a percentage row under it
+        'numeric'    - a stub is followed directly by another stub, or the
+                       row under a stub holds values above 100%
+        'duplicate'  - the same stub appears twice
+        'layout'     - a stub sits inside the rows the start offset drops
+    Only 'percentage' tabs work with the shift logic in aggr.
+    start/end are aggr's offsets into the non-blank stub column.
+    """
+    # =========================================================================
+    # Column A only. Row 1 is the header pandas eats, so positions line up
+    # with the non-blank entries aggr counts
+    # =========================================================================
+    stubcells = []
+    for rownumber, row in enumerate(rows[1:], 2):
+        if row and row[0] is not None and str(row[0]).strip() != '':
+            stubcells.append((rownumber, row[0]))
+
+    filled = set(x[0] for x in stubcells)
+
+    # =========================================================================
+    # Below the banner and letter rows only bases belong to the offset
+    # =========================================================================
+    for rownumber, stub in stubcells[:start]:
+        if rownumber > start + 3 and str(stub) not in ['Base', 'Unweighted Base']:
+            return 'layout', 'stub "' + str(stub) + '" is cut off by the start offset'
+
+    stubcells = stubcells[start:len(stubcells) - end]
+
+    stubs = []
+    seen = set()
+    for rownumber, stub in stubcells:
+        if str(stub) in ['Base', 'Unweighted Base', 'Mean']:
+            continue
+        if str(stub) in seen:
+            return 'duplicate', 'stub "' + str(stub) + '" appears more than once'
+        seen.add(str(stub))
+
+        # =====================================================================
+        # the percentage sits on the next row with nothing in column A
+        # =====================================================================
+        if rownumber + 1 in filled:
+            return 'numeric', 'stub "' + str(stub) + '" has no percentage row'
+        stubs.append(rownumber)
+
+    if not stubs:
+        return 'numeric', 'no stubs found'
+
+    # =========================================================================
+    # Percentage rows of the first few stubs
+    # =========================================================================
+    for rownumber in [x + 1 for x in stubs[:samples]]:
+        if rownumber > len(rows):
+            continue
+        values = [x for x in rows[rownumber - 1][1:] if x is not None and str(x).strip() != '']
+        if not values:
+            return 'numeric', 'row ' + str(rownumber) + ' under a stub is empty, values are not percentages'
+        for value in values:
+            if isinstance(value, (int, float)) and not isinstance(value, bool) and value > 1:
+                return 'numeric', 'row ' + str(rownumber) + ' holds ' + str(value) + ', not a percentage'
+
+    return 'percentage', ''
+
+
+# Stub rows that are bases, not answers. aggr counts leading ones as header
+basestubs = ['Base', 'Unweighted Base', 'Effective Base']
+
+
+def is_data_row(row):
+    """
+    True for a row with a stub in column A and a value next to it (empty
+    tables hold '-' instead of numbers). Title lines only fill column A
+    """
+    if not row or row[0] is None or str(row[0]).strip() == '':
+        return False
+    return any(x is not None and str(x).strip() != '' for x in row[1:])
+
+
+def is_letter_row(row):
+    """
+    True for the stat letter row under a banner, column A blank and every
+    other filled cell a one or two letter column id
+    """
+    if row[0] is not None and str(row[0]).strip() != '':
+        return False
+    values = [str(x).strip() for x in row[1:] if x is not None and str(x).strip() != '']
+    return len(values) > 0 and all(re.fullmatch(r'[A-Za-z]{1,2}', x) for x in values)
+
+
+def header_fingerprint(rows):
+    """
+    Hash of the header block. Column A only counts as filled or not (titles
+    and table numbers differ per tab), banner cells are hashed as they are
+    """
+    shape = []
+    for row in rows:
+        filled = row[0] is not None and str(row[0]).strip() != ''
+        shape.append((filled, tuple(row[1:])))
+    return hashlib.sha1(repr(shape).encode('utf-8')).hexdigest()
+
+
+def read_header(rows):
+    """
+    Finds the title, banner and letter rows (Excel row numbers) in the header
+    block and counts the column A entries it holds
+    """
+    header = {}
+    header['letters'] = None
+    header['banner'] = None
+    for rownumber in range(len(rows), 0, -1):
+        if is_letter_row(rows[rownumber - 1]):
+            header['letters'] = rownumber
+            header['banner'] = rownumber - 1
+            break
+
+    # =========================================================================
+    # No letter row (stat testing off): the banner is the last row with
+    # anything next to column A
+    # =========================================================================
+    if header['banner'] is None:
+        for rownumber in range(len(rows), 0, -1):
+            if any(x is not None and str(x).strip() != '' for x in rows[rownumber - 1][1:]):
+                header['banner'] = rownumber
+                break
+
+    # =========================================================================
+    # Column A holds the project line first and the question title second
+    # =========================================================================
+    lines = [i + 1 for i, row in enumerate(rows) if row[0] is not None and str(row[0]).strip() != '']
+    header['title'] = lines[1] if len(lines) > 1 else (lines[0] if lines else None)
+    header['stubs'] = len(lines)
+    return header
+
+
+def detect_layout(rows, cache = None):
+    """
+    One pass over the rows of a tab (see sheet_rows) that finds
+        title   - Excel row of the question title
+        banner  - Excel row of the banner point names
+        letters - Excel row of the stat letters, None if there is none
+        first   - Excel row of the first stub that is not a base
+        footer  - Excel row where the Statistics/Table footer starts
+        start   - column A entries (non-blank) before the first stub
+        end     - column A entries from the footer on
+    start/end are the offsets aggr uses. Tabs whose header block hashes the
+    same share one entry in cache, so read_header runs once per distinct
+    header. The rows still have to be read in full to find the stubs and the
+    footer, the cache saves analysis, not I/O.
+    """
+    headerrows = []
+    header = None
+    layout = {}
+    layout['first'] = None
+    layout['footer'] = None
+    layout['end'] = 0
+    leading = 0
+    for rownumber, row in enumerate(rows, 1):
+        if not row:
+            row = (None,)
+        if header is None:
+            if not is_data_row(row):
+                headerrows.append(row)
+                continue
+
+            # =================================================================
+            # First row with data, everything above it is the header
+            # =================================================================
+            fingerprint = header_fingerprint(headerrows)
+            if cache is not None and fingerprint in cache:
+                header = cache[fingerprint]
+            else:
+                header = read_header(headerrows)
+                if cache is not None:
+                    cache[fingerprint] = header
+            layout['fingerprint'] = fingerprint
+
+        stub = row[0]
+        if stub is None or str(stub).strip() == '':
+            continue
+
+        if layout['footer'] is None and (str(stub).startswith('Statistics:') or re.fullmatch(r'Table \d+', str(stub).strip())):
+            layout['footer'] = rownumber
+        if layout['footer'] is not None:
+            layout['end'] += 1
+        elif layout['first'] is None:
+            if str(stub).strip() in basestubs:
+                leading += 1
+            else:
+                layout['first'] = rownumber
+
+    if header is None:
+        header = read_header(headerrows)
+        layout['fingerprint'] = None
+
+    layout['title'] = header['title']
+    layout['banner'] = header['banner']
+    layout['letters'] = header['letters']
+    layout['start'] = header['stubs'] + leading
+    return layout
+
+
+# one NaN object so interned banners with blank cells compare equal
+nan = float('nan')
+
+
+def read_banner(rows, layout, cache = None):
+    """
+    Banner names and stat letters of a tab, same values as rowaggregator but
+    taken from the banner and letter rows of its rows (see sheet_rows).
+    Returns a dict with
+        names   - banner point per column, NaN where the cell is blank
+        letters - stat letter per column, '.' where there is none
+        columns - stat letter -> banner point
+    Banners are interned: every tab with the same header fingerprint gets the
+    same dict, and so does every tab with the same names and letters, so keep
+    them read only. That saves memory and rebuilding the lists, the rows are
+    read by aggr either way.
+    """
+    key = layout['fingerprint']
+    if cache is not None and key is not None and key in cache:
+        return cache[key]
+
+    last = layout['letters'] if layout['letters'] is not None else layout['banner']
+    rows = [list(row) for row in rows[layout['banner'] - 1:last]]
+
+    # =========================================================================
+    # pandas reads '' as NaN and drops trailing empty cells, do the same so
+    # the column count matches the sheet dataframe
+    # =========================================================================
+    for row in rows:
+        for i, x in enumerate(row):
+            if x == '':
+                row[i] = None
+        while row and row[-1] is None:
+            row.pop()
+    width = max([len(row) for row in rows] + [1])
+    rows = [row + [None] * (width - len(row)) for row in rows]
+
+    names = [nan if x is None else x for x in rows[0][1:]]
+    if len(rows) > 1:
+        letters = ['.' if x is None else x for x in rows[-1][1:]]
+    else:
+        letters = ['.'] * len(names)
+
+    internkey = ('banner', tuple(names), tuple(letters))
+    if cache is not None and internkey in cache:
+        banner = cache[internkey]
+    else:
+        banner = {}
+        banner['names'] = names
+        banner['letters'] = letters
+        banner['columns'] = {}
+        for p, letter in enumerate(letters):
+            banner['columns'][letter] = names[p]
+        if cache is not None:
+            cache[internkey] = banner
+
+    if cache is not None and key is not None:
+        cache[key] = banner
+    return banner
@@ -1,14 +1,22 @@
 
+import os
 import re
-from datetime import datetime
+import time
+import zlib
+import tempfile
+from datetime import datetime, date
+from functools import lru_cache
+from statistics import NormalDist
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 import pandas as pd
 import networkx as nx
+from scipy import sparse
 from text_tools import *
 from io_tools import *
 from tableauhyperapi import HyperProcess, Telemetry, \
     Connection, CreateMode, \
-    NOT_NULLABLE, NULLABLE, SqlType, TableDefinition, \
+    NOT_NULLABLE, NULLABLE, SqlType, TableDefinition, TableName, \
     Inserter, \
     escape_name, escape_string_literal, \
     HyperException
@@ -180,161 +188,151 @@ def matrix_from_dict(input_dict):
 
 
 # ------------------------------------------------------------------------------
-# Takes any number of inputs and arranges them in a single matrix
-# Return product will be a list of lists of primitives, no matter what is
-# given as the input - any cell contents of complex type will be stringified
+# matrixify's clean-up of a single cell and a single row. Any cell contents of
+# complex type are stringified, any row that isn't a list becomes one
 # ------------------------------------------------------------------------------
-def matrixify(inputs, gutter=0, vertical=False):
+def matrixify_cell(cell):
+    if type(cell) is list or type(cell) is tuple:
+        return ",".join(str(cell))
+    elif type(cell) is float or type(cell) is int or type(cell) is str:
+        return cell
+    else:
+        return str(cell)
+
+def matrixify_row(row):
+    if type(row) is list or type(row) is tuple:
+        return [matrixify_cell(cell) for cell in row]
+    elif type(row) is dict:
+        return [matrixify_cell(cell) for cell in listify_dict(row)]
+    else:
+        return [matrixify_cell(row)]
+
+# ------------------------------------------------------------------------------
+# Width a row will have once matrixify_row has cleaned it, without cleaning it
+# ------------------------------------------------------------------------------
+def matrixify_row_width(row):
+    if type(row) is list or type(row) is tuple:
+        return len(row)
+    elif type(row) is dict:
+        return 2 * len(row)
+    else:
+        return 1
+
+# ------------------------------------------------------------------------------
+# Sizes up the inputs for matrixify without copying them: each input as a list
+# of raw rows, plus the height and width of the final matrix
+# ------------------------------------------------------------------------------
+def matrixify_layout(inputs, gutter=0, vertical=False):
     # --------------------------------------------------------------------------
-    # Identify the type of each input and listify it if it isn't
+    # Identify the type of each input and listify it if it isn't. Lists and
+    # tuples are used as they are, their rows get cleaned on the way out
     # --------------------------------------------------------------------------
-    pass1 = []
+    sources = []
     for item in inputs:
-        if type(item) is list:
-            pass1.append(item)
-        elif type(item) is tuple:
-            pass1.append(list(x for x in item))
+        if type(item) is list or type(item) is tuple:
+            sources.append(item)
         elif type(item) is dict:
-            pass1.append(matrix_from_dict(item))
+            sources.append(matrix_from_dict(item))
         else:
-            pass1.append([[item]])
-
-    # --------------------------------------------------------------------------
-    # We now know that each input is a list, so we need to check that each
-    # item in each of those lists is itself a list.
-    # --------------------------------------------------------------------------
-    pass2 = []
-    for matrix in pass1:
-        clean_matrix = []
-        for row in matrix:
-            if type(row) is list:
-                clean_matrix.append(row)
-            elif type(row) is tuple:
-                clean_matrix.append(list(x for x in row))
-            elif type(row) is dict:
-                clean_matrix.append(listify_dict(row))
-            else:
-                clean_matrix.append([row])
-        pass2.append(clean_matrix)
-
-    # --------------------------------------------------------------------------
-    # Finally, make sure that all the interior 'cells' are primitives
-    # --------------------------------------------------------------------------
-    matrices = []
-    for matrix in pass2:
-        clean_matrix = []
-        for row in matrix:
-            clean_line = []
-            for cell in row:
-                if type(cell) is list or type(cell) is tuple:
-                    clean_line.append(",".join(str(cell)))
-                elif type(cell) is float or type(cell) is int or type(cell) is str:
-                    clean_line.append(cell)
-                else:
-                    clean_line.append(str(cell))
-            clean_matrix.append(clean_line)
-        matrices.append(clean_matrix)
+            sources.append([[item]])
+
+    layout = {}
+    layout['sources'] = sources
+    gutters = gutter * (len(sources) - 1) if sources else 0
 
-    # --------------------------------------------------------------------------
-    # At this point they are all matrices...
-    # Presuming we want to stack these on top of each other
-    # --------------------------------------------------------------------------
     if not vertical:
         # ----------------------------------------------------------------------
-        # Figure out the widest row of any of them
+        # Widest row of any of them. Empty ones still take up a blank line
         # ----------------------------------------------------------------------
-        width = 0
-        for matrix in matrices:
-            # ------------------------------------------------------------------
-            # Maybe it's just empty
-            # ------------------------------------------------------------------
-            if not matrix:
-                continue
-    
-            # ------------------------------------------------------------------
-            # check each internal row
-            # ------------------------------------------------------------------
-            for row in matrix:
-                if len(row) > width:
-                    width = len(row)
-    
+        layout['width'] = max([matrixify_row_width(row) for matrix in sources for row in matrix] + [0])
+        layout['height'] = sum(max(len(matrix), 1) for matrix in sources) + gutters
+    else:
         # ----------------------------------------------------------------------
-        # Go through each matrix line by line and write it into a final version
+        # Tallest of any of them. Missing rows are blank-filled to the width
+        # of the input's first row, but rows are not padded, so the widest
+        # final row decides the width when the inputs are ragged
         # ----------------------------------------------------------------------
-        final_matrix = []
-        for i, matrix in enumerate(matrices):
-            # ------------------------------------------------------------------
-            # Maybe it's empty, so we want to make it a blank line
-            # ------------------------------------------------------------------
+        widths = [matrixify_row_width(matrix[0]) if matrix else 0 for matrix in sources]
+        height = max([len(matrix) for matrix in sources] + [0])
+        width = 0
+        for j in range(height):
+            row_width = gutters
+            for i, matrix in enumerate(sources):
+                row_width += matrixify_row_width(matrix[j]) if j < len(matrix) else widths[i]
+            width = max(width, row_width)
+        layout['widths'] = widths
+        layout['height'] = height
+        layout['width'] = width
+
+    return layout
+
+# ------------------------------------------------------------------------------
+# Streaming version of matrixify: yields the rows of the final matrix one at a
+# time, each one a new list, so nothing but the current row is built up
+# ------------------------------------------------------------------------------
+def matrixify_rows(inputs, gutter=0, vertical=False, layout=None):
+    if layout is None:
+        layout = matrixify_layout(inputs, gutter, vertical)
+    sources = layout['sources']
+
+    # --------------------------------------------------------------------------
+    # Stacking on top of each other, each row filled out with empty cells to
+    # the common width, empty inputs become a blank line
+    # --------------------------------------------------------------------------
+    if not vertical:
+        width = layout['width']
+        for i, matrix in enumerate(sources):
             if not matrix:
-                final_matrix.append([""]*width)
-    
-            # ------------------------------------------------------------------
-            # Each row of the matrix, filled out with empty cells for however 
-            # much to make it the common 'width'
-            # ------------------------------------------------------------------
+                yield [""]*width
+
             for row in matrix:
-                filler = list([""]*(width-len(row)))
-                final_row = row + filler
-                final_matrix.append(final_row)
-    
+                final_row = matrixify_row(row)
+                final_row.extend([""]*(width-len(final_row)))
+                yield final_row
+
             # ------------------------------------------------------------------
             # Gutter between matrices if necessary
             # ------------------------------------------------------------------
-            if gutter and i < len(matrices)-1:
+            if gutter and i < len(sources)-1:
                 for j in range(gutter):
-                    final_matrix.append([""]*width)
+                    yield [""]*width
 
     # --------------------------------------------------------------------------
-    # Alternatively, if it is a vertical merge, we want to do the same thing
-    # but sideways-to-slideways instead of upways-to-downways
+    # Alternatively, side by side: row j is row j of every input tacked
+    # together, with blank cells for inputs that are not that tall
     # --------------------------------------------------------------------------
     else:
-        # ----------------------------------------------------------------------
-        # Figure out the tallest column of any of them
-        # ----------------------------------------------------------------------
-        height = 0
-        for matrix in matrices:
-            if len(matrix) > height:
-                height = len(matrix)
-
-        # ----------------------------------------------------------------------
-        # Go through each matrix
-        # ----------------------------------------------------------------------
-        for i, matrix in enumerate(matrices):
-            # ------------------------------------------------------------------
-            # we need to blank-fill the thing to match the tallest one
-            # ------------------------------------------------------------------
-            if matrix:
-                width  = len(matrix[0])
-            else:
-                width  = 0
-            filler = list([""]*width)
-            for j in range(len(matrix),height):
-                matrix.append(filler)
-
-            # ------------------------------------------------------------------
-            # Make the gutter with the specified number of cells wide by the
-            # height that we got before
-            # ------------------------------------------------------------------
-            gutter_row = list([""] * gutter)
-            gutter_matrix = list([gutter_row] * height)
+        widths = layout['widths']
+        for j in range(layout['height']):
+            final_row = []
+            for i, matrix in enumerate(sources):
+                if gutter and i > 0:
+                    final_row.extend([""]*gutter)
+                if j < len(matrix):
+                    final_row.extend(matrixify_row(matrix[j]))
+                else:
+                    final_row.extend([""]*widths[i])
+            yield final_row
 
-            # ------------------------------------------------------------------
-            # Now, positionally:
-            # - first matrix becomes the basis for the rest
-            # - any others are tacked on line-by-line
-            # ------------------------------------------------------------------
-            if i==0:
-                final_matrix = matrix
-            else:
-                if gutter:
-                    final_matrix = list(map(list.__add__, final_matrix, gutter_matrix))
-                final_matrix = list(map(list.__add__, final_matrix, matrix))
+# ------------------------------------------------------------------------------
+# Takes any number of inputs and arranges them in a single matrix
+# Return product will be a list of lists of primitives, no matter what is
+# given as the input - any cell contents of complex type will be stringified
+# With as_array the matrix comes back as a 2-D numpy object array instead,
+# allocated once at its final size and filled in row by row
+# ------------------------------------------------------------------------------
+def matrixify(inputs, gutter=0, vertical=False, as_array=False):
+    layout = matrixify_layout(inputs, gutter, vertical)
+    rows = matrixify_rows(inputs, gutter, vertical, layout)
+    if not as_array:
+        return list(rows)
 
     # --------------------------------------------------------------------------
-    # Finish
+    # Rows of a vertical merge can be ragged, the array is blank-filled
     # --------------------------------------------------------------------------
+    final_matrix = np.full((layout['height'], layout['width']), "", dtype=object)
+    for i, row in enumerate(rows):
+        final_matrix[i, :len(row)] = row
     return final_matrix
 
 # ------------------------------------------------------------------------------
@@ -352,18 +350,32 @@ def chunkify_matrix(matrix, key_lbl=None):
     # --------------------------------------------------------------------------
     if isinstance(matrix, pd.DataFrame):
         # ----------------------------------------------------------------------
-        # Data frame gets changed to one where 'nan' becomes 'None' so we can
-        # read them simply and consistently in the output...
+        # Data frames are chunked by chunkify_frame, then each chunk changed
+        # to tuples where 'nan' becomes 'None' so we can read them simply and
+        # consistently in the output...
+        # ----------------------------------------------------------------------
+        # The frame is changed once and each chunk is a slice of the rows
         # ----------------------------------------------------------------------
-        clean_df = matrix.where((pd.notnull(matrix)), None)
-        matrix_to_read = [tuple(x) for x in clean_df.values]
+        df, keys, starts, stops = chunk_bounds(matrix, key_lbl)
+        clean_df = df.astype(object).where(df.notna(), None)
+        rows = [tuple(x) for x in clean_df.values]
+        chunks = {}
+        if key_lbl:
+            for chunk_idx, (start, stop) in enumerate(zip(starts, stops), 1):
+                chunks[chunk_idx] = rows[start:stop]
+        else:
+            for key, start, stop in zip(keys, starts, stops):
+                chunks[key] = [row[1:] for row in rows[start:stop]]
+        return chunks
     elif isinstance(matrix, list):
-        if isinstance(matrix[0], [list,tuple]):
+        if matrix and isinstance(matrix[0], (list,tuple)):
             matrix_to_read = matrix
         else:
             print("WARNING! Malformed matrix being fed into chunkify function!")
+            return {}
     else:
         print("WARNING! Malformed matrix being fed into chunkify function!")
+        return {}
 
     # --------------------------------------------------------------------------
     # Now go through each row
@@ -428,6 +440,58 @@ def chunkify_matrix(matrix, key_lbl=None):
     # --------------------------------------------------------------------------
     return chunks
 
+# ------------------------------------------------------------------------------
+# Where the chunks of a data frame start and stop, found with whole-column
+# operations. Returns the frame with the completely blank rows taken out, the
+# first-column key of each chunk and the row positions (in that frame) each
+# chunk runs over, so every chunk is a contiguous row range
+# ------------------------------------------------------------------------------
+def chunk_bounds(df, key_lbl=None):
+    filled = df.notna().any(axis=1).to_numpy()
+    if not filled.all():
+        df = df[filled]
+
+    first = df.iloc[:, 0]
+    if key_lbl:
+        breaks = (first == key_lbl).to_numpy()
+    else:
+        breaks = (first.notna() & first.astype(bool)).to_numpy()
+
+    # --------------------------------------------------------------------------
+    # Each break runs until the next one, or the end of the frame
+    # --------------------------------------------------------------------------
+    starts = np.flatnonzero(breaks)
+    stops = list(starts[1:]) + [len(df.index)]
+    keys = first.to_numpy()[starts]
+    return df, keys, starts, stops
+
+# ------------------------------------------------------------------------------
+# chunkify_matrix for a data frame. Returns the same keys, but each chunk is an
+# iloc slice of the frame (with the completely blank rows taken out) instead
+# of a list of tuples:
+# - with key_lbl, chunks start where the first column equals key_lbl, are
+#   numbered from 1 and keep all columns
+# - without, anything in the first column starts a chunk keyed by it, and the
+#   chunk holds the remaining columns. A key seen twice keeps the last chunk
+# Rows above the first break point are not part of any chunk. No chunk is
+# found with a mask, each one costs a row slice
+# ------------------------------------------------------------------------------
+def chunkify_frame(df, key_lbl=None):
+    df, keys, starts, stops = chunk_bounds(df, key_lbl)
+
+    # --------------------------------------------------------------------------
+    # Columns are cut once up front, each chunk is then a plain row slice
+    # --------------------------------------------------------------------------
+    chunks = {}
+    if key_lbl:
+        for chunk_idx, (start, stop) in enumerate(zip(starts, stops), 1):
+            chunks[chunk_idx] = df.iloc[start:stop]
+    else:
+        body = df.iloc[:, 1:]
+        for key, start, stop in zip(keys, starts, stops):
+            chunks[key] = body.iloc[start:stop]
+    return chunks
+
 # ------------------------------------------------------------------------------
 # Given a 2d matrix, the first column are keys and any other columns are either
 # the value or a list of values, depending on the number of entries
@@ -492,7 +556,7 @@ def keyval_from_matrix(matrix, startcol=None, endcol=None, startrow=None, endrow
 # Given a 2d matrix with field names on row 1, return a bundle of mapped-out
 # properties and metadata about the contents along with the matrix itself
 # ------------------------------------------------------------------------------
-def data_grid_from_matrix(matrix, startcol=None, endcol=None, startrow=None, endrow=None, required_fields=[], key_fields=[]):
+def data_grid_from_matrix(matrix, startcol=None, endcol=None, startrow=None, endrow=None, required_fields=[], key_fields=[], workers=None):
     # --------------------------------------------------------------------------
     # Determine if this thing is already a Pandas DataFrame; if it's not then
     # pull out the header row and recast the thing as a DataFrame
@@ -535,83 +599,10 @@ def data_grid_from_matrix(matrix, startcol=None, endcol=None, startrow=None, end
     #mtrxmeta['encoding']  = detect_encoding_of_matrix(matrix)
 
     # --------------------------------------------------------------------------
-    # Variable level data
+    # Variable level data, a bundle of information for each variable. See
+    # profile_column; workers spreads the columns over that many threads
     # --------------------------------------------------------------------------
-    varmeta = {}
-    for var in mtrxmeta['var_order']:
-        # ----------------------------------------------------------------------
-        # A bundle of information for each variable
-        # ----------------------------------------------------------------------
-        varmeta[var] = {}
-
-        # ----------------------------------------------------------------------
-        # Get a total and a count for this variable
-        # ----------------------------------------------------------------------
-        total = len(df[var])
-        counts = df[var].value_counts()
-        items = counts.keys()
-
-        # ----------------------------------------------------------------------
-        # Stuff from the data 
-        # TODO
-        # This thing with the dtype - it seems like there is a difference
-        # sometimes, I don't know why, this needs to be figured out.  
-        # ----------------------------------------------------------------------
-        try:
-            if df[var].any():
-                varmeta[var]['dtype']      = df.dtypes[var]
-            else:
-                varmeta[var]['dtype']      = "unknown"
-        except:
-            if var in df.dtypes:
-                varmeta[var]['dtype']      = df.dtypes[var]
-            else:
-                varmeta[var]['dtype']      = "unknown"
-
-
-        varmeta[var]['nonblank']   = df[var].count()
-        varmeta[var]['blank']      = total - varmeta[var]['nonblank']
-        varmeta[var]['buckets']    = len(counts)
-
-        # ----------------------------------------------------------------------
-        # Detect the data type
-        # ----------------------------------------------------------------------
-        varmeta[var]['dcontent'] = detect_data_type_from_list(items)
-
-        # ----------------------------------------------------------------------
-        # Get the maximum length of the data when cast as text
-        # ----------------------------------------------------------------------
-        varmeta[var]['text_len']   = get_longest(items)
-
-        # ----------------------------------------------------------------------
-        # Some other derived items
-        # ----------------------------------------------------------------------
-        if total:
-            varmeta[var]['density']    = varmeta[var]['nonblank'] / total
-        else:
-            varmeta[var]['density']    = None
-
-        if varmeta[var]['nonblank']:
-            varmeta[var]['complexity'] = varmeta[var]['buckets'] / varmeta[var]['nonblank']
-        else:
-            varmeta[var]['complexity'] = None
-
-        # ----------------------------------------------------------------------
-        # Numeric items get stats stuff
-        # ----------------------------------------------------------------------
-        if varmeta[var]['dcontent'] == "Float":
-            varmeta[var]['min']  = min([float(x) for x in items])
-            varmeta[var]['max']  = max([float(x) for x in items])
-        elif varmeta[var]['dcontent'] == "Integer":
-            varmeta[var]['min']  = min([int(float(x)) for x in items])
-            varmeta[var]['max']  = max([int(float(x)) for x in items])
-
-        # ----------------------------------------------------------------------
-        # Alpha items get alpha stuff
-        # ----------------------------------------------------------------------
-        if varmeta[var]['dcontent'] in ["Alpha"]:
-            #varmeta[var]['encoding'] = check the encoding here
-            pass
+    varmeta = profile_columns(df, mtrxmeta['var_order'], workers)
 
     # --------------------------------------------------------------------------
     # Stuff about the contents of the fields
@@ -640,6 +631,116 @@ def data_grid_from_matrix(matrix, startcol=None, endcol=None, startrow=None, end
 
 
 
+# ------------------------------------------------------------------------------
+# All the variable level data data_grid_from_matrix keeps for one column, from
+# a single value_counts: everything after that (even whether anything is
+# there at all) only looks at the unique values (buckets) it found, never the
+# whole column again
+# ------------------------------------------------------------------------------
+def profile_column(values):
+    # --------------------------------------------------------------------------
+    # A bundle of information for the variable
+    # --------------------------------------------------------------------------
+    meta = {}
+
+    # --------------------------------------------------------------------------
+    # Get a total and a count for this variable
+    # --------------------------------------------------------------------------
+    total = len(values.index)
+    counts = values.value_counts()
+    items = counts.index
+
+    # --------------------------------------------------------------------------
+    # Stuff from the data 
+    # TODO
+    # This thing with the dtype - it seems like there is a difference
+    # sometimes, I don't know why, this needs to be figured out.  
+    # --------------------------------------------------------------------------
+    try:
+        if items.dtype.kind in "Mm":
+            hasany = values.any()
+        else:
+            hasany = any(items.tolist())
+
+        if hasany:
+            meta['dtype']      = values.dtype
+        else:
+            meta['dtype']      = "unknown"
+    except:
+        meta['dtype']          = values.dtype
+
+    meta['nonblank']   = counts.sum()
+    meta['blank']      = total - meta['nonblank']
+    meta['buckets']    = len(counts)
+
+    # --------------------------------------------------------------------------
+    # Detect the data type, and the maximum length of the data when cast as
+    # text
+    # --------------------------------------------------------------------------
+    meta['dcontent'], numbers = data_type_and_numbers(items)
+    meta['text_len']   = get_longest_of_column(items)
+
+    # --------------------------------------------------------------------------
+    # Some other derived items
+    # --------------------------------------------------------------------------
+    if total:
+        meta['density']    = meta['nonblank'] / total
+    else:
+        meta['density']    = None
+
+    if meta['nonblank']:
+        meta['complexity'] = meta['buckets'] / meta['nonblank']
+    else:
+        meta['complexity'] = None
+
+    # --------------------------------------------------------------------------
+    # Numeric items get stats stuff
+    # --------------------------------------------------------------------------
+    if meta['dcontent'] == "Float":
+        meta['min']  = float(numbers.min())
+        meta['max']  = float(numbers.max())
+    elif meta['dcontent'] == "Integer":
+        meta['min']  = int(numbers.min())
+        meta['max']  = int(numbers.max())
+
+    return meta
+
+# ------------------------------------------------------------------------------
+# profile_column for each of the columns of a data frame, spread over a pool
+# of threads. Returns the varmeta dictionary, in column order
+# ------------------------------------------------------------------------------
+def profile_columns(df, columns=None, workers=None):
+    if columns is None:
+        columns = list(df.columns)
+
+    if workers == 1 or len(columns) < 2:
+        return {var: profile_column(df[var]) for var in columns}
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        metas = list(pool.map(lambda var: profile_column(df[var]), columns))
+    return dict(zip(columns, metas))
+
+# ------------------------------------------------------------------------------
+# get_longest for the unique values of a column (an Index, like value_counts
+# gives). Skips what valid_value would: blank text, zeros, False
+# ------------------------------------------------------------------------------
+def get_longest_of_column(items):
+    kind = items.dtype.kind
+    if kind in "iuf":
+        values = items.to_numpy()
+        values = values[values != 0]
+    elif kind == "b":
+        values = items.to_numpy()
+        values = values[values]
+    elif kind == "O" and pd.api.types.infer_dtype(items, skipna=False) == "string":
+        text = pd.Series(items, dtype=object)
+        lengths = text[text.str.strip().str.len() > 0].str.len()
+        return int(lengths.max()) if len(lengths.index) else 0
+    else:
+        return get_longest(items)
+
+    return max(map(len, map(str, values.tolist())), default=0)
+
 # ------------------------------------------------------------------------------
 # Given a list of items, determine the type of data being stored
 #   Alpha    - any item doesn't cast as a number or None or NaN
@@ -651,91 +752,140 @@ def data_grid_from_matrix(matrix, startcol=None, endcol=None, startrow=None, end
 # ------------------------------------------------------------------------------
 def detect_data_type_from_list(items):
     # --------------------------------------------------------------------------
-    # Start
+    # Same as detect_data_type, which does it a column at a time
     # --------------------------------------------------------------------------
-    dtype = ""
+    return detect_data_type(items)
+
+# ------------------------------------------------------------------------------
+# Given a whole column (Series, Index, array or list), determine the type of
+# data being stored, with the same types as detect_data_type_from_list. Blanks
+# (None, NaN, NaT) are left out the way value_counts leaves them out.
+# Whatever the dtype already says is believed, other columns are checked on
+# their unique values with pd.to_numeric, and only the values it can't read
+# get a float() of their own, so a mostly-numeric column costs next to nothing.
+# With sample, that many values are checked first, and if they are already
+# Alpha that's the answer - more values can't change it. Date can still turn
+# into Alpha further down the column, so that one always gets the full scan.
+# ------------------------------------------------------------------------------
+def detect_data_type(values, sample=None):
+    return data_type_and_numbers(values, sample)[0]
+
+# ------------------------------------------------------------------------------
+# detect_data_type, also handing back the values read as numbers (a float
+# array) when the type is Float, Integer or Binary, None otherwise
+# ------------------------------------------------------------------------------
+def data_type_and_numbers(values, sample=None):
+    if not isinstance(values, pd.Series):
+        values = pd.Series(values, dtype=None if hasattr(values, 'dtype') else object)
 
     # --------------------------------------------------------------------------
-    # If there's nothing there, we can't tell
+    # Early exit on an evenly spaced sample, only when it is already Alpha
     # --------------------------------------------------------------------------
-    if items.empty:
-        dtype = "Blank"
-        return dtype
+    if sample and len(values.index) > sample:
+        dtype = detect_data_type(values.iloc[::len(values.index) // sample])
+        if dtype == "Alpha":
+            return dtype, None
 
     # --------------------------------------------------------------------------
-    # Make sure we're looking at a minimized version of the thing by casting
-    # it to a set of itself
+    # Typed columns. If there's nothing there, we can't tell
     # --------------------------------------------------------------------------
-    set_to_check = list(set(items))
+    kind = values.dtype.kind
+    if kind in "biuf":
+        numbers = values.to_numpy(dtype=float, na_value=np.nan)
+        numbers = numbers[~np.isnan(numbers)]
+        if not len(numbers):
+            return "Blank", None
+        return numeric_data_type(numbers), numbers
+    elif kind in "Mmc":
+        if not values.notna().any():
+            return "Blank", None
+        return "Date" if kind == "M" else "Alpha", None
 
     # --------------------------------------------------------------------------
-    # Go through each item - maybe we can tell right away if it's alpha; if it
-    # isn't, flag some stuff so we can figure the type of number
+    # Anything else is looked at by its unique values, the same minimized
+    # version of the thing the list detection made with a set
     # --------------------------------------------------------------------------
-    has_decimals = False
-    not_binary = False
-    for item in set_to_check:
-        # ----------------------------------------------------------------------
-        # If it is a string and won't cast as a float, it's got alpha characters
-        # ----------------------------------------------------------------------
-        if type(item) is str:
-            try: 
-                item_as_float = float(item)
-            except:
-                dtype = "Alpha"
-                break
+    items = pd.unique(values.to_numpy(dtype=object))
+    items = items[~pd.isna(items)]
+    if not len(items):
+        return "Blank", None
+    inferred = pd.api.types.infer_dtype(items, skipna=False)
 
-        # ----------------------------------------------------------------------
-        # It might be one of the datetime formats
-        # ----------------------------------------------------------------------
-        elif type(item) is pd._libs.tslibs.timestamps.Timestamp:
-                dtype = "Date"
-                break
-
-        elif isinstance(item, datetime):
-                dtype = "Date"
-                break
+    if inferred in ["datetime", "datetime64", "date"]:
+        return "Date", None
 
+    elif inferred == "string":
         # ----------------------------------------------------------------------
-        # If not, it has to be a number, or something that needs to be added
-        # to this function.
+        # If it is a string and won't cast as a float, it's got alpha
+        # characters. to_numeric reads most of them, float() gets a go at
+        # the ones it couldn't ('nan', 'infinity', '1_000'...)
         # ----------------------------------------------------------------------
-        else:
+        numbers = np.asarray(pd.to_numeric(items, errors="coerce"), dtype=float)
+        for i in np.flatnonzero(np.isnan(numbers)):
             try:
-                item_as_float = float(item)
+                numbers[i] = float(items[i])
             except:
-                print("UNACCOUNTED TYPE! - " + str(type(item)))
-                sys.exit()
+                return "Alpha", None
+        return numeric_data_type(numbers), numbers
 
-        # ----------------------------------------------------------------------
-        # If it gets this far it's at least a number...flag if there are any
-        # decimals, which freeze it at the float level
-        # ----------------------------------------------------------------------
-        if not item_as_float.is_integer():
-            has_decimals = True
+    elif inferred in ["integer", "floating", "mixed-integer-float", "decimal", "boolean"]:
+        try:
+            numbers = np.asarray(items, dtype=float)
+            return numeric_data_type(numbers), numbers
+        except:
+            pass
 
-        # ----------------------------------------------------------------------
-        # By now it's a whole number - if it's anything other than 0 or 1 it
-        # cannot be binary
-        # ----------------------------------------------------------------------
-        if item_as_float < 0 or item_as_float > 1:
-            not_binary = True
+    return data_type_of_items(items)
 
-    # --------------------------------------------------------------------------
-    # If they're one of the numbers, use those flags to tell which kind
-    # --------------------------------------------------------------------------
-    if not dtype:
-        if has_decimals:
-            dtype = "Float"
-        elif not_binary:
-            dtype = "Integer"
-        else:
-            dtype = "Binary"
+# ------------------------------------------------------------------------------
+# The item by item detection, for columns that mix kinds of things. Anything
+# that isn't a date and won't cast as a float counts as Alpha.
+# ------------------------------------------------------------------------------
+def data_type_of_items(items):
+    has_date = False
+    numbers = []
+    for item in items:
+        if isinstance(item, (datetime, date, np.datetime64)):
+            has_date = True
+            continue
+        try:
+            numbers.append(float(item))
+        except:
+            return "Alpha", None
 
-    # --------------------------------------------------------------------------
-    # Finish
-    # --------------------------------------------------------------------------
-    return dtype
+    if has_date:
+        return "Date", None
+    numbers = np.asarray(numbers, dtype=float)
+    return numeric_data_type(numbers), numbers
+
+# ------------------------------------------------------------------------------
+# Float, Integer or Binary for an array of numbers:
+#   decimals (or nan/inf) freeze it at the float level
+#   whole numbers other than 0 or 1 cannot be binary
+# ------------------------------------------------------------------------------
+def numeric_data_type(numbers):
+    if not np.isfinite(numbers).all() or (numbers != np.floor(numbers)).any():
+        return "Float"
+    elif (numbers < 0).any() or (numbers > 1).any():
+        return "Integer"
+    else:
+        return "Binary"
+
+# ------------------------------------------------------------------------------
+# detect_data_type for several columns of a data frame at once, spread over a
+# pool of threads (most of the work is in pandas/numpy). Returns a dictionary
+# of column -> type
+# ------------------------------------------------------------------------------
+def detect_data_types(df, columns=None, sample=None, workers=None):
+    if columns is None:
+        columns = list(df.columns)
+
+    if workers == 1 or len(columns) < 2:
+        return {var: detect_data_type(df[var], sample) for var in columns}
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        dtypes = list(pool.map(lambda var: detect_data_type(df[var], sample), columns))
+    return dict(zip(columns, dtypes))
 
 # ------------------------------------------------------------------------------
 # Real quick - Does this thing evaluate as a number?
@@ -1075,10 +1225,10 @@ def jaccard_score(item1, item2):
 # ------------------------------------------------------------------------------
 def jaccard_score_of_ngrams(string1, string2, n):
     # --------------------------------------------------------------------------
-    # Make sure they're reading as sets
+    # Make sure they're reading as sets (cached, see ngram_set)
     # --------------------------------------------------------------------------
-    set1 = set(ngrams_char(string1, n))
-    set2 = set(ngrams_char(string2, n))
+    set1 = ngram_set(string1, n)
+    set2 = ngram_set(string2, n)
 
     # --------------------------------------------------------------------------
     # Calculate the pieces
@@ -1134,6 +1284,243 @@ def ngrams_char(istring, n):
     return output
 
 
+# ------------------------------------------------------------------------------
+# The n-grams of a string as a set. Strings get compared over and over again
+# (similarity_of_list, matching stubs between tables...), so the sets are
+# cached instead of being cut up again every time
+# ------------------------------------------------------------------------------
+def ngram_set(istring, n):
+    if type(istring) is str:
+        return cached_ngram_set(istring, n)
+    return frozenset(ngrams_char(istring, n))
+
+@lru_cache(maxsize=65536)
+def cached_ngram_set(istring, n):
+    return frozenset(ngrams_char(istring, n))
+
+
+# ------------------------------------------------------------------------------
+# MinHash / LSH similarity index
+# Finds strings whose n-gram Jaccard score is probably high without comparing
+# every pair. Each string gets a MinHash signature - for num_perm random hash
+# functions, the smallest hash of any of its n-grams - and two signatures agree
+# in about (Jaccard score) of their positions. The signature is cut into bands;
+# strings sharing a whole band land in the same bucket and become candidates,
+# and only candidates get their exact score worked out.
+# With b bands of r rows, a pair with score s becomes a candidate with
+# probability 1-(1-s^r)^b: the default 32 bands of 4 catch pairs above ~0.5
+# almost always and rarely bother with pairs below ~0.2.
+# The index is a plain dictionary:
+#   strings     - everything added, position is the id
+#   signatures  - list of MinHash signatures, same order
+#   buckets     - (band, band contents) -> ids
+# ------------------------------------------------------------------------------
+minhash_prime = (1 << 31) - 1
+
+def make_similarity_index(n=2, num_perm=128, bands=32, seed=1):
+    if num_perm % bands:
+        raise ValueError("num_perm must be a multiple of bands")
+
+    rng = np.random.RandomState(seed)
+    index = {}
+    index['n']          = n
+    index['num_perm']   = num_perm
+    index['bands']      = bands
+    index['rows']       = num_perm // bands
+    index['hash_a']     = rng.randint(1, minhash_prime, num_perm).astype(np.uint64)
+    index['hash_b']     = rng.randint(0, minhash_prime, num_perm).astype(np.uint64)
+    index['strings']    = []
+    index['signatures'] = []
+    index['buckets']    = {}
+    return index
+
+# ------------------------------------------------------------------------------
+# MinHash signature of one string. crc32 gives every n-gram a stable 32 bit
+# number, (a*x + b) mod p turns it into num_perm different hashes at once.
+# Strings too short for a single n-gram get None
+# ------------------------------------------------------------------------------
+def minhash_signature(index, istring):
+    grams = ngram_set(istring, index['n'])
+    if not grams:
+        return None
+
+    x = np.fromiter((zlib.crc32(g.encode('utf-8')) for g in grams), dtype=np.uint64, count=len(grams))
+    hashes = (np.outer(x, index['hash_a']) + index['hash_b']) % minhash_prime
+    return hashes.min(axis=0)
+
+# ------------------------------------------------------------------------------
+# The buckets a signature falls into, one per band
+# ------------------------------------------------------------------------------
+def minhash_bands(index, signature):
+    rows = index['rows']
+    return [(band, signature[band*rows:(band+1)*rows].tobytes()) for band in range(index['bands'])]
+
+# ------------------------------------------------------------------------------
+# Add strings to the index, returns the ids they got
+# ------------------------------------------------------------------------------
+def add_to_similarity_index(index, strings):
+    ids = []
+    for istring in strings:
+        idx = len(index['strings'])
+        signature = minhash_signature(index, istring)
+        index['strings'].append(istring)
+        index['signatures'].append(signature)
+        ids.append(idx)
+
+        if signature is None:
+            continue
+        for key in minhash_bands(index, signature):
+            index['buckets'].setdefault(key, []).append(idx)
+
+    return ids
+
+# ------------------------------------------------------------------------------
+# Index a list of strings in one go
+# ------------------------------------------------------------------------------
+def build_similarity_index(strings, n=2, num_perm=128, bands=32, seed=1):
+    index = make_similarity_index(n, num_perm, bands, seed)
+    add_to_similarity_index(index, strings)
+    return index
+
+# ------------------------------------------------------------------------------
+# Estimated Jaccard score of two indexed strings, from their signatures only
+# ------------------------------------------------------------------------------
+def minhash_score(index, id1, id2):
+    sig1 = index['signatures'][id1]
+    sig2 = index['signatures'][id2]
+    if sig1 is None or sig2 is None:
+        return 0
+    return float((sig1 == sig2).mean())
+
+# ------------------------------------------------------------------------------
+# Indexed strings that are probably similar to istring (which doesn't need to
+# be in the index). Candidates are checked with the exact n-gram Jaccard score
+# and returned as (id, string, score), best first, down to threshold
+# ------------------------------------------------------------------------------
+def query_similarity_index(index, istring, threshold=0.5):
+    signature = minhash_signature(index, istring)
+    if signature is None:
+        return []
+
+    candidates = set()
+    for key in minhash_bands(index, signature):
+        candidates.update(index['buckets'].get(key, []))
+
+    matches = []
+    for idx in candidates:
+        jscore = jaccard_score_of_ngrams(istring, index['strings'][idx], index['n'])
+        if jscore >= threshold:
+            matches.append((idx, index['strings'][idx], jscore))
+
+    matches.sort(key=lambda x: (-x[2], x[0]))
+    return matches
+
+# ------------------------------------------------------------------------------
+# Every pair of indexed strings that is probably similar, as (id1, id2, score)
+# with id1 < id2 and an exact score of at least threshold. Only pairs sharing a
+# bucket are ever scored, so this stays close to linear unless huge numbers of
+# strings are near-identical
+# ------------------------------------------------------------------------------
+def similar_pairs(index, threshold=0.5):
+    seen = set()
+    pairs = []
+    for ids in index['buckets'].values():
+        if len(ids) < 2:
+            continue
+        for i, id1 in enumerate(ids):
+            for id2 in ids[i+1:]:
+                if (id1, id2) in seen:
+                    continue
+                seen.add((id1, id2))
+                jscore = jaccard_score_of_ngrams(index['strings'][id1], index['strings'][id2], index['n'])
+                if jscore >= threshold:
+                    pairs.append((id1, id2, jscore))
+
+    pairs.sort(key=lambda x: (-x[2], x[0], x[1]))
+    return pairs
+
+
+# ------------------------------------------------------------------------------
+# Strings as rows of a sparse 0/1 matrix, one column per distinct n-gram.
+# vocabulary (n-gram -> column) is filled in as new n-grams turn up, pass the
+# same one in to put another list of strings in the same columns
+# ------------------------------------------------------------------------------
+def ngram_incidence_matrix(strings, n=2, vocabulary=None):
+    if vocabulary is None:
+        vocabulary = {}
+
+    indptr = [0]
+    indices = []
+    for istring in strings:
+        for gram in ngram_set(istring, n):
+            indices.append(vocabulary.setdefault(gram, len(vocabulary)))
+        indptr.append(len(indices))
+
+    data = np.ones(len(indices), dtype=np.float32)
+    matrix = sparse.csr_matrix((data, indices, indptr), shape=(len(strings), max(len(vocabulary), 1)))
+    return matrix, vocabulary
+
+# ------------------------------------------------------------------------------
+# jaccard_score_of_ngrams of every string in strings1 against every string in
+# strings2 (or strings1 again), without a double loop: the intersections are
+# one sparse matrix product, the unions come from the set sizes.
+# Done in blocks of block_size rows so a block of scores is all that's ever
+# held densely. Returns
+#   - a sparse matrix of scores, keeping those of at least threshold (and
+#     above 0, pairs with nothing in common are left out), or
+#   - with top_k, for each string in strings1 the list of its top_k matches
+#     in strings2 as (position, score), best first
+# Without strings2 a string is never scored against itself, the diagonal is 0
+# ------------------------------------------------------------------------------
+def jaccard_matrix(strings1, strings2=None, n=2, top_k=None, threshold=0.0, block_size=1024):
+    # --------------------------------------------------------------------------
+    # Both lists share one vocabulary so the columns line up
+    # --------------------------------------------------------------------------
+    matrix1, vocabulary = ngram_incidence_matrix(strings1, n)
+    if strings2 is None:
+        matrix2 = matrix1
+    else:
+        matrix2, vocabulary = ngram_incidence_matrix(strings2, n, vocabulary)
+        matrix1.resize((matrix1.shape[0], matrix2.shape[1]))
+
+    sizes1 = np.asarray(matrix1.sum(axis=1)).ravel()
+    sizes2 = np.asarray(matrix2.sum(axis=1)).ravel()
+    matrix2t = matrix2.T.tocsr()
+
+    results = []
+    blocks = []
+    for start in range(0, matrix1.shape[0], block_size):
+        stop = min(start + block_size, matrix1.shape[0])
+
+        # ----------------------------------------------------------------------
+        # Size of the intersect and the union for the whole block
+        # ----------------------------------------------------------------------
+        intersect = (matrix1[start:stop] @ matrix2t).toarray().astype(np.float64)
+        union = sizes1[start:stop, None] + sizes2[None, :] - intersect
+        scores = np.divide(intersect, union, out=np.zeros_like(intersect), where=union > 0)
+        if strings2 is None:
+            scores[np.arange(stop - start), np.arange(start, stop)] = 0
+
+        if top_k:
+            k = min(top_k, scores.shape[1])
+            if not k:
+                results.extend([] for row in scores)
+                continue
+            best = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+            for i, row in enumerate(scores):
+                order = sorted(best[i], key=lambda j: (-row[j], j))
+                results.append([(int(j), float(row[j])) for j in order if row[j] > 0 and row[j] >= threshold])
+        else:
+            scores[scores < threshold] = 0
+            blocks.append(sparse.csr_matrix(scores))
+
+    if top_k:
+        return results
+    if not blocks:
+        return sparse.csr_matrix((0, matrix2.shape[0]))
+    return sparse.vstack(blocks).tocsr()
+
+
 # ------------------------------------------------------------------------------
 # Length of longest item in a list
 # ------------------------------------------------------------------------------
@@ -1227,7 +1614,7 @@ def formatted_block(block, indent=0):
 # ------------------------------------------------------------------------------
 # This takes in a dataframe and turns it into a verticalized dataframe
 # ------------------------------------------------------------------------------
-def verticalize(inputdf,idcolumn,questioncolumnname = 'Question',valuecolumnname = 'Value'):
+def verticalize(inputdf,idcolumn,questioncolumnname = 'Question',valuecolumnname = 'Value',categorical = True):
     """
     Takes in the following fields:
         - inputdf (dataframe of the matrix data)
@@ -1237,17 +1624,86 @@ def verticalize(inputdf,idcolumn,questioncolumnname = 'Question',valuecolumnname
         the deconstructed headers)
         - valuecolumnname (defaults to Value. This gives the name of the column containing
         the value)
+        - categorical (defaults to True. The question column is a pandas Categorical
+        with the headers as categories, in column order, instead of one string per row)
+    Rows come out column by column: every respondent for the first header, then
+    every respondent for the next one...
     """
-    outputdf = pd.DataFrame()
-    for column in inputdf.columns:
-        if column != idcolumn:
-            tempdf = pd.DataFrame()
-            tempdf[idcolumn] = inputdf[idcolumn]
-            tempdf[questioncolumnname] = [column for i in range(len(tempdf[idcolumn]))]
-            tempdf[valuecolumnname] = inputdf[column]
-            outputdf = pd.concat([outputdf,tempdf], ignore_index=True)
+    # --------------------------------------------------------------------------
+    # One reshape for all the columns at once
+    # --------------------------------------------------------------------------
+    questions = [column for column in inputdf.columns if column != idcolumn]
+    outputdf = pd.melt(inputdf, id_vars=[idcolumn], value_vars=questions,
+                       var_name=questioncolumnname, value_name=valuecolumnname)
+
+    # --------------------------------------------------------------------------
+    # melt repeats each header once per respondent; as a categorical that's
+    # just a code per row. Only works if the headers are unique
+    # --------------------------------------------------------------------------
+    if categorical and questions and len(set(questions)) == len(questions):
+        codes = np.repeat(np.arange(len(questions)), len(inputdf.index))
+        outputdf[questioncolumnname] = pd.Categorical.from_codes(codes, categories=questions)
+
     return outputdf
 
+# ------------------------------------------------------------------------------
+# verticalize straight into a file, a batch of respondents at a time, so the
+# long table is never all in memory. inputdf is a dataframe (cut into batches
+# of chunksize rows) or anything that yields dataframes, like
+# pd.read_csv(..., chunksize=...), so the wide file doesn't need to be in
+# memory either.
+# - csv: one file, header written once
+# - parquet: path is a directory of part-00000.parquet, part-00001.parquet...
+#   which pd.read_parquet(path) reads back as one table
+# The rows come out batch by batch, each batch column by column. An empty
+# input still writes the header (an empty part-00000 for parquet).
+# Returns the number of rows written.
+# ------------------------------------------------------------------------------
+def verticalize_to_file(inputdf,idcolumn,path,chunksize = 10000,questioncolumnname = 'Question',valuecolumnname = 'Value',fileformat = None):
+    # --------------------------------------------------------------------------
+    # File format from the extension if not given
+    # --------------------------------------------------------------------------
+    if fileformat is None:
+        fileformat = 'parquet' if str(path).lower().endswith('.parquet') else 'csv'
+    if fileformat not in ['csv', 'parquet']:
+        raise ValueError("fileformat must be 'csv' or 'parquet'")
+
+    if isinstance(inputdf, pd.DataFrame):
+        batches = (inputdf.iloc[i:i+chunksize] for i in range(0, len(inputdf.index), chunksize))
+    else:
+        batches = inputdf
+
+    if fileformat == 'parquet':
+        os.makedirs(path, exist_ok=True)
+
+    # --------------------------------------------------------------------------
+    # Go through each batch
+    # --------------------------------------------------------------------------
+    written = 0
+    part = -1
+    for part, batchdf in enumerate(batches):
+        longdf = verticalize(batchdf, idcolumn, questioncolumnname, valuecolumnname)
+        if fileformat == 'csv':
+            longdf.to_csv(path, mode='w' if part == 0 else 'a', header=(part == 0), index=False)
+        else:
+            longdf.to_parquet(os.path.join(path, 'part-%05d.parquet' % part), index=False)
+        written += len(longdf.index)
+
+    # --------------------------------------------------------------------------
+    # No batches at all, the file gets the header and nothing else
+    # --------------------------------------------------------------------------
+    if part < 0:
+        if isinstance(inputdf, pd.DataFrame):
+            longdf = verticalize(inputdf, idcolumn, questioncolumnname, valuecolumnname)
+        else:
+            longdf = pd.DataFrame(columns=[idcolumn, questioncolumnname, valuecolumnname])
+        if fileformat == 'csv':
+            longdf.to_csv(path, index=False)
+        else:
+            longdf.to_parquet(os.path.join(path, 'part-00000.parquet'), index=False)
+
+    return written
+
 
 
 # ------------------------------------------------------------------------------
@@ -1341,6 +1797,151 @@ def run_create_hyper_file_from_csv(table,path_to_database,path_to_csv,delimiter=
     # --------------------------------------------------------------------------
     return True
 
+# ------------------------------------------------------------------------------
+# Hyper column type for a pandas dtype, anything we do not know becomes text
+# ------------------------------------------------------------------------------
+def hyper_type_of_dtype(dtype):
+    if isinstance(dtype, pd.CategoricalDtype):
+        return hyper_type_of_dtype(dtype.categories.dtype)
+    if pd.api.types.is_bool_dtype(dtype):
+        return SqlType.bool()
+    if pd.api.types.is_integer_dtype(dtype):
+        return SqlType.big_int()
+    if pd.api.types.is_float_dtype(dtype):
+        return SqlType.double()
+    if pd.api.types.is_datetime64_any_dtype(dtype):
+        return SqlType.timestamp()
+    return SqlType.text()
+
+# ------------------------------------------------------------------------------
+# TableDefinition built from the columns/dtypes of a dataframe
+# ------------------------------------------------------------------------------
+def hyper_table_definition(df, table_name='Extract', schema='Extract'):
+    columns = [TableDefinition.Column(str(col), hyper_type_of_dtype(df[col].dtype), NULLABLE) for col in df.columns]
+    return TableDefinition(table_name=TableName(schema, table_name), columns=columns)
+
+# ------------------------------------------------------------------------------
+# Rows of a dataframe as plain python tuples, chunksize rows at a time, with
+# missing values as None (what the Inserter wants for NULL)
+# ------------------------------------------------------------------------------
+def hyper_rows(df, chunksize=10000):
+    for start in range(0, len(df.index), chunksize):
+        chunk = df.iloc[start:start + chunksize]
+        columns = []
+        for col in chunk.columns:
+            values = chunk[col].tolist()
+            # text columns of mixed objects (scraper output) go in as strings
+            if hyper_type_of_dtype(chunk[col].dtype) == SqlType.text():
+                values = [str(value) for value in values]
+            for i in np.flatnonzero(chunk[col].isna().to_numpy()):
+                values[i] = None
+            columns.append(values)
+        yield list(zip(*columns))
+
+# ------------------------------------------------------------------------------
+# Take in a dataframe (or a dict of equal length columns, like the scraper's
+# output) and write it straight to a Tableau hyper file, no CSV in between
+# ------------------------------------------------------------------------------
+def run_create_hyper_file_from_df(data,path_to_database,table_name='Extract',schema='Extract',chunksize=10000):
+    """
+    Expects:
+        - data (dataframe or dict of columns)
+        - path to output (path_to_database)
+        - table_name/schema (defaults to "Extract"."Extract", what Tableau looks for)
+        - chunksize (rows handed to the Inserter per call)
+    Column types come from the dtypes, see hyper_type_of_dtype.
+    Returns the number of rows written
+    """
+    df = data if isinstance(data, pd.DataFrame) else pd.DataFrame(data)
+    table = hyper_table_definition(df, table_name, schema)
+    process_parameters = {
+        "log_file_max_count": "2",
+        "log_file_size_limit": "100M"
+    }
+
+    # --------------------------------------------------------------------------
+    # Local Hyper process only, no usage data sent anywhere
+    # --------------------------------------------------------------------------
+    with HyperProcess(telemetry=Telemetry.DO_NOT_SEND_USAGE_DATA_TO_TABLEAU, parameters=process_parameters) as hyper:
+        with Connection(endpoint=hyper.endpoint,
+                        database=path_to_database,
+                        create_mode=CreateMode.CREATE_AND_REPLACE,
+                        parameters={"lc_time": "en_US"}) as connection:
+
+            connection.catalog.create_schema_if_not_exists(schema)
+            connection.catalog.create_table(table_definition=table)
+
+            # ------------------------------------------------------------------
+            # One Inserter, fed a chunk at a time so the whole frame is never
+            # turned into python objects at once
+            # ------------------------------------------------------------------
+            with Inserter(connection, table) as inserter:
+                for rows in hyper_rows(df, chunksize):
+                    inserter.add_rows(rows)
+                inserter.execute()
+
+            count_in_table = connection.execute_scalar_query(query=f"SELECT COUNT(*) FROM {table.table_name}")
+
+    # --------------------------------------------------------------------------
+    # Finish
+    # --------------------------------------------------------------------------
+    return count_in_table
+
+# ------------------------------------------------------------------------------
+# Times the direct writer against writing a CSV and loading it with COPY
+# ------------------------------------------------------------------------------
+def benchmark_hyper_writers(data,workdir=None,chunksize=10000,repeat=1):
+    """
+    Writes the same data both ways into a temporary folder (or workdir)
+    Returns {'rows', 'inserter', 'csv_copy'} with the best time of each in
+    seconds, 'csv_copy' includes writing the CSV
+    """
+    df = data if isinstance(data, pd.DataFrame) else pd.DataFrame(data)
+    table = hyper_table_definition(df)
+    timings = {'rows': len(df.index), 'inserter': None, 'csv_copy': None}
+
+    with tempfile.TemporaryDirectory(dir=workdir) as tmpdir:
+        path_to_csv = os.path.join(tmpdir, 'extract.csv')
+        for _ in range(repeat):
+            start = time.perf_counter()
+            run_create_hyper_file_from_df(df, os.path.join(tmpdir, 'inserter.hyper'), chunksize=chunksize)
+            elapsed = time.perf_counter() - start
+            if timings['inserter'] is None or elapsed < timings['inserter']:
+                timings['inserter'] = elapsed
+
+            start = time.perf_counter()
+            df.to_csv(path_to_csv, index=False)
+            with HyperProcess(telemetry=Telemetry.DO_NOT_SEND_USAGE_DATA_TO_TABLEAU) as hyper:
+                with Connection(endpoint=hyper.endpoint,
+                                database=os.path.join(tmpdir, 'csv_copy.hyper'),
+                                create_mode=CreateMode.CREATE_AND_REPLACE) as connection:
+                    connection.catalog.create_schema_if_not_exists(table.table_name.schema_name)
+                    connection.catalog.create_table(table_definition=table)
+                    connection.execute_command(
+                        command=f"COPY {table.table_name} from {escape_string_literal(path_to_csv)} with "
+                        f"(format csv, NULL '', delimiter ',', header)")
+            elapsed = time.perf_counter() - start
+            if timings['csv_copy'] is None or elapsed < timings['csv_copy']:
+                timings['csv_copy'] = elapsed
+
+    return timings
+
+# ------------------------------------------------------------------------------
+# Two-sided z cutoffs. The levels we have always used keep their rounded values
+# so existing results do not move, anything else comes from the normal curve
+# ------------------------------------------------------------------------------
+cutoffdict = {0.99:2.57,0.95:1.96,0.90:1.645,0.85:1.44,0.80:1.282}
+
+def critical_value(confidence):
+    """
+    z cutoff for a two-sided test at the given confidence (0 < confidence < 1)
+    """
+    if confidence in cutoffdict:
+        return cutoffdict[confidence]
+    if not 0 < confidence < 1:
+        raise ValueError('confidence must be between 0 and 1, got ' + str(confidence))
+    return NormalDist().inv_cdf((1 + confidence) / 2)
+
 def stat_test(field1dict,field2dict,field1,field2,confidence=0.95):
     """
     Takes in the valuedicts from two fields in the same metric
@@ -1352,8 +1953,7 @@ def stat_test(field1dict,field2dict,field1,field2,confidence=0.95):
         - stat (list)
         - field1/field2 : Names of the fields being stat-tested
     """
-    cutoffdict = {0.99:2.57,0.95:1.96,0.90:1.645,0.85:1.44,0.80:1.282}
-    cutoff = cutoffdict[confidence]
+    cutoff = critical_value(confidence)
     # If there is no stddev value, use proportion testing method
     value1  = field1dict['value']
     value2  = field2dict['value']
@@ -1383,25 +1983,164 @@ def stat_test(field1dict,field2dict,field1,field2,confidence=0.95):
         else:
             field2dict['stat'].append(field1)
     return
+
+def stat_test_batch(values1,values2,ebases1,ebases2,fields1,fields2,stddevs1=None,stddevs2=None,confidence=0.95):
+    """
+    stat_test for N pairs of fields at once
+        - values1/values2, ebases1/ebases2 (one entry per pair)
+        - fields1/fields2 (names of the fields, what ends up in the stat lists)
+        - stddevs1/stddevs2 (optional, '' means no stddev, leaving them out
+        means none at all. Pairs with neither use proportion testing, pairs
+        with both use the means test, pairs with only one are skipped like
+        stat_test does. A None or NaN stddev is not ''; as in stat_test the
+        pair goes to the means test and never gets a letter)
+    Returns (stats1, stats2): for pair i, stats1[i] is what stat_test would
+    append to field1dict['stat'] and stats2[i] what it would append to
+    field2dict['stat'] (either [] or the other field's name)
+    """
+    cutoff = critical_value(confidence)
+    value1 = np.asarray(values1, dtype=float)
+    value2 = np.asarray(values2, dtype=float)
+    ebase1 = np.asarray(ebases1, dtype=float)
+    ebase2 = np.asarray(ebases2, dtype=float)
+
+    # --------------------------------------------------------------------------
+    # Only '' counts as missing, the same test stat_test makes. None becomes
+    # NaN, which gives a NaN z score and so no letter, like stat_test's
+    # TypeError does
+    # --------------------------------------------------------------------------
+    def stddev_array(stddevs):
+        if stddevs is None:
+            return np.full(value1.shape, np.nan), np.full(value1.shape, True)
+        blank = np.array([isinstance(x, str) and x == '' for x in stddevs], dtype=bool)
+        return np.array([np.nan if y else x for x, y in zip(stddevs, blank)], dtype=float), blank
+    stddev1, blank1 = stddev_array(stddevs1)
+    stddev2, blank2 = stddev_array(stddevs2)
+    proportion = blank1 & blank2
+    means = ~blank1 & ~blank2
+
+    # --------------------------------------------------------------------------
+    # Both formulas over every pair. Anything stat_test would have raised on
+    # (a zero in a denominator) is left out through valid
+    # --------------------------------------------------------------------------
+    with np.errstate(divide='ignore', invalid='ignore'):
+        count1  = ebase1 * value1
+        count2  = ebase2 * value2
+        combined_percent = (count1 + count2)/(ebase1 + ebase2)
+        prop_den = (combined_percent*100.0)*(100.0 - combined_percent*100.0)*(1/ebase1 + 1/ebase2)
+        prop_z_sq = ((100 * count1/ebase1 - 100 * count2/ebase2)**2) / prop_den
+        prop_valid = (ebase1 != 0) & (ebase2 != 0) & (ebase1 + ebase2 != 0) & (prop_den != 0)
+
+        mean_den = stddev1**2/ebase1 + stddev2**2/ebase2
+        mean_z_sq = (value1 - value2)**2 / mean_den
+        mean_valid = (ebase1 != 0) & (ebase2 != 0) & (mean_den != 0)
+
+    z_score_sq = np.where(proportion, prop_z_sq, mean_z_sq)
+    valid = (proportion & prop_valid) | (means & mean_valid)
+    significant = valid & (z_score_sq > cutoff**2)
+    higher = value1 > value2
+
+    stats1 = [[field2] if win else [] for win, field2 in zip(significant & higher, fields2)]
+    stats2 = [[field1] if win else [] for win, field1 in zip(significant & ~higher, fields1)]
+    return stats1, stats2
+
+def stat_test_many(pairs,confidence=0.95):
+    """
+    Runs stat_test over a list of (field1dict, field2dict, field1, field2)
+    in one batch, appending to the 'stat' lists the same way stat_test does
+    """
+    if not pairs:
+        return
+    def column(key, side):
+        return [pair[side][key] for pair in pairs]
+    stats1, stats2 = stat_test_batch(column('value', 0), column('value', 1),
+                                     column('ebase', 0), column('ebase', 1),
+                                     [pair[2] for pair in pairs], [pair[3] for pair in pairs],
+                                     column('stddev', 0), column('stddev', 1), confidence)
+    for pair, stat1, stat2 in zip(pairs, stats1, stats2):
+        pair[0]['stat'].extend(stat1)
+        pair[1]['stat'].extend(stat2)
+    return
     
 def stat_test_df(datdf1,effdf1,datdf2,effdf2,high,low,confidence=0.95):
     """
     Do stat testing with two sets of dataframes
+    Returns a dataframe (lined up the way pandas lines up the inputs) holding
+    high where datdf1 is significantly above datdf2, low where it is
+    significantly below and '' everywhere else
     """
-    cutoffdict = {0.99:2.57,0.95:1.96,0.90:1.645,0.85:1.44,0.80:1.282}
-    cutoff = cutoffdict[confidence]
+    cutoff = critical_value(confidence)
     count1  = effdf1 * datdf1
     count2  = effdf2 * datdf2
     combined_percent = (count1 + count2)/(effdf1 + effdf2)
 
     zdf = ((100 * count1/effdf1 - 100 * count2/effdf2)**2) / ((combined_percent*100.0)*(100.0 - combined_percent*100.0)*(1/effdf1 + 1/effdf2))
-    for idx, row in zdf.iterrows():
-        for col,val in row.items():
-            if val > cutoff**2:
-                if datdf1.loc[idx,col] > datdf2.loc[idx,col]:
-                    zdf.loc[idx,col] = high
-                else:
-                    zdf.loc[idx,col] = low
-            else:
-                zdf.loc[idx,col] = ''
-    return zdf
+
+    # --------------------------------------------------------------------------
+    # Whole frame at once: significant cells get high or low depending on
+    # which side is bigger, the rest (including NaN) are blank
+    # --------------------------------------------------------------------------
+    significant = zdf.to_numpy(dtype=float) > cutoff**2
+    higher = datdf1.reindex_like(zdf).to_numpy() > datdf2.reindex_like(zdf).to_numpy()
+
+    result = np.full(zdf.shape, '', dtype=object)
+    result[significant & higher] = high
+    result[significant & ~higher] = low
+    return pd.DataFrame(result, index=zdf.index, columns=zdf.columns)
+
+def stat_test_pairs(datdf,effdf,letters=None,groups=None,confidence=0.95):
+    """
+    Stat test every banner column of a table against every other one at once
+        - datdf (dataframe of percentages, rows are stubs, columns are banner points)
+        - effdf (effective bases, a dataframe like datdf or one base per column)
+        - letters (stat letter of each column, defaults to the column names)
+        - groups (lists of letters that are tested against each other, like
+        the A/B/C/D, I/J, K/L of the T_Banners. Defaults to every column
+        against every other. A group given as a plain string is one letter,
+        not a string of letters, since letters can be longer than one character)
+    Returns a dataframe like datdf where each cell holds the letters of the
+    columns it is significantly higher than, in column order (like stat_test,
+    the higher one gets the other one's letter)
+    """
+    cutoff = critical_value(confidence)
+    if letters is None:
+        letters = [str(col) for col in datdf.columns]
+
+    # --------------------------------------------------------------------------
+    # rows x columns x columns: [:, i, j] is column i tested against column j
+    # --------------------------------------------------------------------------
+    dat = datdf.to_numpy(dtype=float)
+    eff = np.broadcast_to(np.asarray(effdf, dtype=float), dat.shape)
+    dat1, dat2 = dat[:, :, None], dat[:, None, :]
+    eff1, eff2 = eff[:, :, None], eff[:, None, :]
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        count1  = eff1 * dat1
+        count2  = eff2 * dat2
+        combined_percent = (count1 + count2)/(eff1 + eff2)
+        z_score_sq = ((100 * count1/eff1 - 100 * count2/eff2)**2) / ((combined_percent*100.0)*(100.0 - combined_percent*100.0)*(1/eff1 + 1/eff2))
+
+    # --------------------------------------------------------------------------
+    # Which pairs get tested at all
+    # --------------------------------------------------------------------------
+    tested = np.ones((len(letters), len(letters)), dtype=bool)
+    if groups is not None:
+        position = {letter: i for i, letter in enumerate(letters)}
+        tested[:] = False
+        for group in groups:
+            if isinstance(group, str):
+                group = [group]
+            members = [position[letter] for letter in group if letter in position]
+            tested[np.ix_(members, members)] = True
+    np.fill_diagonal(tested, False)
+
+    wins = (z_score_sq > cutoff**2) & (dat1 > dat2) & tested[None, :, :]
+
+    # --------------------------------------------------------------------------
+    # Glue the letters together a column at a time
+    # --------------------------------------------------------------------------
+    result = np.full(dat.shape, '', dtype=object)
+    for j, letter in enumerate(letters):
+        if wins[:, :, j].any():
+            result = result + np.where(wins[:, :, j], letter, '').astype(object)
+    return pd.DataFrame(result, index=datdf.index, columns=datdf.columns)
@@ -2,7 +2,13 @@
 import os
 import sys
 import bs4
+import zlib
+import json
+import shutil
+import hashlib
 import sqlite3
+from xml.etree import ElementTree
+import numpy as np
 import pandas as pd
 import csv
 import win32com.client
@@ -180,9 +186,12 @@ def parse_include_fname(line):
 
 
 # ------------------------------------------------------------------------------
-# Parsing a whole regular MDD file and returning a useful structure
+# Parsing a whole regular MDD file and returning a useful structure.
+# languages (e.g. ['en-US']) drops the text in any other language before the
+# tree is walked, so only labels in those languages are kept. All labels are
+# also in the label store at mdd_info['labels'] (see make_label_store)
 # ------------------------------------------------------------------------------
-def parse_mdd(mdd_file, fdebug=False):
+def parse_mdd(mdd_file, fdebug=False, languages=None):
     # --------------------------------------------------------------------------
     # Start
     # --------------------------------------------------------------------------
@@ -193,6 +202,13 @@ def parse_mdd(mdd_file, fdebug=False):
     # --------------------------------------------------------------------------
     mdd_data = bs4.BeautifulSoup(open(mdd_file, "r", encoding='utf-8'), "lxml-xml")
 
+    # --------------------------------------------------------------------------
+    # Text in other languages goes before anything looks at the tree, the
+    # same way parse_mdd_stream drops it, so both give the same structures
+    # --------------------------------------------------------------------------
+    if languages is not None:
+        drop_other_languages(mdd_data, set(lang.lower() for lang in languages))
+
     # --------------------------------------------------------------------------
     # Prettified debug version
     # --------------------------------------------------------------------------
@@ -241,27 +257,7 @@ def parse_mdd(mdd_file, fdebug=False):
         if not isinstance(node, bs4.element.Tag):
             continue
 
-        # ----------------------------------------------------------------------
-        # Get the things
-        # ----------------------------------------------------------------------
-        sdate = node.attrs['date']
-        sfver = node.attrs['fileversion']
-        svset = node.attrs['versionset']
-        suser = node.attrs['username']
-
-        if 'count' in node.attrs:
-            scount = node.attrs['count']
-        else:
-            scount = 1
-
-        # ----------------------------------------------------------------------
-        # Make the record
-        # ----------------------------------------------------------------------
-        mdd_savelogs[sdate] = {}
-        mdd_savelogs[sdate]['fileversion'] = sfver
-        mdd_savelogs[sdate]['versionset']  = svset
-        mdd_savelogs[sdate]['username']    = suser
-        mdd_savelogs[sdate]['count']       = scount
+        parse_savelog_node(node, mdd_savelogs)
 
     # --------------------------------------------------------------------------
     # Metadata properties
@@ -273,17 +269,9 @@ def parse_mdd(mdd_file, fdebug=False):
     # --------------------------------------------------------------------------
     mdd_languages = {}
     for node in raw_languages.children:
-        if node.name == "versions":
-            continue
-        if node.name == "deleted":
-            continue
         if type(node) == bs4.element.NavigableString:
             continue
-        if not 'name' in node.attrs:
-            continue
-        lname = node.attrs['name']
-        mdd_languages[lname] = retrieve_properties(node.properties)
-        mdd_languages[lname]['langid'] = node.attrs['id']
+        parse_language_node(node, mdd_languages)
 
     # --------------------------------------------------------------------------
     # Start the data structures for the category components
@@ -298,357 +286,1125 @@ def parse_mdd(mdd_file, fdebug=False):
     # category names and start a structure with them.
     # --------------------------------------------------------------------------
     for node in raw_categorymap:
+        parse_categorymap_node(node, mdd_categories['by_cat'])
+
+    # --------------------------------------------------------------------------
+    # Go through the definitions and start structures for the shared lists,
+    # indexing each one's categories as we go
+    # --------------------------------------------------------------------------
+    sl_index = {}
+    for node in raw_definition:
         # ----------------------------------------------------------------------
-        # 'categoryid' is what these things are called
+        # 'categories' indicates a shared list definition
         # ----------------------------------------------------------------------
-        if not node.name == "categoryid":
+        if not node.name == "categories":
             continue
 
         # ----------------------------------------------------------------------
-        # Grab what we need
+        # Make an area in the data structure for this shared list
         # ----------------------------------------------------------------------
-        catname = node.attrs['name'].lower()
-        catval  = node.attrs['value']
+        sl_name = node.attrs['name'].lower()
+        mdd_categories['shared'][sl_name] = start_shared_list(node)
+        sl_index[sl_name] = index_shared_list(node)
 
-        # ----------------------------------------------------------------------
-        # Fill in the start of the structure for this category
-        # ----------------------------------------------------------------------
-        mdd_categories['by_cat'][catname] = {}
-        mdd_categories['by_cat'][catname]['value'] = catval
-        mdd_categories['by_cat'][catname]['catname'] = node.attrs['name']
-        mdd_categories['by_cat'][catname]['usage_sl']  = []
-        mdd_categories['by_cat'][catname]['usage_var'] = []
+    # --------------------------------------------------------------------------
+    # Plain lists first, then the nested ones, which need the lists they
+    # include parsed first, so those go in dependency order rather than the
+    # order they're defined in
+    # --------------------------------------------------------------------------
+    sl_nested = {sl_name: sl_index[sl_name] for sl_name in sl_index if sl_index[sl_name]['nested']}
+    sl_order = [sl_name for sl_name in sl_index if not sl_name in sl_nested] + shared_list_order(sl_nested)
+    for sl_name in sl_order:
+        mdd_categories['shared'][sl_name]['cats'] = retrieve_categories(sl_index[sl_name]['node'],
+                                                                        mdd_categories['shared'],
+                                                                        cat_nodes=sl_index[sl_name]['cat_nodes'])
 
+    # --------------------------------------------------------------------------
+    # Run back through the categories we just parsed and flag their usage in
+    # the other section, plain lists first and then the nested ones
+    # --------------------------------------------------------------------------
+    for nested in [False, True]:
+        for sl_name in sl_index:
+            if sl_index[sl_name]['nested'] == nested:
+                flag_shared_list_usage(mdd_categories['by_cat'], sl_name, mdd_categories['shared'][sl_name]['cats'])
+
+    mdd_categories['sl_order'] = sl_order
 
     # --------------------------------------------------------------------------
-    # Go through the definitions and start structures for the shared lists
+    # Go through the definitions and gather information about variables
     # --------------------------------------------------------------------------
-    nested_sl = []
+    mdd_variables = {}
+    mdd_variables['var_defs'] = {}
+
     for node in raw_definition:
         # ----------------------------------------------------------------------
-        # 'categories' indicates a shared list definition
+        # 'variable' indicates an individual variable
         # ----------------------------------------------------------------------
-        if not node.name == "categories":
+        if not node.name == "variable":
             continue
 
         # ----------------------------------------------------------------------
-        # Get the information about the shared list from the tree
+        # Skip past nodes that are nothing
         # ----------------------------------------------------------------------
-        sl_name    = node.attrs['name'].lower()
-        sl_id      = node.attrs['id']
-        sl_props   = retrieve_properties(node.properties)
-        sl_notes   = retrieve_properties(node.notes)
-        sl_labels  = retrieve_labels(node.labels)
+        if not node:
+            continue
 
         # ----------------------------------------------------------------------
-        # In order to parse nested shared lists, they need to already exist in
-        # this data structure, so we're going to skip over any like that and
-        # get them on a second pass
+        # Skip past nodes that are not tags
         # ----------------------------------------------------------------------
-        if node.find_all(['categories']):
-            nested_sl.append(sl_name)
-            sl_cats = None
-        else:
-            sl_cats = retrieve_categories(node, mdd_categories['shared'])
+        if not type(node) == bs4.element.Tag:
+            continue
 
+        var_id, var_def = parse_variable_node(node, mdd_categories['shared'])
+        mdd_variables['var_defs'][var_id] = var_def
 
+    # --------------------------------------------------------------------------
+    # Go through and flag the pages
+    # --------------------------------------------------------------------------
+    mdd_pages = {}
+    for node in raw_definition:
         # ----------------------------------------------------------------------
-        # Run back through the categories we just parsed and flag their
-        # usage in the other section
+        # only page type
         # ----------------------------------------------------------------------
-        if sl_cats:
-            # ------------------------------------------------------------------
-            # Sometimes there is something referenced in a shared list that 
-            # never actually gets used anywhere - it wouldn't have been in the
-            # category map if that's the case, but we'll still make an entry
-            # ------------------------------------------------------------------
-            for catname in sl_cats['list']:
-                cat_tag = catname.lower()
-                if not cat_tag in mdd_categories['by_cat']:
-                    mdd_categories['by_cat'][cat_tag] = {}
-                    mdd_categories['by_cat'][cat_tag]['value'] = -1
-                    mdd_categories['by_cat'][cat_tag]['catname'] = catname
-                    mdd_categories['by_cat'][cat_tag]['usage_sl']  = []
-                    mdd_categories['by_cat'][cat_tag]['usage_var'] = []
-
-                # --------------------------------------------------------------
-                # Add the shared list to the variable's usage list
-                # --------------------------------------------------------------
-                mdd_categories['by_cat'][cat_tag]['usage_sl'].append(sl_name)
+        if not node.name == "page":
+            continue
 
         # ----------------------------------------------------------------------
-        # Make an area in the data structure for this shared list
+        # THIS NEEDS TO BE DONE
         # ----------------------------------------------------------------------
-        mdd_categories['shared'][sl_name] = {}
-        mdd_categories['shared'][sl_name]['id']     = sl_id
-        mdd_categories['shared'][sl_name]['name']   = node.attrs['name']
-        mdd_categories['shared'][sl_name]['props']  = sl_props
-        mdd_categories['shared'][sl_name]['notes']  = sl_notes
-        mdd_categories['shared'][sl_name]['labels'] = sl_labels
-        mdd_categories['shared'][sl_name]['cats']   = sl_cats
-        mdd_categories['shared'][sl_name]['usage_var'] = []
+        #print(node)
 
     # --------------------------------------------------------------------------
-    # Make a second pass through the shared lists and add the actual categories
-    # we can't always do this on the first pass because it is possible that
-    # nested shared lists are not defined before they are used in the sequence.
+    # 'Other' text fields
     # --------------------------------------------------------------------------
+    mdd_othervars = {}
     for node in raw_definition:
         # ----------------------------------------------------------------------
-        # 'categories' indicates a shared list definition
+        # only other type
         # ----------------------------------------------------------------------
-        if not node.name == "categories":
+        if not node.name == "othervariable":
             continue
 
         # ----------------------------------------------------------------------
-        # Re-get the name, and skip past if we've already done this one
+        # THIS NEEDS TO BE DONE
         # ----------------------------------------------------------------------
-        sl_name = node.attrs['name'].lower()
+        #print(node)
 
-        if not sl_name in nested_sl:
+    # --------------------------------------------------------------------------
+    # What are we missing from the varible definition
+    # --------------------------------------------------------------------------
+    for node in raw_definition:
+        if type(node) == bs4.element.NavigableString:
+            continue
+        if node.name in ["variable","categories","page","othervariable"]:
             continue
+        print("UNDOCUMENTED NODE WITHIN DEFINITIONS      ", child.encode('utf-8'))
 
-        # ----------------------------------------------------------------------
-        # Get the category data
-        # ----------------------------------------------------------------------
-        sl_cats = retrieve_categories(node, mdd_categories['shared'])
 
-        # ----------------------------------------------------------------------
-        # Run back through the categories we just parsed and flag their
-        # usage in the other section
-        # ----------------------------------------------------------------------
-        for catname in sl_cats['list']:
-            # ------------------------------------------------------------------
-            # Sometimes there is something referenced in a shared list that 
-            # never actually gets used anywhere - it wouldn't have been in the
-            # category map if that's the case, but we'll still make an entry
-            # ------------------------------------------------------------------
-            cat_tag = catname.lower()
-            if not cat_tag in mdd_categories['by_cat']:
-                mdd_categories['by_cat'][cat_tag] = {}
-                mdd_categories['by_cat'][cat_tag]['value'] = -1
-                mdd_categories['by_cat'][cat_tag]['catname'] = catname
-                mdd_categories['by_cat'][cat_tag]['usage_sl']  = []
-                mdd_categories['by_cat'][cat_tag]['usage_var'] = []
+    # --------------------------------------------------------------------------
+    # Routing scripts
+    # --------------------------------------------------------------------------
+    mdd_routing = {}
+    for item in raw_design_routings.scripts:
+        parse_routing_node(item, mdd_routing)
 
-            # ------------------------------------------------------------------
-            # Add the shared list to the variable's usage list
-            # ------------------------------------------------------------------
-            mdd_categories['by_cat'][cat_tag]['usage_sl'].append(sl_name)
+    # --------------------------------------------------------------------------
+    # Build a single structure to hold the things we have so far...we need 
+    # to pass this stuff in to get some more complex parts
+    # --------------------------------------------------------------------------
+    mdd_info = {}
+    mdd_info['properties']  = mdd_properties
+    mdd_info['languages']   = mdd_languages
+    mdd_info['categories']  = mdd_categories
+    mdd_info['variables']   = mdd_variables
+    mdd_info['routing']     = mdd_routing
+    mdd_info['pages']       = mdd_pages
+    mdd_info['othervars']   = mdd_othervars
+    mdd_info['savelogs']    = mdd_savelogs
 
-        # ----------------------------------------------------------------------
-        # Overwrite this info in the data for this list that was started before
-        # ----------------------------------------------------------------------
-        mdd_categories['shared'][sl_name]['cats'] = sl_cats
+    # --------------------------------------------------------------------------
+    # compile as a master list of variables for easy reference
+    # --------------------------------------------------------------------------
+    mdd_master = {}
+    mdd_master['list'] = []
+    mdd_master['info'] = {}
 
     # --------------------------------------------------------------------------
-    # Go through the definitions and gather information about variables
+    # First pass on the master is the system-level section
+    # --------------------------------------------------------------------------
+    for node in raw_system:
+        node_data = parse_metadata_field(mdd_info, node, 0, [], [], {}, [])
+        mdd_master['list'].extend(node_data['list'])
+        mdd_master['info'].update(node_data['info'])
+
+    # --------------------------------------------------------------------------
+    # Then go through the fields section and do the same thing
+    # --------------------------------------------------------------------------
+    for node in raw_design_fields:
+        node_data = parse_metadata_field(mdd_info, node, 0, [], [], {}, [])
+        mdd_master['list'].extend(node_data['list'])
+        mdd_master['info'].update(node_data['info'])
+
+    # --------------------------------------------------------------------------
+    # Response types, category usage and the question list
+    # --------------------------------------------------------------------------
+    compile_mdd_master(mdd_info, mdd_master)
+
     # --------------------------------------------------------------------------
+    # Finish
+    # --------------------------------------------------------------------------
+    return mdd_info
+
+# ------------------------------------------------------------------------------
+# Removes the <text> elements whose language is not in languages (lowercase),
+# each with the whitespace after it, like ElementTree's remove() does in
+# parse_mdd_stream
+# ------------------------------------------------------------------------------
+def drop_other_languages(mdd_data, languages):
+    for node in mdd_data.find_all("text"):
+        if node.attrs.get('xml:lang', "").lower() in languages:
+            continue
+        tail = node.next_sibling
+        if isinstance(tail, bs4.NavigableString):
+            tail.extract()
+        node.extract()
+    return mdd_data
+
+# ------------------------------------------------------------------------------
+# Streaming version of parse_mdd, gives back the same structure. The file is
+# read once with ElementTree's iterparse and each savelog, language, category
+# map entry, definition, field and routing script is handled as soon as its
+# closing tag is read, then dropped, so memory stays flat however big the MDD
+# is. Everything is handed to the same helpers parse_mdd uses, wrapped in an
+# MddNode (see below) so they see what they would get from bs4. Text in other
+# languages than the ones asked for is dropped before it's even wrapped.
+# ------------------------------------------------------------------------------
+def parse_mdd_stream(mdd_file, languages=None):
+    # --------------------------------------------------------------------------
+    # Start
+    # --------------------------------------------------------------------------
+    print("...streaming mdd file " + mdd_file + "...")
+
+    mdd_savelogs   = {}
+    mdd_languages  = {}
+    mdd_routing    = {}
+    mdd_pages      = {}
+    mdd_othervars  = {}
+
+    mdd_categories = {}
+    mdd_categories['by_cat'] = {}
+    mdd_categories['shared'] = {}
+    mdd_categories['by_question'] = {}
+    mdd_categories['sl_order'] = []
+
     mdd_variables = {}
     mdd_variables['var_defs'] = {}
 
-    for node in raw_definition:
+    mdd_info = {}
+    mdd_info['properties']  = {}
+    mdd_info['languages']   = mdd_languages
+    mdd_info['categories']  = mdd_categories
+    mdd_info['variables']   = mdd_variables
+    mdd_info['routing']     = mdd_routing
+    mdd_info['pages']       = mdd_pages
+    mdd_info['othervars']   = mdd_othervars
+    mdd_info['savelogs']    = mdd_savelogs
+
+    mdd_master = {}
+    mdd_master['list'] = []
+    mdd_master['info'] = {}
+
+    # --------------------------------------------------------------------------
+    # The category map can come after the definitions, so the shared list
+    # usage is kept in order and laid over the map once everything is read
+    # --------------------------------------------------------------------------
+    by_catmap = {}
+    sl_usage  = []
+
+    # --------------------------------------------------------------------------
+    # Things that have to wait: nested shared lists until every list has been
+    # seen, variables that use a list we don't have yet, and system/design
+    # fields until the variable definitions are complete (system first)
+    # --------------------------------------------------------------------------
+    nested_sl       = {}
+    deferred_vars   = []
+    pending_system  = []
+    pending_fields  = []
+    definition_done = False
+    system_done     = False
+
+    def add_to_master(node):
+        node_data = parse_metadata_field(mdd_info, node, 0, [], [], {}, [])
+        mdd_master['list'].extend(node_data['list'])
+        mdd_master['info'].update(node_data['info'])
+
+    def finish_definition():
+        for sl_name in shared_list_order(nested_sl):
+            mdd_categories['shared'][sl_name]['cats'] = retrieve_categories(nested_sl[sl_name]['node'],
+                                                                            mdd_categories['shared'],
+                                                                            cat_nodes=nested_sl[sl_name]['cat_nodes'])
+            mdd_categories['sl_order'].append(sl_name)
+        for sl_name in nested_sl:
+            sl_usage.append((sl_name, mdd_categories['shared'][sl_name]['cats']))
+        for node in deferred_vars:
+            var_id, var_def = parse_variable_node(node, mdd_categories['shared'])
+            mdd_variables['var_defs'][var_id] = var_def
+        nested_sl.clear()
+        deferred_vars.clear()
+
+    # --------------------------------------------------------------------------
+    # Which elements get handed over, by their path below <metadata>
+    # --------------------------------------------------------------------------
+    unit_paths = {}
+    unit_paths[('properties',)]                      = 'properties'
+    unit_paths[('savelogs', '*')]                    = 'savelog'
+    unit_paths[('languages', '*')]                   = 'language'
+    unit_paths[('categorymap', '*')]                 = 'categorymap'
+    unit_paths[('definition', '*')]                  = 'definition'
+    unit_paths[('system', '*')]                      = 'system'
+    unit_paths[('design', 'fields', '*')]            = 'field'
+    unit_paths[('design', 'routings', 'scripts', '*')] = 'routing'
+
+    if languages is not None:
+        languages = set(lang.lower() for lang in languages)
+    prefixes = {}
+    stack    = []
+    path     = []
+    top      = None
+    unit     = None
+    kind     = None
+    for event, element in ElementTree.iterparse(mdd_file, events=('start', 'end', 'start-ns')):
+        # ----------------------------------------------------------------------
+        # Namespace prefixes, so attribute names come out like bs4's (xml:lang)
+        # ----------------------------------------------------------------------
+        if event == 'start-ns':
+            prefixes[element[1]] = element[0]
+            continue
+
         # ----------------------------------------------------------------------
-        # 'variable' indicates an individual variable
+        # Opening tags just track where we are
         # ----------------------------------------------------------------------
-        if not node.name == "variable":
+        if event == 'start':
+            stack.append(element)
+            if top is None:
+                if mdd_local_name(element.tag) == "metadata":
+                    top = len(stack)
+                continue
+            path.append(mdd_local_name(element.tag))
+            if unit is None:
+                kind = unit_paths.get(tuple(path), unit_paths.get(tuple(path[:-1]) + ('*',)))
+                if kind is not None:
+                    unit = len(stack)
             continue
 
         # ----------------------------------------------------------------------
-        # Skip past nodes that are nothing
+        # Closing tags. Anything inside a unit stays until the unit is done
         # ----------------------------------------------------------------------
-        if not node:
+        depth = len(stack)
+        stack.pop()
+        if top is None or depth <= top:
+            continue
+        if unit is not None and depth > unit:
+            path.pop()
+            if languages is not None and element.tag == "text":
+                if not element.attrib.get(xml_lang, "").lower() in languages:
+                    stack[-1].remove(element)
             continue
 
+        name = path.pop()
+
+        if unit == depth:
+            node = MddNode(element, None, prefixes)
+            unit = None
+
+            if kind == 'properties':
+                mdd_info['properties'] = retrieve_properties(node)
+
+            elif kind == 'savelog':
+                parse_savelog_node(node, mdd_savelogs)
+
+            elif kind == 'language':
+                parse_language_node(node, mdd_languages)
+
+            elif kind == 'categorymap':
+                parse_categorymap_node(node, by_catmap)
+
+            elif kind == 'definition':
+                # --------------------------------------------------------------
+                # Shared lists, nested ones wait for the end of the section
+                # --------------------------------------------------------------
+                if node.name == "categories":
+                    sl_name = node.attrs['name'].lower()
+                    sl_entry = index_shared_list(node)
+                    mdd_categories['shared'][sl_name] = start_shared_list(node)
+                    if sl_entry['nested']:
+                        nested_sl[sl_name] = sl_entry
+                    else:
+                        sl_cats = retrieve_categories(node, mdd_categories['shared'], cat_nodes=sl_entry['cat_nodes'])
+                        mdd_categories['shared'][sl_name]['cats'] = sl_cats
+                        mdd_categories['sl_order'].append(sl_name)
+                        sl_usage.append((sl_name, sl_cats))
+
+                # --------------------------------------------------------------
+                # Variables, unless a shared list they use isn't complete yet.
+                # The placeholder keeps var_defs in document order
+                # --------------------------------------------------------------
+                elif node.name == "variable":
+                    if shared_lists_ready(node, mdd_categories['shared']):
+                        var_id, var_def = parse_variable_node(node, mdd_categories['shared'])
+                        mdd_variables['var_defs'][var_id] = var_def
+                    else:
+                        mdd_variables['var_defs'][node.attrs['id']] = None
+                        deferred_vars.append(node)
+
+                elif node.name in ["page","othervariable"]:
+                    pass
+
+                else:
+                    print("UNDOCUMENTED NODE WITHIN DEFINITIONS      ", node.encode('utf-8'))
+
+            elif kind == 'system':
+                if definition_done:
+                    add_to_master(node)
+                else:
+                    pending_system.append(node)
+
+            elif kind == 'field':
+                if definition_done and system_done:
+                    add_to_master(node)
+                else:
+                    pending_fields.append(node)
+
+            elif kind == 'routing':
+                parse_routing_node(node, mdd_routing)
+
         # ----------------------------------------------------------------------
-        # Skip past nodes that are not tags
+        # End of a whole section
         # ----------------------------------------------------------------------
-        if not type(node) == bs4.element.Tag:
-            continue
+        if depth == top + 1:
+            if name == "definition":
+                finish_definition()
+                definition_done = True
+                for node in pending_system:
+                    add_to_master(node)
+                pending_system.clear()
+
+            elif name == "system":
+                system_done = True
+
+            if definition_done and system_done:
+                for node in pending_fields:
+                    add_to_master(node)
+                pending_fields.clear()
 
         # ----------------------------------------------------------------------
-        # Get the components
+        # Done with this element, drop it from the tree
         # ----------------------------------------------------------------------
-        var_name   = node.attrs['name']
-        var_id     = node.attrs['id']
-        var_typen  = node.attrs['type']
-        var_type   = metadata_type_name(var_typen)
-        var_attrs  = retrieve_attributes(node, ['name','id','type'])
-        var_props  = retrieve_properties(node.properties)
-        var_notes  = retrieve_properties(node.notes)
-        var_styles = retrieve_properties(node.styles)
-        var_labels = retrieve_labels(node.labels)
-        var_cats   = retrieve_categories(node.categories, mdd_categories['shared'])
-        var_helper = retrieve_helpers(node.helperfields)
-        var_axis   = retrieve_axis_exp(node.axis)
-        var_tmplt  = retrieve_properties(node.templates)
-        var_lstyle = retrieve_properties(node.labelstyles)
+        stack[-1].remove(element)
 
-        if False:
-            print("-------------------------------------------------")
-            print(node.encode('utf-8'))
-            print("    var_name:   ", var_name)
-            print("    var_id:     ", var_id)
-            print("    var_type:   ", var_type)
-            print("    var_attrs:  ", var_attrs)
-            print("    var_props:  ", var_props)
-            print("    var_notes:  ", var_notes)
-            print("    var_styles: ", var_styles)
-            print("    var_helper: ", var_helper)
-            print("    var_axis:   ", var_axis)
-            print("    var_labels: ", str(var_labels).encode('utf-8'))
-            print("    var_cats:   ", str(var_cats).encode('utf-8'))
-            print("---------------------------------")
-            something = retrieve_categories(node.categories, mdd_categories['shared'], fdebug=True)
-
-        # ----------------------------------------------------------------------
-        # Make a structure
-        # ----------------------------------------------------------------------
-        mdd_variables['var_defs'][var_id] = {}
-        mdd_variables['var_defs'][var_id]['name']     = var_name
-        mdd_variables['var_defs'][var_id]['type']     = var_type
-        mdd_variables['var_defs'][var_id]['labels']   = var_labels
-        if var_attrs:
-            mdd_variables['var_defs'][var_id]['attrs']  = var_attrs
-        if var_type == "categorical":
-            mdd_variables['var_defs'][var_id]['cats']   = var_cats
-            mdd_variables['var_defs'][var_id]['shared_lists'] = []
-        if var_props:
-            mdd_variables['var_defs'][var_id]['props']  = var_props
-        if var_notes:
-            mdd_variables['var_defs'][var_id]['notes']  = var_notes
-        if var_styles:
-            mdd_variables['var_defs'][var_id]['styles'] = var_styles
-        if var_helper:
-            mdd_variables['var_defs'][var_id]['helper'] = var_helper
-        if var_axis:
-            mdd_variables['var_defs'][var_id]['axis']   = var_axis
-        if var_tmplt:
-            mdd_variables['var_defs'][var_id]['templates'] = var_tmplt
-        if var_lstyle:
-            mdd_variables['var_defs'][var_id]['labelstyles'] = var_lstyle
-
-        # ----------------------------------------------------------------------
-        # Check if there's anything that we didn't account for
-        # ----------------------------------------------------------------------
-        for child in node:
-            if type(child) == bs4.element.NavigableString:
-                continue
-            if child.name in ['versions','DIFF']:
-                continue
-            if child.name in ['properties','notes','labels','categories','styles','helperfields','axis','templates','labelstyles']:
-                continue
-            print("IGNORING UNDOCUMENTED NODE WITHIN VARIABLE      ", child.encode('utf-8'))
+    # --------------------------------------------------------------------------
+    # Whatever is still waiting (a file without a system section, or with the
+    # sections in an unusual order)
+    # --------------------------------------------------------------------------
+    finish_definition()
+    for node in pending_system + pending_fields:
+        add_to_master(node)
 
     # --------------------------------------------------------------------------
-    # Go through and flag the pages
+    # Category map first, then the shared list usage in parse_mdd's order
     # --------------------------------------------------------------------------
-    mdd_pages = {}
-    for node in raw_definition:
+    for sl_name, sl_cats in sl_usage:
+        flag_shared_list_usage(by_catmap, sl_name, sl_cats)
+    mdd_categories['by_cat'] = by_catmap
+
+    # --------------------------------------------------------------------------
+    # Response types, category usage and the question list
+    # --------------------------------------------------------------------------
+    compile_mdd_master(mdd_info, mdd_master)
+
+    # --------------------------------------------------------------------------
+    # Finish
+    # --------------------------------------------------------------------------
+    return mdd_info
+
+# ------------------------------------------------------------------------------
+# Persistent cache of parsed MDDs. One SQLite file holds the zlib-compressed
+# JSON of each parsed MDD, keyed by its path and checked against the file's
+# size, mtime and sha256. JSON rather than pickle, so whoever can write the
+# cache can't make it run code. Bump mdd_cache_version when the parsed
+# structure changes so old entries get thrown away.
+# ------------------------------------------------------------------------------
+mdd_cache_version = 6
+
+# ------------------------------------------------------------------------------
+# The cache is per user: %LOCALAPPDATA% on Windows, $XDG_CACHE_HOME or
+# ~/.cache elsewhere
+# ------------------------------------------------------------------------------
+def mdd_cache_file():
+    if os.name == 'nt' and os.environ.get('LOCALAPPDATA'):
+        cache_dir = os.path.join(os.environ['LOCALAPPDATA'], "TotalTabPlus")
+    else:
+        cache_dir = os.path.join(os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser("~"), ".cache"),
+                                 "totaltabplus")
+    return os.path.join(cache_dir, "mdd_cache.sqlite")
+
+# ------------------------------------------------------------------------------
+# JSON has no tuples, sets or non-string keys, the parsed MDD has all three.
+# Those are wrapped in a one-key object and unwrapped again on the way back.
+# Things referenced from more than one place (a shared list's categories are
+# referenced from every variable using it) are written once, with a number,
+# and referenced by that number after that, so they stay shared
+# ------------------------------------------------------------------------------
+mdd_cache_tags = ("__tuple__", "__set__", "__items__", "__def__", "__ref__")
+mdd_cache_plain = (str, int, float, bool, type(None))
+mdd_cache_str   = {str}
+
+def mdd_cache_count_refs(obj, counts):
+    stack = [obj]
+    while stack:
+        obj = stack.pop()
+        if type(obj) in mdd_cache_plain:
+            continue
+        counts[id(obj)] = counts.get(id(obj), 0) + 1
+        if counts[id(obj)] > 1:
+            continue
+        if isinstance(obj, dict):
+            stack.extend(obj.keys())
+            stack.extend(obj.values())
+        elif isinstance(obj, (list, tuple, set, frozenset)):
+            stack.extend(obj)
+    return counts
+
+def mdd_cache_encode(obj, counts, refs):
+    # --------------------------------------------------------------------------
+    # Millions of these, mostly strings, so plain values are let through
+    # before any call is made for them
+    # --------------------------------------------------------------------------
+    kind = type(obj)
+    if kind in mdd_cache_plain:
+        return obj
+    if id(obj) in refs:
+        return {"__ref__": refs[id(obj)]}
+
+    if kind is list:
+        data = [x if type(x) in mdd_cache_plain else mdd_cache_encode(x, counts, refs) for x in obj]
+    elif kind is tuple:
+        data = {"__tuple__": [x if type(x) in mdd_cache_plain else mdd_cache_encode(x, counts, refs) for x in obj]}
+    elif isinstance(obj, dict):
+        if set(map(type, obj)) <= mdd_cache_str and obj.keys().isdisjoint(mdd_cache_tags):
+            data = {key: value if type(value) in mdd_cache_plain else mdd_cache_encode(value, counts, refs)
+                    for key, value in obj.items()}
+        else:
+            data = {"__items__": [[mdd_cache_encode(key, counts, refs), mdd_cache_encode(value, counts, refs)]
+                                  for key, value in obj.items()]}
+    elif isinstance(obj, (set, frozenset)):
+        data = {"__set__": [mdd_cache_encode(x, counts, refs) for x in obj]}
+    elif isinstance(obj, str):
+        return str(obj)
+    else:
+        raise TypeError("can't cache " + kind.__name__ + " in a parsed MDD")
+
+    if counts[id(obj)] > 1:
+        refs[id(obj)] = len(refs)
+        data = {"__def__": refs[id(obj)], "__value__": data}
+    return data
+
+def mdd_cache_dumps(mdd_info):
+    counts = mdd_cache_count_refs(mdd_info, {})
+    data = mdd_cache_encode(mdd_info, counts, {})
+    return zlib.compress(json.dumps(data, separators=(',', ':')).encode('utf-8'))
+
+# ------------------------------------------------------------------------------
+# Objects are decoded innermost first and in file order, so a definition is
+# always in refs by the time something refers to it
+# ------------------------------------------------------------------------------
+def mdd_cache_loads(data):
+    refs = {}
+
+    def decode_object(obj):
+        if len(obj) == 1:
+            if "__tuple__" in obj:
+                return tuple(obj["__tuple__"])
+            if "__ref__" in obj:
+                return refs[obj["__ref__"]]
+            if "__set__" in obj:
+                return set(obj["__set__"])
+            if "__items__" in obj:
+                return {key: value for key, value in obj["__items__"]}
+        elif len(obj) == 2 and "__def__" in obj:
+            refs[obj["__def__"]] = obj["__value__"]
+            return obj["__value__"]
+        return obj
+
+    return json.loads(zlib.decompress(data).decode('utf-8'), object_hook=decode_object)
+
+# ------------------------------------------------------------------------------
+# The mdd_info in a cache row, None when there's no row or its data can't be
+# read back (truncated or corrupt blob, bad text, broken references). Such an
+# entry is a miss, it gets parsed again and overwritten
+# ------------------------------------------------------------------------------
+def mdd_cache_entry(row):
+    if row is None:
+        return None
+    try:
+        return mdd_cache_loads(row[0])
+    except (zlib.error, ValueError, KeyError, TypeError):
+        return None
+
+def mdd_file_signature(mdd_file, with_hash=True):
+    stat = os.stat(mdd_file)
+    signature = {}
+    signature['path']  = os.path.abspath(mdd_file)
+    signature['size']  = stat.st_size
+    signature['mtime'] = stat.st_mtime_ns
+    signature['sha']   = None
+    if with_hash:
+        sha = hashlib.sha256()
+        with open(mdd_file, 'rb') as f:
+            for block in iter(lambda: f.read(1024 * 1024), b''):
+                sha.update(block)
+        signature['sha'] = sha.hexdigest()
+    return signature
+
+def open_mdd_cache(cache_file=None):
+    if cache_file is None:
+        cache_file = mdd_cache_file()
+        os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+    conn = sqlite3.connect(cache_file)
+    # caches from before the language selection was part of the key
+    columns = [row[1] for row in conn.execute('PRAGMA table_info(mdd_cache)')]
+    if columns and not 'languages' in columns:
+        conn.execute('DROP TABLE mdd_cache')
+    conn.execute('CREATE TABLE IF NOT EXISTS mdd_cache (path TEXT, languages TEXT, size INTEGER, mtime INTEGER, '
+                 'sha TEXT, version INTEGER, data BLOB, PRIMARY KEY (path, languages))')
+    return conn
+
+# ------------------------------------------------------------------------------
+# parse_mdd with the cache in front of it. A matching path/size/mtime is taken
+# as is (no hashing). Otherwise the file is hashed, and the same content seen
+# before under this or another path is reused; only new content gets parsed.
+# The cache defaults to the per-user mdd_cache_file(). Each language
+# selection (see parse_mdd) is cached separately. A cache that can't be
+# opened, read or written is skipped and the MDD just gets parsed, an entry
+# that can't be loaded is parsed again and replaced.
+# ------------------------------------------------------------------------------
+def parse_mdd_cached(mdd_file, cache_file=None, parser=None, languages=None):
+    # --------------------------------------------------------------------------
+    # Start
+    # --------------------------------------------------------------------------
+    if parser is None:
+        parser = parse_mdd_stream
+    langkey = ""
+    if languages is not None:
+        langkey = ",".join(sorted(set(lang.lower() for lang in languages)))
+
+    signature = mdd_file_signature(mdd_file, with_hash=False)
+    try:
+        conn = open_mdd_cache(cache_file)
+    except (sqlite3.Error, OSError):
+        return parser(mdd_file, languages=languages)
+
+    mdd_info = None
+    try:
         # ----------------------------------------------------------------------
-        # only page type
+        # Same file, untouched since it was cached
         # ----------------------------------------------------------------------
-        if not node.name == "page":
-            continue
+        row = conn.execute('SELECT data FROM mdd_cache WHERE path = ? AND languages = ? AND size = ? AND mtime = ? AND version = ?',
+                           (signature['path'], langkey, signature['size'], signature['mtime'], mdd_cache_version)).fetchone()
+        mdd_info = mdd_cache_entry(row)
+        if mdd_info is not None:
+            return mdd_info
 
         # ----------------------------------------------------------------------
-        # THIS NEEDS TO BE DONE
+        # Touched, copied or renamed but the same content
         # ----------------------------------------------------------------------
-        #print(node)
+        signature = mdd_file_signature(mdd_file)
+        row = conn.execute('SELECT data FROM mdd_cache WHERE sha = ? AND languages = ? AND size = ? AND version = ?',
+                           (signature['sha'], langkey, signature['size'], mdd_cache_version)).fetchone()
+        mdd_info = mdd_cache_entry(row)
+        if mdd_info is not None:
+            data = row[0]
 
-    # --------------------------------------------------------------------------
-    # 'Other' text fields
-    # --------------------------------------------------------------------------
-    mdd_othervars = {}
-    for node in raw_definition:
         # ----------------------------------------------------------------------
-        # only other type
+        # New content (or an entry that won't load), parse it
         # ----------------------------------------------------------------------
-        if not node.name == "othervariable":
+        else:
+            mdd_info = parser(mdd_file, languages=languages)
+            data = mdd_cache_dumps(mdd_info)
+
+        with conn:
+            conn.execute('INSERT OR REPLACE INTO mdd_cache VALUES (?, ?, ?, ?, ?, ?, ?)',
+                         (signature['path'], langkey, signature['size'], signature['mtime'], signature['sha'],
+                          mdd_cache_version, data))
+
+    # --------------------------------------------------------------------------
+    # Locked, read-only or broken cache: do without it
+    # --------------------------------------------------------------------------
+    except sqlite3.Error:
+        if mdd_info is None:
+            mdd_info = parser(mdd_file, languages=languages)
+    finally:
+        conn.close()
+
+    # --------------------------------------------------------------------------
+    # Finish
+    # --------------------------------------------------------------------------
+    return mdd_info
+
+# ------------------------------------------------------------------------------
+# Drop one MDD (or everything) from the cache, for every language selection
+# ------------------------------------------------------------------------------
+def clear_mdd_cache(cache_file=None, mdd_file=None):
+    conn = open_mdd_cache(cache_file)
+    try:
+        with conn:
+            if mdd_file is None:
+                conn.execute('DELETE FROM mdd_cache')
+            else:
+                conn.execute('DELETE FROM mdd_cache WHERE path = ?', (os.path.abspath(mdd_file),))
+    finally:
+        conn.close()
+
+# ------------------------------------------------------------------------------
+# Can this variable be parsed now, i.e. does every shared list it references
+# already have its categories
+# ------------------------------------------------------------------------------
+def shared_lists_ready(node, shared_info):
+    for cnode, offset in category_nodes(node):
+        if not cnode.name == "categories" or not 'ref_name' in cnode.attrs:
+            continue
+        sltag = shared_list_tag(cnode.attrs['ref_name'])
+        if not sltag in shared_info or shared_info[sltag]['cats'] is None:
+            return False
+    return True
+
+# ------------------------------------------------------------------------------
+# Element and attribute names without the {namespace} ElementTree puts on them,
+# attributes keep their prefix the way bs4 does (xml:lang)
+# ------------------------------------------------------------------------------
+xml_namespace = "http://www.w3.org/XML/1998/namespace"
+xml_lang      = "{" + xml_namespace + "}lang"
+
+def mdd_local_name(tag):
+    if tag[:1] == "{":
+        return tag.split("}", 1)[1]
+    return tag
+
+def mdd_attr_name(key, prefixes):
+    if key[:1] != "{":
+        return key
+    namespace, name = key[1:].split("}", 1)
+    prefix = "xml" if namespace == xml_namespace else prefixes.get(namespace)
+    if prefix:
+        return prefix + ":" + name
+    return name
+
+class MddNode:
+    """
+    Read-only stand-in for a bs4 Tag, built from an ElementTree element, with
+    the parts of the Tag interface the MDD helpers use: name, attrs, parent,
+    iteration/children over child tags, descendants, contents, string,
+    find/find_all, find_parent, parentGenerator and node.<tag> lookups of the
+    first descendant with that name.
+    """
+    __slots__ = ('name', 'attrs', 'parent', 'nodes', 'contents')
+
+    def __init__(self, element, parent=None, prefixes=None):
+        prefixes = prefixes or {}
+        self.name = mdd_local_name(element.tag)
+        self.attrs = {mdd_attr_name(key, prefixes): value for key, value in element.attrib.items()}
+        self.parent = parent
+        self.nodes = []
+        self.contents = []
+        if element.text:
+            self.contents.append(element.text)
+        for child in element:
+            node = MddNode(child, self, prefixes)
+            self.nodes.append(node)
+            self.contents.append(node)
+            if child.tail:
+                self.contents.append(child.tail)
+
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+        return self.find(name)
+
+    def __iter__(self):
+        return iter(self.nodes)
+
+    def __bool__(self):
+        return True
+
+    @property
+    def children(self):
+        return iter(self.nodes)
+
+    @property
+    def descendants(self):
+        # document order, without a generator per level
+        stack = self.nodes[::-1]
+        while stack:
+            node = stack.pop()
+            yield node
+            if node.nodes:
+                stack.extend(node.nodes[::-1])
+
+    @property
+    def string(self):
+        if len(self.contents) != 1:
+            return None
+        if isinstance(self.contents[0], str):
+            return self.contents[0]
+        return self.contents[0].string
+
+    def find(self, name):
+        for node in self.descendants:
+            if node.name == name:
+                return node
+        return None
+
+    def find_all(self, names):
+        if isinstance(names, str):
+            names = [names]
+        return [node for node in self.descendants if node.name in names]
+
+    def find_parent(self):
+        return self.parent
+
+    def parentGenerator(self):
+        node = self.parent
+        while node is not None:
+            yield node
+            node = node.parent
+
+    def encode(self, encoding='utf-8'):
+        attrs = "".join(' ' + key + '="' + value + '"' for key, value in self.attrs.items())
+        return ("<" + self.name + attrs + ">").encode(encoding)
+
+# ------------------------------------------------------------------------------
+# One savelogs entry, keyed by its date
+# ------------------------------------------------------------------------------
+def parse_savelog_node(node, mdd_savelogs):
+    # --------------------------------------------------------------------------
+    # Get the things
+    # --------------------------------------------------------------------------
+    sdate = node.attrs['date']
+    sfver = node.attrs['fileversion']
+    svset = node.attrs['versionset']
+    suser = node.attrs['username']
+
+    if 'count' in node.attrs:
+        scount = node.attrs['count']
+    else:
+        scount = 1
+
+    # --------------------------------------------------------------------------
+    # Make the record
+    # --------------------------------------------------------------------------
+    mdd_savelogs[sdate] = {}
+    mdd_savelogs[sdate]['fileversion'] = sfver
+    mdd_savelogs[sdate]['versionset']  = svset
+    mdd_savelogs[sdate]['username']    = suser
+    mdd_savelogs[sdate]['count']       = scount
+
+    return mdd_savelogs
+
+# ------------------------------------------------------------------------------
+# One language entry: its properties plus the language id
+# ------------------------------------------------------------------------------
+def parse_language_node(node, mdd_languages):
+    if node.name == "versions":
+        return mdd_languages
+    if node.name == "deleted":
+        return mdd_languages
+    if not 'name' in node.attrs:
+        return mdd_languages
+    lname = node.attrs['name']
+    mdd_languages[lname] = retrieve_properties(node.properties)
+    mdd_languages[lname]['langid'] = node.attrs['id']
+
+    return mdd_languages
+
+# ------------------------------------------------------------------------------
+# One category map entry, starts the by_cat structure for that category
+# ------------------------------------------------------------------------------
+def parse_categorymap_node(node, by_cat):
+    # --------------------------------------------------------------------------
+    # 'categoryid' is what these things are called
+    # --------------------------------------------------------------------------
+    if not node.name == "categoryid":
+        return by_cat
+
+    # --------------------------------------------------------------------------
+    # Grab what we need
+    # --------------------------------------------------------------------------
+    catname = node.attrs['name'].lower()
+    catval  = node.attrs['value']
+
+    # --------------------------------------------------------------------------
+    # Fill in the start of the structure for this category
+    # --------------------------------------------------------------------------
+    by_cat[catname] = {}
+    by_cat[catname]['value'] = catval
+    by_cat[catname]['catname'] = node.attrs['name']
+    by_cat[catname]['usage_sl']  = []
+    by_cat[catname]['usage_var'] = []
+
+    return by_cat
+
+# ------------------------------------------------------------------------------
+# Record that a shared list or a variable uses a category. Sometimes there is
+# something referenced that never actually gets used anywhere - it wouldn't
+# have been in the category map if that's the case, but we'll still make an
+# entry
+# ------------------------------------------------------------------------------
+def add_category_usage(by_cat, cat_tag, catname, usage, name):
+    if not cat_tag in by_cat:
+        by_cat[cat_tag] = {}
+        by_cat[cat_tag]['value'] = -1
+        by_cat[cat_tag]['catname'] = catname
+        by_cat[cat_tag]['usage_sl']  = []
+        by_cat[cat_tag]['usage_var'] = []
+
+    by_cat[cat_tag][usage].append(name)
+
+    return by_cat
+
+# ------------------------------------------------------------------------------
+# Flag every category of a parsed shared list as used by that list
+# ------------------------------------------------------------------------------
+def flag_shared_list_usage(by_cat, sl_name, sl_cats):
+    for catname in sl_cats['list']:
+        add_category_usage(by_cat, catname.lower(), catname, 'usage_sl', sl_name)
+
+    return by_cat
+
+# ------------------------------------------------------------------------------
+# Start the structure for a shared list, its categories get filled in later
+# ------------------------------------------------------------------------------
+def start_shared_list(node):
+    sl_info = {}
+    sl_info['id']     = node.attrs['id']
+    sl_info['name']   = node.attrs['name']
+    sl_info['props']  = retrieve_properties(node.properties)
+    sl_info['notes']  = retrieve_properties(node.notes)
+    sl_info['labels'] = retrieve_labels(node.labels)
+    sl_info['cats']   = None
+    sl_info['usage_var'] = []
+
+    return sl_info
+
+# ------------------------------------------------------------------------------
+# Every categories/category node under root_node in document order, with how
+# many levels below root_node it is. One walk, no parent lookups, and no going
+# into the parts of a category that never hold categories (labels mostly,
+# which is where the bulk of a multi-language MDD is)
+# ------------------------------------------------------------------------------
+no_category_nodes = set(['labels','properties','notes','styles','labelstyles','templates','versions'])
+
+def category_nodes(root_node):
+    found = []
+    stack = [(child, 1) for child in reversed(list(root_node.children))]
+    while stack:
+        node, offset = stack.pop()
+        # bs4 text, comments and such are all strings
+        if isinstance(node, str) or node.name in no_category_nodes:
+            continue
+        if node.name in ['categories','category']:
+            found.append((node, offset))
+        stack.extend((child, offset + 1) for child in reversed(list(node.children)))
+    return found
+
+# ------------------------------------------------------------------------------
+# Index of a shared list: its category nodes, the shared lists it includes and
+# whether it nests other lists at all
+# ------------------------------------------------------------------------------
+def index_shared_list(node):
+    sl_entry = {}
+    sl_entry['node']      = node
+    sl_entry['cat_nodes'] = category_nodes(node)
+    sl_entry['refs']      = []
+    sl_entry['nested']    = False
+    for cnode, offset in sl_entry['cat_nodes']:
+        if cnode.name == "categories":
+            sl_entry['nested'] = True
+            if 'ref_name' in cnode.attrs:
+                sl_entry['refs'].append(shared_list_tag(cnode.attrs['ref_name']))
+    return sl_entry
+
+# ------------------------------------------------------------------------------
+# Shared lists in an order where every list comes after the ones it includes,
+# otherwise keeping the order of sl_index. Lists included from outside sl_index
+# are taken as already done
+# ------------------------------------------------------------------------------
+def shared_list_order(sl_index):
+    order = []
+    seen = set()
+    for sl_name in sl_index:
+        if sl_name in seen:
             continue
+        seen.add(sl_name)
+        stack = [(sl_name, iter(sl_index[sl_name]['refs']))]
+        while stack:
+            current, refs = stack[-1]
+            for ref in refs:
+                if ref in sl_index and not ref in seen:
+                    seen.add(ref)
+                    stack.append((ref, iter(sl_index[ref]['refs'])))
+                    break
+            else:
+                stack.pop()
+                order.append(current)
+    return order
 
-        # ----------------------------------------------------------------------
-        # THIS NEEDS TO BE DONE
-        # ----------------------------------------------------------------------
-        #print(node)
+# ------------------------------------------------------------------------------
+# Shared list tag from a ref_name, which can come with leading \ and .
+# ------------------------------------------------------------------------------
+def shared_list_tag(ref_name):
+    slname = ref_name
+    while slname.startswith("\\"):
+        slname = slname[1:]
+    while slname.startswith("."):
+        slname = slname[1:]
 
-    # --------------------------------------------------------------------------
-    # What are we missing from the varible definition
-    # --------------------------------------------------------------------------
-    for node in raw_definition:
-        if type(node) == bs4.element.NavigableString:
+    return slname.strip().lower()
+
+# ------------------------------------------------------------------------------
+# One variable definition, returns its id and the info structure for it
+# ------------------------------------------------------------------------------
+def parse_variable_node(node, shared_info):
+    # --------------------------------------------------------------------------
+    # Get the components
+    # --------------------------------------------------------------------------
+    var_name   = node.attrs['name']
+    var_id     = node.attrs['id']
+    var_typen  = node.attrs['type']
+    var_type   = metadata_type_name(var_typen)
+    var_attrs  = retrieve_attributes(node, ['name','id','type'])
+    var_props  = retrieve_properties(node.properties)
+    var_notes  = retrieve_properties(node.notes)
+    var_styles = retrieve_properties(node.styles)
+    var_labels = retrieve_labels(node.labels)
+    var_cats   = retrieve_categories(node.categories, shared_info)
+    var_helper = retrieve_helpers(node.helperfields)
+    var_axis   = retrieve_axis_exp(node.axis)
+    var_tmplt  = retrieve_properties(node.templates)
+    var_lstyle = retrieve_properties(node.labelstyles)
+
+    if False:
+        print("-------------------------------------------------")
+        print(node.encode('utf-8'))
+        print("    var_name:   ", var_name)
+        print("    var_id:     ", var_id)
+        print("    var_type:   ", var_type)
+        print("    var_attrs:  ", var_attrs)
+        print("    var_props:  ", var_props)
+        print("    var_notes:  ", var_notes)
+        print("    var_styles: ", var_styles)
+        print("    var_helper: ", var_helper)
+        print("    var_axis:   ", var_axis)
+        print("    var_labels: ", str(var_labels).encode('utf-8'))
+        print("    var_cats:   ", str(var_cats).encode('utf-8'))
+        print("---------------------------------")
+        something = retrieve_categories(node.categories, shared_info, fdebug=True)
+
+    # --------------------------------------------------------------------------
+    # Make a structure
+    # --------------------------------------------------------------------------
+    var_def = {}
+    var_def['name']     = var_name
+    var_def['type']     = var_type
+    var_def['labels']   = var_labels
+    if var_attrs:
+        var_def['attrs']  = var_attrs
+    if var_type == "categorical":
+        var_def['cats']   = var_cats
+        var_def['shared_lists'] = []
+    if var_props:
+        var_def['props']  = var_props
+    if var_notes:
+        var_def['notes']  = var_notes
+    if var_styles:
+        var_def['styles'] = var_styles
+    if var_helper:
+        var_def['helper'] = var_helper
+    if var_axis:
+        var_def['axis']   = var_axis
+    if var_tmplt:
+        var_def['templates'] = var_tmplt
+    if var_lstyle:
+        var_def['labelstyles'] = var_lstyle
+
+    # --------------------------------------------------------------------------
+    # Check if there's anything that we didn't account for
+    # --------------------------------------------------------------------------
+    for child in node:
+        if type(child) == bs4.element.NavigableString:
             continue
-        if node.name in ["variable","categories","page","othervariable"]:
+        if child.name in ['versions','DIFF']:
             continue
-        print("UNDOCUMENTED NODE WITHIN DEFINITIONS      ", child.encode('utf-8'))
+        if child.name in ['properties','notes','labels','categories','styles','helperfields','axis','templates','labelstyles']:
+            continue
+        print("IGNORING UNDOCUMENTED NODE WITHIN VARIABLE      ", child.encode('utf-8'))
 
+    # --------------------------------------------------------------------------
+    # Finish
+    # --------------------------------------------------------------------------
+    return var_id, var_def
 
+# ------------------------------------------------------------------------------
+# One scripttype node from the routings, each script in it is parsed and stored
+# ------------------------------------------------------------------------------
+def parse_routing_node(item, mdd_routing):
     # --------------------------------------------------------------------------
-    # Routing scripts
+    # It's nested inside a thing called scripttype
     # --------------------------------------------------------------------------
-    mdd_routing = {}
-    for item in raw_design_routings.scripts:
+    if item.name == "scripttype":
         # ----------------------------------------------------------------------
-        # It's nested inside a thing called scripttype
+        # There are script level properties as attributes
         # ----------------------------------------------------------------------
-        if item.name == "scripttype":
-            # ------------------------------------------------------------------
-            # There are script level properties as attributes
-            # ------------------------------------------------------------------
-            script_props = item.attrs
-
-            # ------------------------------------------------------------------
-            # Drill down to the script nodes and parse and store each one
-            # ------------------------------------------------------------------
-            for script in item.children:
-                if script.name == "script":
-                    sname = script.attrs['name']
-                    raw_script = script.contents[0][1:-1]
-                    script_info = parse_routing_script(raw_script.splitlines())
-                    script_dir  = compile_routing_script_directory(script_info)
+        script_props = item.attrs
 
-                    mdd_routing[sname] = {}
-                    mdd_routing[sname]['props']      = script_props
-                    mdd_routing[sname]['raw_script'] = raw_script
-                    mdd_routing[sname]['info']       = script_info
-                    mdd_routing[sname]['directory']  = script_dir
+        # ----------------------------------------------------------------------
+        # Drill down to the script nodes and parse and store each one
+        # ----------------------------------------------------------------------
+        for script in item.children:
+            if script.name == "script":
+                sname = script.attrs['name']
+                raw_script = script.contents[0][1:-1]
+                script_info = parse_routing_script(raw_script.splitlines())
+                script_dir  = compile_routing_script_directory(script_info)
 
-    # --------------------------------------------------------------------------
-    # Build a single structure to hold the things we have so far...we need 
-    # to pass this stuff in to get some more complex parts
-    # --------------------------------------------------------------------------
-    mdd_info = {}
-    mdd_info['properties']  = mdd_properties
-    mdd_info['languages']   = mdd_languages
-    mdd_info['categories']  = mdd_categories
-    mdd_info['variables']   = mdd_variables
-    mdd_info['routing']     = mdd_routing
-    mdd_info['pages']       = mdd_pages
-    mdd_info['othervars']   = mdd_othervars
-    mdd_info['savelogs']    = mdd_savelogs
+                mdd_routing[sname] = {}
+                mdd_routing[sname]['props']      = script_props
+                mdd_routing[sname]['raw_script'] = raw_script
+                mdd_routing[sname]['info']       = script_info
+                mdd_routing[sname]['directory']  = script_dir
 
-    # --------------------------------------------------------------------------
-    # compile as a master list of variables for easy reference
-    # --------------------------------------------------------------------------
-    mdd_master = {}
-    mdd_master['list'] = []
-    mdd_master['info'] = {}
+    return mdd_routing
 
-    # --------------------------------------------------------------------------
-    # First pass on the master is the system-level section
-    # --------------------------------------------------------------------------
-    for node in raw_system:
-        node_data = parse_metadata_field(mdd_info, node, 0, [], [], {}, [])
-        mdd_master['list'].extend(node_data['list'])
-        mdd_master['info'].update(node_data['info'])
+# ------------------------------------------------------------------------------
+# Last steps once the master list is built: single/multi flags, which variables
+# use each category (and through it which shared lists), the label store and
+# the question list
+# ------------------------------------------------------------------------------
+def compile_mdd_master(mdd_info, mdd_master):
+    mdd_categories = mdd_info['categories']
 
     # --------------------------------------------------------------------------
-    # Then go through the fields section and do the same thing
+    # Category id -> category info, from the shared lists and the variables
     # --------------------------------------------------------------------------
-    for node in raw_design_fields:
-        node_data = parse_metadata_field(mdd_info, node, 0, [], [], {}, [])
-        mdd_master['list'].extend(node_data['list'])
-        mdd_master['info'].update(node_data['info'])
+    mdd_categories['by_id'] = {}
+    for sl_name in mdd_categories['shared']:
+        sl_cats = mdd_categories['shared'][sl_name]['cats']
+        for catname in sl_cats['list']:
+            mdd_categories['by_id'].setdefault(sl_cats['info'][catname]['id'], sl_cats['info'][catname])
+    for var in mdd_master['list']:
+        if 'cats' in mdd_master['info'][var] and mdd_master['info'][var]['cats']:
+            for catname in mdd_master['info'][var]['cats']['list']:
+                catinfo = mdd_master['info'][var]['cats']['info'][catname]
+                mdd_categories['by_id'].setdefault(catinfo['id'], catinfo)
 
     # --------------------------------------------------------------------------
     # Add a flag for response type = single/multi
@@ -665,11 +1421,11 @@ def parse_mdd(mdd_file, fdebug=False):
         if mdd_master['info'][item]['type'] == "categorical":
             mdd_master['info'][item]['singlemulti'] = "multi"
 
-        # ------------------------------------------------------------------
+        # ----------------------------------------------------------------------
         # If there is an attribute section, then 'max' might be in there...
         # run through each and check if the numbers is >1; if it is, then
         # this is a multipunch
-        # ------------------------------------------------------------------
+        # ----------------------------------------------------------------------
         if 'attrs' in mdd_master['info'][item]:
             attrs = mdd_master['info'][item]['attrs']
             for attr in attrs:
@@ -678,9 +1434,10 @@ def parse_mdd(mdd_file, fdebug=False):
                         mdd_master['info'][item]['singlemulti'] = "single"
 
     # --------------------------------------------------------------------------
-    # Add the compiled master to the structure
+    # Add the compiled master to the structure, with the label store of it
     # --------------------------------------------------------------------------
     mdd_info['master'] = mdd_master
+    mdd_info['labels'] = make_label_store(mdd_master)
 
     #print("-------")
     #for i, item in enumerate(mdd_master['list']):
@@ -720,18 +1477,7 @@ def parse_mdd(mdd_file, fdebug=False):
             # ------------------------------------------------------------------
             cat_tag = catinfo['catname'].lower()
 
-            if not cat_tag in mdd_categories['by_cat']:
-                #print("MISSING", var, cat_tag)
-                mdd_categories['by_cat'][cat_tag] = {}
-                mdd_categories['by_cat'][cat_tag]['value'] = -1
-                mdd_categories['by_cat'][cat_tag]['catname'] = catname
-                mdd_categories['by_cat'][cat_tag]['usage_sl']  = []
-                mdd_categories['by_cat'][cat_tag]['usage_var'] = []
-
-            # ------------------------------------------------------------------
-            # Add the variable to the list
-            # ------------------------------------------------------------------
-            mdd_categories['by_cat'][cat_tag]['usage_var'].append(var)
+            add_category_usage(mdd_categories['by_cat'], cat_tag, catname, 'usage_var', var)
 
             # ------------------------------------------------------------------
             # If this variable uses a shared list, add that to its info
@@ -1197,7 +1943,7 @@ def retrieve_helpers(root_node):
 # ------------------------------------------------------------------------------
 # 
 # ------------------------------------------------------------------------------
-def retrieve_categories(root_node, shared_info, fdebug=False):
+def retrieve_categories(root_node, shared_info, fdebug=False, cat_nodes=None):
     # --------------------------------------------------------------------------
     # Start
     # --------------------------------------------------------------------------
@@ -1213,9 +1959,11 @@ def retrieve_categories(root_node, shared_info, fdebug=False):
         return data
 
     # --------------------------------------------------------------------------
-    # Get the context of the root so we can compare levels
+    # The categories/category nodes and their levels below the root, in one
+    # walk (unless the caller already has them, see index_shared_list)
     # --------------------------------------------------------------------------
-    root_context = get_node_context(root_node)
+    if cat_nodes is None:
+        cat_nodes = category_nodes(root_node)
 
     #if fdebug:
     #    print("------------")
@@ -1229,7 +1977,7 @@ def retrieve_categories(root_node, shared_info, fdebug=False):
     # --------------------------------------------------------------------------
     namelev = []
     labellev = []
-    for node in root_node.find_all(['categories','category']):
+    for node, offset in cat_nodes:
         # ----------------------------------------------------------------------
         # 
         # ----------------------------------------------------------------------
@@ -1246,12 +1994,6 @@ def retrieve_categories(root_node, shared_info, fdebug=False):
         else:
             cat_type = "leaf"
 
-        # ----------------------------------------------------------------------
-        # Get this node's context and calculate the offset from the root
-        # ----------------------------------------------------------------------
-        node_context = get_node_context(node)
-        offset = node_context['level'] - root_context['level']
-
         # ----------------------------------------------------------------------
         # If it's a 'categories' then it's a sublist, so we want to keep track
         # of the level-based naming.  First reset the thing if it's at the first
@@ -1287,7 +2029,6 @@ def retrieve_categories(root_node, shared_info, fdebug=False):
         #print(node)
         #print(node.name)
         #print(node.attrs)
-        #print(node_context)
         #print(offset)
         #print(fullname)
         #print(cat_type)
@@ -1296,14 +2037,7 @@ def retrieve_categories(root_node, shared_info, fdebug=False):
         # A shared list includes pieces from the already-defined set
         # ----------------------------------------------------------------------
         if cat_type == "shared":
-            slname = node.attrs['ref_name']
-            while slname.startswith("\\"):
-                slname = slname[1:]
-            while slname.startswith("."):
-                slname = slname[1:]
-            slname = slname.strip()
-            sltag  = slname.lower()
-            #print(slname, sltag)
+            sltag = shared_list_tag(node.attrs['ref_name'])
 
             for cname in shared_info[sltag]['cats']['list']:
                 cinfo = shared_info[sltag]['cats']['info'][cname]
@@ -1361,6 +2095,60 @@ def retrieve_categories(root_node, shared_info, fdebug=False):
     # --------------------------------------------------------------------------
     return data
 
+# ------------------------------------------------------------------------------
+# Label store, one per parsed MDD at mdd_info['labels']. Every label string is
+# kept once (interned, the labels in the master list get the same string
+# objects) and indexed by (object id, context, language), all lowercase, so
+# one label of one thing is a single dict lookup instead of a walk over all
+# its languages. The object id of a variable is its master list name, that of
+# a category is (variable, category name as in the variable's 'cats' list).
+# by_object keeps each thing's (context, language) pairs in MDD order, as they
+# were written
+# ------------------------------------------------------------------------------
+def make_label_store(mdd_master):
+    store = {}
+    store['languages'] = set()
+    store['index']     = {}
+    store['by_object'] = {}
+    strings = {}
+    for var in mdd_master['list']:
+        info = mdd_master['info'][var]
+        add_labels(store, strings, var, info.get('labels'))
+        if info.get('cats'):
+            for catname in info['cats']['list']:
+                add_labels(store, strings, (var, catname), info['cats']['info'][catname]['labels'])
+    return store
+
+def add_labels(store, strings, obj_id, labels):
+    if not labels or not 'list' in labels:
+        return
+    for key in labels['list']:
+        text = labels['info'][key]
+        if text is not None:
+            text = strings.setdefault(str(text), str(text))
+            labels['info'][key] = text
+        store['languages'].add(key[1].lower())
+        store['index'][(obj_id, key[0].lower(), key[1].lower())] = text
+    store['by_object'][obj_id] = labels['list']
+
+# ------------------------------------------------------------------------------
+# Label of one thing: the context/language asked for, else the same context in
+# any language, else whatever it has first (like select_primary_mdd_label).
+# Blank if it has none
+# ------------------------------------------------------------------------------
+def lookup_label(store, obj_id, context="question", language="en-us"):
+    text = store['index'].get((obj_id, context.lower(), language.lower()))
+    if text is None:
+        pairs = store['by_object'].get(obj_id, [])
+        same_context = [pair for pair in pairs if pair[0].lower() == context.lower()]
+        if same_context:
+            pairs = same_context
+        if pairs:
+            text = store['index'][(obj_id, pairs[0][0].lower(), pairs[0][1].lower())]
+    if text is None:
+        text = ""
+    return text
+
 # ------------------------------------------------------------------------------
 # Store a dictionary of labels by language and context
 # ------------------------------------------------------------------------------
@@ -1965,7 +2753,100 @@ def compile_routing_script_directory(script_info):
 
 
 # ------------------------------------------------------------------------------
-# Parse a ddf
+# Quote a DDF column name for SQL. Names straight from the schema come wrapped
+# in brackets already ([Respondent.ID:L])
+# ------------------------------------------------------------------------------
+def ddf_quote(name):
+    if name.startswith("[") and name.endswith("]"):
+        return name
+    return '"' + name.replace('"', '""') + '"'
+
+# ------------------------------------------------------------------------------
+# One table (level) of a DDF, opened lazily. Nothing is read until it's asked
+# for: read() and chunks() only pull the columns and rows requested, and the
+# row count and the 500 row sample are run on first use and kept. It's still
+# the dict parse_ddf always gave, so table['count'] and table['data500'] work
+# as before, they just cost nothing until somebody looks.
+# ------------------------------------------------------------------------------
+class DdfTable(dict):
+
+    def __init__(self, ddf_file, tablename, schema):
+        super().__init__()
+        self.ddf_file  = ddf_file
+        self.tablename = tablename
+        self['schema']      = schema
+        self['schema_info'] = parse_ddf_schema(schema)
+
+    def __missing__(self, key):
+        if key == "count":
+            self.count()
+        elif key == "data500":
+            self[key] = self.read(limit=500)
+        else:
+            raise KeyError(key)
+        return self[key]
+
+    # --------------------------------------------------------------------------
+    # Column names as the schema lists them
+    # --------------------------------------------------------------------------
+    def columns(self):
+        return [vinfo['varname'] + (":" + vinfo['dtype'] if vinfo['dtype'] else "")
+                for vinfo in self['schema_info']['vinfo'].values()]
+
+    def query(self, columns=None, where=None, limit=None):
+        if columns is None:
+            select = "*"
+        else:
+            select = ", ".join(ddf_quote(col) for col in columns)
+        sql = "SELECT " + select + " FROM " + ddf_quote(self.tablename)
+        if where:
+            sql += " WHERE " + where
+        if limit is not None:
+            sql += " LIMIT " + str(int(limit))
+        return sql
+
+    def count(self, where=None, params=()):
+        if where is None and "count" in self:
+            return self["count"]
+        sql = "SELECT count(*) FROM " + ddf_quote(self.tablename)
+        if where:
+            sql += " WHERE " + where
+        conn = sqlite3.connect(self.ddf_file)
+        try:
+            tablecount = int(conn.execute(sql, params).fetchone()[0])
+        finally:
+            conn.close()
+        if where is None:
+            self["count"] = tablecount
+        return tablecount
+
+    # --------------------------------------------------------------------------
+    # Whole (or filtered) table in one dataframe. where is plain SQL with ?
+    # placeholders filled from params, e.g. where='"Wave:L" = ?', params=(3,)
+    # --------------------------------------------------------------------------
+    def read(self, columns=None, where=None, params=(), limit=None):
+        conn = sqlite3.connect(self.ddf_file)
+        try:
+            return pd.read_sql_query(self.query(columns, where, limit), conn, params=params)
+        finally:
+            conn.close()
+
+    # --------------------------------------------------------------------------
+    # Same thing, chunksize rows at a time, so a full level can be scanned
+    # without ever holding it all
+    # --------------------------------------------------------------------------
+    def chunks(self, columns=None, where=None, params=(), chunksize=10000):
+        conn = sqlite3.connect(self.ddf_file)
+        try:
+            for chunk in pd.read_sql_query(self.query(columns, where), conn, params=params, chunksize=chunksize):
+                yield chunk
+        finally:
+            conn.close()
+
+
+# ------------------------------------------------------------------------------
+# Parse a ddf. Only the small bookkeeping tables (SchemaVersion, DataVersion
+# and Levels) are read, every data table comes back as a DdfTable
 # ------------------------------------------------------------------------------
 def parse_ddf(ddf_file):
     # --------------------------------------------------------------------------
@@ -1986,7 +2867,7 @@ def parse_ddf(ddf_file):
     curs = conn.cursor()
 
     # --------------------------------------------------------------------------
-    # Pull in a copy of each table as a pandas dataframe
+    # Go through the list of tables
     # --------------------------------------------------------------------------
     curs.execute("SELECT * FROM sqlite_master WHERE type='table';")
 
@@ -1998,28 +2879,18 @@ def parse_ddf(ddf_file):
         tablename = item[1]
         tableschema = item[4]
 
-        # ----------------------------------------------------------------------
-        # Grab a sample of the data
-        # ----------------------------------------------------------------------
-        data500 = pd.read_sql_query("SELECT * FROM " + tablename + " LIMIT 500;", conn)
-
-        # ----------------------------------------------------------------------
-        # Get the raw row count
-        # ----------------------------------------------------------------------
-        tablecount = int(pd.read_sql_query("SELECT count(*) FROM " + tablename, conn).values[0][0])
-
         # ----------------------------------------------------------------------
         # There's always a table called 'SchemaVersion' with one row
         # ----------------------------------------------------------------------
         if tablename == "SchemaVersion":
-            schema_version = data500.iloc[0].to_dict()
+            schema_version = pd.read_sql_query("SELECT * FROM " + tablename + " LIMIT 1;", conn).iloc[0].to_dict()
             continue
 
         # ----------------------------------------------------------------------
         # There's always a table called 'DataVersion' with one row
         # ----------------------------------------------------------------------
         if tablename == "DataVersion":
-            data_version = data500.iloc[0].to_dict()
+            data_version = pd.read_sql_query("SELECT * FROM " + tablename + " LIMIT 1;", conn).iloc[0].to_dict()
             continue
 
         # ----------------------------------------------------------------------
@@ -2032,18 +2903,9 @@ def parse_ddf(ddf_file):
             continue
 
         # ----------------------------------------------------------------------
-        # Parse out the schema into a useful format
-        # ----------------------------------------------------------------------
-        schema_info = parse_ddf_schema(tableschema)
-
-        # ----------------------------------------------------------------------
-        # Put all of this table-level information together
+        # Everything else is data, schema only for now
         # ----------------------------------------------------------------------
-        tables[tablename] = {}
-        tables[tablename]['schema']      = tableschema
-        tables[tablename]['schema_info'] = schema_info
-        tables[tablename]['data500']     = data500
-        tables[tablename]['count']       = tablecount
+        tables[tablename] = DdfTable(ddf_file, tablename, tableschema)
 
     # --------------------------------------------------------------------------
     # Close it down
@@ -2077,6 +2939,640 @@ def parse_ddf(ddf_file):
     return data
 
 
+# ------------------------------------------------------------------------------
+# Columnar copy of a DDF. Each level is converted once into one .npy file per
+# column plus a manifest.json, and read back with np.load(mmap_mode='r'), so
+# pulling 3 columns out of a 2000 column HDATA level touches only those 3 and
+# numbers are never copied. Columns come back the way read_sql_query gives
+# them: integers without nulls stay int64, other numbers are float64 with NaN
+# for null, text is fixed width utf-8 bytes with a separate null mask. The
+# whole cache is rebuilt once the DDF's size or mtime changes. It lives in the
+# same per-user cache directory as the MDD cache, one directory per DDF path.
+# If it can't be written the columns are read straight from the DDF instead.
+# ------------------------------------------------------------------------------
+ddf_column_cache_version = 2
+
+def ddf_column_cache_dir(ddf_file):
+    path = os.path.abspath(ddf_file)
+    name = re.sub(r"[^A-Za-z0-9_.-]", "_", os.path.splitext(os.path.basename(path))[0])
+    return os.path.join(os.path.dirname(mdd_cache_file()), "ddf_columns",
+                        name + "_" + hashlib.sha256(path.encode('utf-8')).hexdigest()[:16])
+
+# ------------------------------------------------------------------------------
+# SQLite's column affinity for a declared type. Only CHAR/CLOB/TEXT columns
+# are sure to hold text; BOOLEAN, DATE and the like get NUMERIC affinity and
+# hold numbers wherever the value looks like one
+# ------------------------------------------------------------------------------
+def ddf_column_affinity(vinfo):
+    vartype = vinfo['vartype'].upper()
+    if "INT" in vartype:
+        return "integer"
+    if any(x in vartype for x in ("CHAR", "CLOB", "TEXT")):
+        return "text"
+    if "BLOB" in vartype or vartype.strip() == "":
+        return "blob"
+    if any(x in vartype for x in ("REAL", "FLOA", "DOUB")):
+        return "real"
+    return "numeric"
+
+# ------------------------------------------------------------------------------
+# How a column is cached, from its affinity and what it actually holds (see
+# ddf_column_stats): text columns and anything holding text are "text",
+# numbers are "int" when they are all integers and never null, else "float"
+# (always for REAL, which stores every number as one)
+# ------------------------------------------------------------------------------
+def ddf_column_kind(affinity, stats):
+    if affinity == "text" or stats['text']:
+        return "text"
+    if affinity == "real" or stats['nulls'] or stats['real']:
+        return "float"
+    return "int"
+
+# ------------------------------------------------------------------------------
+# What every column holds, as {'nulls', 'real', 'text', 'width'}. Only what
+# the affinity leaves open is counted: nulls and width for text, text values
+# for REAL, everything for the rest. The aggregates go in as few passes as
+# SQLite's result column limit allows, and the width of a number column that
+# turns out to hold text is looked up afterwards
+# ------------------------------------------------------------------------------
+ddf_column_stats_batch = 1900
+
+def ddf_column_stats(ddf_file, tablename, columns, affinities):
+    checks = []
+    for col, affinity in zip(columns, affinities):
+        qcol = ddf_quote(col)
+        if affinity == "text":
+            checks.append((col, 'nulls', "sum(" + qcol + " IS NULL)"))
+            checks.append((col, 'width', "max(length(CAST(" + qcol + " AS BLOB)))"))
+        else:
+            if not affinity == "real":
+                checks.append((col, 'nulls', "sum(" + qcol + " IS NULL)"))
+                checks.append((col, 'real', "sum(typeof(" + qcol + ") = 'real')"))
+            checks.append((col, 'text', "sum(typeof(" + qcol + ") IN ('text', 'blob'))"))
+
+    stats = {}
+    for col, affinity in zip(columns, affinities):
+        stats[col] = {'nulls': 0, 'real': 0, 'text': 0, 'width': 1}
+
+    conn = sqlite3.connect(ddf_file)
+    try:
+        for first in range(0, len(checks), ddf_column_stats_batch):
+            batch = checks[first:first + ddf_column_stats_batch]
+            row = conn.execute("SELECT " + ", ".join(x[2] for x in batch) + " FROM " + ddf_quote(tablename)).fetchone()
+            for (col, stat, _), value in zip(batch, row):
+                stats[col][stat] = int(value or 0)
+
+        mixed = [col for col, affinity in zip(columns, affinities) if not affinity == "text" and stats[col]['text']]
+        for first in range(0, len(mixed), ddf_column_stats_batch):
+            batch = mixed[first:first + ddf_column_stats_batch]
+            row = conn.execute("SELECT " + ", ".join("max(length(CAST(" + ddf_quote(col) + " AS BLOB)))" for col in batch) +
+                               " FROM " + ddf_quote(tablename)).fetchone()
+            for col, value in zip(batch, row):
+                stats[col]['width'] = int(value or 0)
+    finally:
+        conn.close()
+
+    for col in stats:
+        stats[col]['width'] = max(stats[col]['width'], 1)
+    return stats
+
+# ------------------------------------------------------------------------------
+# Write one level. Types, text widths and null counts come from aggregate
+# queries first, so every file can be allocated at its final size and filled
+# chunk by chunk
+# ------------------------------------------------------------------------------
+def write_ddf_table_columns(table, table_dir, chunksize=10000):
+    # --------------------------------------------------------------------------
+    # Start
+    # --------------------------------------------------------------------------
+    columns = table.columns()
+    rows = table.count()
+    os.makedirs(table_dir)
+
+    affinities = [ddf_column_affinity(vinfo) for vinfo in table['schema_info']['vinfo'].values()]
+    stats = ddf_column_stats(table.ddf_file, table.tablename, columns, affinities)
+    kinds = [ddf_column_kind(affinity, stats[col]) for col, affinity in zip(columns, affinities)]
+
+    # --------------------------------------------------------------------------
+    # Allocate the files
+    # --------------------------------------------------------------------------
+    info = {}
+    arrays = {}
+    masks = {}
+    for i, (col, affinity, kind) in enumerate(zip(columns, affinities, kinds)):
+        cinfo = {}
+        cinfo['kind'] = kind
+        cinfo['file'] = "c%05d.npy" % i
+        cinfo['nulls'] = None
+        if kind == "int":
+            dtype = np.int64
+        elif kind == "float":
+            dtype = np.float64
+        else:
+            # str() of a number can be longer than SQLite's text for it
+            width = stats[col]['width'] if affinity == "text" else max(stats[col]['width'], 24)
+            dtype = "S" + str(width)
+            if stats[col]['nulls']:
+                cinfo['nulls'] = "c%05d_null.npy" % i
+                masks[col] = np.lib.format.open_memmap(os.path.join(table_dir, cinfo['nulls']), mode="w+",
+                                                       dtype=np.bool_, shape=(rows,))
+        arrays[col] = np.lib.format.open_memmap(os.path.join(table_dir, cinfo['file']), mode="w+",
+                                                dtype=dtype, shape=(rows,))
+        info[col] = cinfo
+
+    # --------------------------------------------------------------------------
+    # Fill them
+    # --------------------------------------------------------------------------
+    start = 0
+    for chunk in table.chunks(columns, chunksize=chunksize):
+        stop = start + len(chunk)
+        for col in columns:
+            values = chunk[col]
+            if info[col]['kind'] == "text":
+                isnull = values.isna().values
+                arrays[col][start:stop] = [b"" if x else str(v).encode("utf-8") for v, x in zip(values.values, isnull)]
+                if col in masks:
+                    masks[col][start:stop] = isnull
+            elif info[col]['kind'] == "float":
+                arrays[col][start:stop] = values.astype(np.float64).values
+            else:
+                arrays[col][start:stop] = values.values
+        start = stop
+
+    for array in list(arrays.values()) + list(masks.values()):
+        array.flush()
+
+    # --------------------------------------------------------------------------
+    # Finish
+    # --------------------------------------------------------------------------
+    tinfo = {}
+    tinfo['dir'] = os.path.basename(table_dir)
+    tinfo['rows'] = rows
+    tinfo['columns'] = info
+    return tinfo
+
+# ------------------------------------------------------------------------------
+# Convert every level of a DDF (or just the ones in tables) into the cache.
+# The manifest is written last, so a half built cache is never picked up
+# ------------------------------------------------------------------------------
+def build_ddf_column_cache(ddf_file, cache_dir=None, tables=None, chunksize=10000):
+    # --------------------------------------------------------------------------
+    # Start
+    # --------------------------------------------------------------------------
+    if cache_dir is None:
+        cache_dir = ddf_column_cache_dir(ddf_file)
+    ddf_data = parse_ddf(ddf_file)
+    if ddf_data is None:
+        return None
+
+    if os.path.isdir(cache_dir):
+        shutil.rmtree(cache_dir)
+    os.makedirs(cache_dir)
+
+    # --------------------------------------------------------------------------
+    # One directory per level
+    # --------------------------------------------------------------------------
+    manifest = {}
+    manifest['version'] = ddf_column_cache_version
+    manifest['signature'] = mdd_file_signature(ddf_file, with_hash=False)
+    manifest['tables'] = {}
+    for i, tablename in enumerate(ddf_data['tables']):
+        if tables is not None and not tablename in tables:
+            continue
+        table_dir = os.path.join(cache_dir, "t%03d_" % i + re.sub(r"[^A-Za-z0-9_.-]", "_", tablename))
+        manifest['tables'][tablename] = write_ddf_table_columns(ddf_data['tables'][tablename], table_dir, chunksize)
+
+    # --------------------------------------------------------------------------
+    # Finish
+    # --------------------------------------------------------------------------
+    with open(os.path.join(cache_dir, "manifest.json"), "w") as f:
+        json.dump(manifest, f, indent=1)
+    return manifest
+
+# ------------------------------------------------------------------------------
+# Manifest of an up to date cache, building (or rebuilding) it when needed
+# ------------------------------------------------------------------------------
+def open_ddf_column_cache(ddf_file, cache_dir=None, tables=None):
+    # --------------------------------------------------------------------------
+    # Start
+    # --------------------------------------------------------------------------
+    if cache_dir is None:
+        cache_dir = ddf_column_cache_dir(ddf_file)
+    signature = mdd_file_signature(ddf_file, with_hash=False)
+
+    manifest = None
+    manifest_file = os.path.join(cache_dir, "manifest.json")
+    if os.path.isfile(manifest_file):
+        with open(manifest_file) as f:
+            manifest = json.load(f)
+        if manifest.get('version') != ddf_column_cache_version or manifest.get('signature') != signature:
+            manifest = None
+        elif tables is not None and any(not tablename in manifest['tables'] for tablename in tables):
+            manifest = None
+
+    # --------------------------------------------------------------------------
+    # Stale, missing or built for other levels: convert the whole DDF. If that
+    # can't be written, do without the cache
+    # --------------------------------------------------------------------------
+    if manifest is None:
+        try:
+            manifest = build_ddf_column_cache(ddf_file, cache_dir)
+        except OSError:
+            shutil.rmtree(cache_dir, ignore_errors=True)
+            return ddf_sqlite_manifest(ddf_file)
+
+    # --------------------------------------------------------------------------
+    # Finish
+    # --------------------------------------------------------------------------
+    manifest['cache_dir'] = cache_dir
+    return manifest
+
+# ------------------------------------------------------------------------------
+# Stand-in manifest when there's no cache: the same tables, rows and columns,
+# and cache_dir None so the columns get read from the DDF itself
+# ------------------------------------------------------------------------------
+def ddf_sqlite_manifest(ddf_file):
+    manifest = {}
+    manifest['version'] = ddf_column_cache_version
+    manifest['signature'] = mdd_file_signature(ddf_file, with_hash=False)
+    manifest['tables'] = {}
+    for tablename, table in parse_ddf(ddf_file)['tables'].items():
+        tinfo = {}
+        tinfo['dir'] = None
+        tinfo['rows'] = table.count()
+        tinfo['columns'] = {col: {'kind': None, 'file': None, 'nulls': None} for col in table.columns()}
+        manifest['tables'][tablename] = tinfo
+    manifest['cache_dir'] = None
+    return manifest
+
+# ------------------------------------------------------------------------------
+# The same arrays as the cache gives, from a query on the DDF
+# ------------------------------------------------------------------------------
+def read_ddf_column_arrays(ddf_file, tablename, columns, decode=True):
+    df = parse_ddf(ddf_file)['tables'][tablename].read([col.strip("[]") for col in columns])
+    arrays = {}
+    for col, name in zip(columns, df.columns):
+        array = df[name].to_numpy()
+        if array.dtype == object and not decode:
+            array = np.array([b"" if x is None else str(x).encode("utf-8") for x in array], dtype=np.bytes_)
+        arrays[col] = array
+    return arrays
+
+# ------------------------------------------------------------------------------
+# Columns of one level as arrays. Numbers come straight off the memory map,
+# text is decoded into an object array with None for null (or, with
+# decode=False, left as the mapped utf-8 bytes with b"" for null)
+# ------------------------------------------------------------------------------
+def load_ddf_column_arrays(ddf_file, tablename, columns=None, cache_dir=None, decode=True):
+    manifest = open_ddf_column_cache(ddf_file, cache_dir, [tablename])
+    tinfo = manifest['tables'][tablename]
+    if columns is None:
+        columns = list(tinfo['columns'])
+    if manifest['cache_dir'] is None:
+        return read_ddf_column_arrays(ddf_file, tablename, columns, decode)
+    table_dir = os.path.join(manifest['cache_dir'], tinfo['dir'])
+
+    arrays = {}
+    for col in columns:
+        cinfo = tinfo['columns'][col.strip("[]")]
+        array = np.load(os.path.join(table_dir, cinfo['file']), mmap_mode="r")
+        if cinfo['kind'] == "text" and decode:
+            array = np.char.decode(array, "utf-8").astype(object)
+            if cinfo['nulls'] is not None:
+                array[np.load(os.path.join(table_dir, cinfo['nulls']), mmap_mode="r")] = None
+        arrays[col] = array
+    return arrays
+
+def load_ddf_columns(ddf_file, tablename, columns=None, cache_dir=None):
+    return pd.DataFrame(load_ddf_column_arrays(ddf_file, tablename, columns, cache_dir))
+
+
+# ------------------------------------------------------------------------------
+# Cross tabs straight from the data. A banner is a list of banner points:
+#   {'name': 'Total',  'letter': 'A'}
+#   {'name': 'Female', 'letter': 'C', 'var': 'Gender', 'cats': ['Female']}
+# a point without 'var' takes everybody, otherwise the respondents with any of
+# its categories. Stubs are categorical variables of the HDATA level, one
+# table each with a row per category. Everything is worked out on the
+# columnar cache (see build_ddf_column_cache) with matrix products, so the
+# respondent data is only ever touched once per variable.
+# ------------------------------------------------------------------------------
+
+# ------------------------------------------------------------------------------
+# Leaf categories of a variable as (category, label, value), in MDD order.
+# value is what the DDF stores, from the category map. Categories without one
+# can't be in the data and are left out. Labels come from the label store
+# ------------------------------------------------------------------------------
+def mdd_category_values(mdd_info, var, language="en-us"):
+    by_cat = mdd_info['categories']['by_cat']
+    cats = mdd_info['master']['info'][var]['cats']
+
+    data = []
+    for fullname in cats['list']:
+        cinfo = cats['info'][fullname]
+        if not cinfo['cat_type'] == "leaf":
+            continue
+        catname = cinfo['catname'].lower()
+        if not catname in by_cat or not 'value' in by_cat[catname]:
+            continue
+        data.append((fullname, lookup_label(mdd_info['labels'], (var, fullname), language=language),
+                     str(by_cat[catname]['value'])))
+    return data
+
+# ------------------------------------------------------------------------------
+# Code every respondent by their answer: (codes, distinct answers). Fixed width
+# bytes straight from the column cache are hashed 8 bytes at a time as
+# integers, which is a lot quicker than sorting or hashing the strings
+# ------------------------------------------------------------------------------
+def categorical_codes(raw):
+    raw = np.asarray(raw)
+    if not raw.dtype.kind == "S":
+        codes, uniques = pd.factorize(raw.astype(object), use_na_sentinel=False)
+        return codes, list(uniques)
+
+    width = raw.dtype.itemsize
+    padded = np.zeros((len(raw), -(-width // 8) * 8), dtype=np.uint8)
+    padded[:, :width] = raw.view(np.uint8).reshape(len(raw), width)
+    words = padded.view(np.uint64)
+
+    codes = None
+    for w in range(words.shape[1]):
+        word_codes = pd.factorize(words[:, w])[0]
+        if codes is None:
+            codes = word_codes
+        else:
+            codes = pd.factorize(codes * (int(word_codes.max()) + 1) + word_codes)[0]
+
+    # factorize numbers the codes in order of first appearance, so the first
+    # row of each distinct code comes out in code order
+    first = pd.Series(codes).drop_duplicates().index.values
+    return codes, list(raw[first])
+
+# ------------------------------------------------------------------------------
+# Per distinct answer: which of values it holds, and whether it's an answer at
+# all (not null)
+# ------------------------------------------------------------------------------
+def categorical_table(uniques, values):
+    position = {value: j for j, value in enumerate(values)}
+    table = np.zeros((len(uniques), len(values)), dtype=np.float64)
+    answered = np.zeros(len(uniques), dtype=np.float64)
+    for u, text in enumerate(uniques):
+        if isinstance(text, bytes):
+            text = text.decode("utf-8")
+        if text is None or not isinstance(text, str) or text == "":
+            continue
+        answered[u] = 1
+        for token in text.strip("{}").split(","):
+            j = position.get(token.strip())
+            if j is not None:
+                table[u, j] = 1
+    return table, answered
+
+# ------------------------------------------------------------------------------
+# Respondents x categories for one categorical column ('{1,3}' strings), plus
+# who answered at all. Only the distinct answers get split, every respondent
+# is then just a row lookup
+# ------------------------------------------------------------------------------
+def categorical_indicator(raw, values):
+    codes, uniques = categorical_codes(raw)
+    table, answered = categorical_table(uniques, values)
+    return table[codes], answered[codes]
+
+# ------------------------------------------------------------------------------
+# Respondents x banner points, 1 where the respondent is in the point
+# ------------------------------------------------------------------------------
+def banner_membership(banner, arrays, columns, mdd_info, rows):
+    membership = np.zeros((rows, len(banner)), dtype=np.float64)
+    for p, point in enumerate(banner):
+        if point.get('var') is None:
+            membership[:, p] = 1
+            continue
+        wanted = set(cat.lower() for cat in point['cats'])
+        values = [value for fullname, label, value in mdd_category_values(mdd_info, point['var'])
+                  if fullname.lower() in wanted]
+        indicator, answered = categorical_indicator(arrays[columns[point['var']]], values)
+        if values:
+            membership[:, p] = indicator.max(axis=1)
+    return membership
+
+# ------------------------------------------------------------------------------
+# Letter groups as lists of letters, from 'B/C/D' strings or lists
+# ------------------------------------------------------------------------------
+def banner_groups(groups):
+    if groups is None:
+        return None
+    groups = [group.split("/") if isinstance(group, str) else group for group in groups]
+    return [[str(letter).strip() for letter in group] for group in groups]
+
+# ------------------------------------------------------------------------------
+# The whole run. Returns tables in stub order, each like get_table_df gives
+# them back for a parsed tab: 'count', 'pct' and 'stat' (categories x banner
+# points) and 'base', 'unwb', 'effb' (one row each), plus 'question' and
+# 'label'. weight is a numeric column of the same level, groups the letter
+# groups tested against each other ('B/C/D' or ['B', 'C', 'D'], default all
+# points against each other), sig letters come from stat_test_pairs. Stubs
+# are worked out crosstab_batch_columns categories at a time, which is what
+# sets the memory used (respondents x that many floats). Table and category
+# labels are looked up in the label store in language
+# ------------------------------------------------------------------------------
+crosstab_batch_columns = 256
+
+def crosstab_ddf(ddf_file, mdd_info, stubs, banner, weight=None, groups=None, confidence=0.95,
+                 tablename=None, cache_dir=None, language="en-us"):
+    # --------------------------------------------------------------------------
+    # Start
+    # --------------------------------------------------------------------------
+    manifest = open_ddf_column_cache(ddf_file, cache_dir)
+    if tablename is None:
+        levels = parse_ddf(ddf_file)['levels']
+        hdata = [table for table in manifest['tables'] if levels.loc[table, 'DSCTableName'] == "HDATA"]
+        tablename = hdata[0] if hdata else list(manifest['tables'])[0]
+    tinfo = manifest['tables'][tablename]
+
+    letters = [str(point.get('letter', point['name'])) for point in banner]
+    names = [point['name'] for point in banner]
+    groups = banner_groups(groups)
+
+    # --------------------------------------------------------------------------
+    # DDF columns are named variable:type, find the ones we need
+    # --------------------------------------------------------------------------
+    columns = {}
+    for col in tinfo['columns']:
+        columns[col.rsplit(":", 1)[0]] = col
+
+    needed = set(stubs) | set(point['var'] for point in banner if point.get('var') is not None)
+    missing = [var for var in needed if not var in columns]
+    if weight is not None and not weight in columns:
+        missing.append(weight)
+    if missing:
+        raise KeyError("not in " + tablename + " of " + ddf_file + ": " + ", ".join(sorted(missing)))
+
+    load = [columns[var] for var in needed]
+    if weight is not None:
+        load.append(columns[weight])
+    if manifest['cache_dir'] is None:
+        arrays = read_ddf_column_arrays(ddf_file, tablename, load, decode=False)
+    else:
+        arrays = load_ddf_column_arrays(ddf_file, tablename, load, manifest['cache_dir'], decode=False)
+
+    # --------------------------------------------------------------------------
+    # Banner side, shared by every table: membership, weighted membership and
+    # the squared weights for the effective base
+    # --------------------------------------------------------------------------
+    rows = tinfo['rows']
+    if weight is None:
+        weights = np.ones(rows)
+    else:
+        weights = np.nan_to_num(np.asarray(arrays[columns[weight]], dtype=np.float64))
+    membership = banner_membership(banner, arrays, columns, mdd_info, rows)
+    points = len(banner)
+    weighted = membership * weights[:, None]
+    base_side = np.hstack([weighted, membership, membership * (weights ** 2)[:, None]])
+
+    # --------------------------------------------------------------------------
+    # Stub side, a batch of stubs at a time: the categories of every stub side
+    # by side times the weighted banner gives all the counts of the batch in
+    # one matrix product, an 'answered' column per stub times the weighted,
+    # plain and squared weight banner gives the bases, unweighted bases and
+    # sums of squared weights
+    # --------------------------------------------------------------------------
+    counts = {}
+    bases = {}
+    batch = []
+    width = 0
+    for i, var in enumerate(stubs):
+        codes, uniques = categorical_codes(arrays[columns[var]])
+        cats = mdd_category_values(mdd_info, var)
+        table, answered = categorical_table(uniques, [value for fullname, label, value in cats])
+        batch.append((var, codes, table, answered))
+        width += table.shape[1]
+        if width < crosstab_batch_columns and i < len(stubs) - 1:
+            continue
+
+        # column major, each stub's columns are written in one contiguous run
+        cat_block = np.empty((rows, width), dtype=np.float64, order="F")
+        ans_block = np.empty((rows, len(batch)), dtype=np.float64, order="F")
+        offset = 0
+        for j, (batch_var, batch_codes, batch_table, batch_answered) in enumerate(batch):
+            cat_block[:, offset:offset + batch_table.shape[1]] = batch_table[batch_codes]
+            ans_block[:, j] = batch_answered[batch_codes]
+            offset += batch_table.shape[1]
+        cat_products = cat_block.T @ weighted
+        ans_products = ans_block.T @ base_side
+
+        offset = 0
+        for j, (batch_var, batch_codes, batch_table, batch_answered) in enumerate(batch):
+            counts[batch_var] = cat_products[offset:offset + batch_table.shape[1]]
+            bases[batch_var] = ans_products[j]
+            offset += batch_table.shape[1]
+        batch = []
+        width = 0
+
+    # --------------------------------------------------------------------------
+    # One table per stub
+    # --------------------------------------------------------------------------
+    banner_index = pd.Index(names)
+    tables = {}
+    for var in stubs:
+        labels = [label for fullname, label, value in mdd_category_values(mdd_info, var, language)]
+        base   = bases[var][:points]
+        unwb   = bases[var][points:2*points]
+        sumsq  = bases[var][2*points:]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            effb = np.where(sumsq > 0, base ** 2 / sumsq, 0)
+            pct = np.where(base > 0, counts[var] / base, np.nan)
+
+        labels = pd.Index(labels)
+        pctdf = pd.DataFrame(pct, index=labels, columns=banner_index)
+        table = {}
+        table['question'] = var
+        table['label']    = lookup_label(mdd_info['labels'], var, language=language)
+        table['count']    = pd.DataFrame(counts[var], index=labels, columns=banner_index)
+        table['pct']      = pctdf
+        table['stat']     = stat_test_pairs(pctdf, effb, letters, groups, confidence)
+        table['base']     = pd.DataFrame(base[None, :], index=["Base"], columns=banner_index)
+        table['unwb']     = pd.DataFrame(unwb[None, :], index=["Unweighted Base"], columns=banner_index)
+        table['effb']     = pd.DataFrame(effb[None, :], index=["Effective Base"], columns=banner_index)
+        tables[var] = table
+
+    # --------------------------------------------------------------------------
+    # Finish
+    # --------------------------------------------------------------------------
+    return tables
+
+# ------------------------------------------------------------------------------
+# Stub names of one table: unique (RowStubData is keyed by them) and none of
+# the base rows the scraper leaves out. Repeats get ' (2)', ' (3)'... in order
+# ------------------------------------------------------------------------------
+def unique_stub_labels(labels, reserved=("Base", "Unweighted Base", "Mean")):
+    seen = set(reserved)
+    unique = []
+    for label in labels:
+        label = str(label)
+        name = label
+        n = 1
+        while name in seen:
+            n += 1
+            name = label + " (" + str(n) + ")"
+        seen.add(name)
+        unique.append(name)
+    return unique
+
+# ------------------------------------------------------------------------------
+# crosstab_ddf output in the layout aggr builds from a tab workbook
+# (TotalTabsDictionary), tables numbered from 1 in stub order. Cells are
+# '45.00% BC', '45.00%' or '-' for an empty cell, like they come off the tabs.
+# 'StatTest' holds the letter groups as 'B/C/D' strings, what the scraper
+# otherwise reads off T1 (groups as given to crosstab_ddf, default all points)
+# ------------------------------------------------------------------------------
+def crosstab_totaltabs(tables, banner, groups=None):
+    # --------------------------------------------------------------------------
+    # Start
+    # --------------------------------------------------------------------------
+    names = [point['name'] for point in banner]
+    letters = [str(point.get('letter', point['name'])) for point in banner]
+    groups = banner_groups(groups)
+    if groups is None:
+        groups = [letters]
+
+    tabs = {}
+    for key in ['Table', 'Question', 'Stub', 'StubData', 'RowStubData', 'TableLink']:
+        tabs[key] = {}
+    tabs['Banner'] = names
+    tabs['BannerLetter'] = letters
+    tabs['BannerColumn'] = dict(zip(letters, names))
+    tabs['StatTest'] = ["/".join(group) for group in groups]
+
+    # --------------------------------------------------------------------------
+    # One entry per table
+    # --------------------------------------------------------------------------
+    for i, table in enumerate(tables.values()):
+        number = str(i + 1)
+        counts = table['count'].to_numpy()
+        pct = table['pct'].to_numpy()
+        stat = table['stat'].to_numpy()
+
+        cells = np.full(pct.shape, "-", dtype=object)
+        for r, c in zip(*np.nonzero(counts > 0)):
+            cells[r, c] = "{:.2%}".format(pct[r, c]) + (" " + stat[r, c] if stat[r, c] else "")
+
+        stubs = unique_stub_labels(table['pct'].index)
+        tabs['Table'][number]     = number
+        tabs['Question'][number]  = table['question']
+        tabs['TableLink'][int(number)] = table['label']
+        tabs['Stub'][number]      = ['Base', 'Unweighted Base'] + stubs
+        tabs['StubData'][number]  = {str(name): list(cells[:, c]) for c, name in enumerate(names)}
+
+        rowstubdata = {'Base': [], 'Unweighted Base': []}
+        for r, stub in enumerate(stubs):
+            rowstubdata[stub] = list(cells[r])
+        tabs['RowStubData'][number] = rowstubdata
+
+    # --------------------------------------------------------------------------
+    # Finish
+    # --------------------------------------------------------------------------
+    return tabs
+
 # ------------------------------------------------------------------------------
 # Make a text version of the parsed metadata as a list of text fields
 # ------------------------------------------------------------------------------
@@ -2120,8 +3616,9 @@ def make_metadata_text_listing(mdd_data):
     block.append("")
 
     # --------------------------------------------------------------------------
-    # The variables from the master list
+    # The variables from the master list, labels from the label store
     # --------------------------------------------------------------------------
+    store = mdd_data['labels']
     for i, var in enumerate(mdd_data['master']['list']):
         # ----------------------------------------------------------------------
         # Get the info
@@ -2130,7 +3627,7 @@ def make_metadata_text_listing(mdd_data):
         vname   = info['name']
         vtype   = info['type']
         vlevel  = info['level']
-        vlabels = info['labels']
+        vlabels = store['by_object'].get(var, [])
 
         if 'attrs' in info:
             vattrs = info['attrs']
@@ -2197,14 +3694,14 @@ def make_metadata_text_listing(mdd_data):
         # ----------------------------------------------------------------------
         # Labels
         # ----------------------------------------------------------------------
-        width_context  = get_longest([x[0] for x in vlabels['list']])
-        width_language = get_longest([x[1] for x in vlabels['list']])
+        width_context  = get_longest([x[0] for x in vlabels])
+        width_language = get_longest([x[1] for x in vlabels])
 
         block.append("")
-        for label in vlabels['list']:
+        for label in vlabels:
             context  = label[0]
             language = label[1]
-            text     = vlabels['info'][label]
+            text     = store['index'][(var, context.lower(), language.lower())]
 
             if not text:
                 text = ""
@@ -2362,14 +3859,15 @@ def make_metadata_text_listing(mdd_data):
                 # is the only one, we already show it with the cat string
                 # It is possible to have no labels, we just skip
                 # --------------------------------------------------------------
-                if catinfo['labels'] and len(catinfo['labels']['list']) > 1:
-                    width_context  = get_longest([x[0] for x in catinfo['labels']['list']])
-                    width_language = get_longest([x[1] for x in catinfo['labels']['list']])
+                clabels = store['by_object'].get((var, vcat), [])
+                if len(clabels) > 1:
+                    width_context  = get_longest([x[0] for x in clabels])
+                    width_language = get_longest([x[1] for x in clabels])
 
-                    for ltag in catinfo['labels']['list']:
+                    for ltag in clabels:
                         context = ltag[0]
                         language = ltag[1]
-                        text = catinfo['labels']['info'][ltag]
+                        text = store['index'][((var, vcat), context.lower(), language.lower())]
                         if not text:
                             text = ""
                         text = text.replace("\n","\\n")
@@ -2402,7 +3900,7 @@ def make_metadata_text_listing(mdd_data):
                 # --------------------------------------------------------------
                 # If the category was multiline, give some whitespace
                 # --------------------------------------------------------------
-                if (catinfo['labels'] and len(catinfo['labels']['list']) > 1) or catinfo['attrs'] or catinfo['props']:
+                if len(clabels) > 1 or catinfo['attrs'] or catinfo['props']:
                     cblock.append("")
 
                 # --------------------------------------------------------------
@@ -0,0 +1,129 @@
+
+import os
+import sys
+import pickle
+import sqlite3
+import tempfile
+from collections.abc import MutableMapping
+
+
+def parse_size(size):
+    """
+    Turns '2G', '512M', '800k' or a plain byte count into a number of bytes
+    """
+    size = str(size).strip().upper().rstrip('B')
+    units = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3, 'T': 1024 ** 4}
+    if size and size[-1] in units:
+        return int(float(size[:-1]) * units[size[-1]])
+    return int(float(size))
+
+
+def sizeof(obj):
+    """
+    Rough deep size of the dict/list/str/number structures aggr builds
+    """
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        for key, value in obj.items():
+            size += sizeof(key) + sizeof(value)
+    elif isinstance(obj, (list, tuple)):
+        for item in obj:
+            size += sizeof(item)
+    return size
+
+
+class SpillStore:
+    """
+    A memory budget shared by any number of SpillDicts. Values stay in memory
+    until the budget is used up, everything after that is pickled into a
+    temporary SQLite file and read back on access.
+    """
+
+    def __init__(self, budget, spilldir = None):
+        self.budget = budget
+        self.used = 0
+        self.spilled = 0
+        fd, self.path = tempfile.mkstemp(prefix = 'totaltabs_', suffix = '.sqlite', dir = spilldir)
+        os.close(fd)
+        self.conn = sqlite3.connect(self.path)
+        self.conn.execute('CREATE TABLE spill (name TEXT, key TEXT, value BLOB, PRIMARY KEY (name, key))')
+
+    def mapping(self, name):
+        return SpillDict(self, name)
+
+    def close(self):
+        if self.conn is None:
+            return
+        self.conn.close()
+        self.conn = None
+        os.remove(self.path)
+
+
+class SpillDict(MutableMapping):
+    """
+    Insertion-ordered dict backed by a SpillStore. Values are copied in on
+    assignment, so build a value completely before storing it; changing it
+    afterwards is not seen once it has been spilled.
+    """
+
+    def __init__(self, store, name):
+        self.store = store
+        self.name = name
+        self.order = {}
+        self.memory = {}
+        self.sizes = {}
+        self.last = None
+
+    def __setitem__(self, key, value):
+        if key in self:
+            del self[key]
+
+        size = sizeof(value)
+        if self.store.used + size <= self.store.budget:
+            self.memory[key] = value
+            self.sizes[key] = size
+            self.store.used += size
+        else:
+            self.store.conn.execute('INSERT INTO spill VALUES (?, ?, ?)',
+                                    (self.name, str(key), pickle.dumps(value, pickle.HIGHEST_PROTOCOL)))
+            self.store.spilled += 1
+        self.order[key] = None
+
+    def __getitem__(self, key):
+        if key in self.memory:
+            return self.memory[key]
+        if key not in self.order:
+            raise KeyError(key)
+
+        # =====================================================================
+        # Keep the last spilled value around, callers tend to look one table
+        # up several times in a row
+        # =====================================================================
+        if self.last is not None and self.last[0] == key:
+            return self.last[1]
+        row = self.store.conn.execute('SELECT value FROM spill WHERE name = ? AND key = ?',
+                                      (self.name, str(key))).fetchone()
+        value = pickle.loads(row[0])
+        self.last = (key, value)
+        return value
+
+    def __delitem__(self, key):
+        if key not in self.order:
+            raise KeyError(key)
+        del self.order[key]
+        if key in self.memory:
+            del self.memory[key]
+            self.store.used -= self.sizes.pop(key)
+        else:
+            self.store.conn.execute('DELETE FROM spill WHERE name = ? AND key = ?', (self.name, str(key)))
+            if self.last is not None and self.last[0] == key:
+                self.last = None
+
+    def __contains__(self, key):
+        return key in self.order
+
+    def __iter__(self):
+        return iter(self.order)
+
+    def __len__(self):
+        return len(self.order)
@@ -0,0 +1,55 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'styles'))
+import bough
+
+
+def test_split_skip_rules_regex_takes_the_rest():
+    assert bough.split_skip_rules('T56, T187-T190, re:^T2[0-9]{2,3}$') == ['T56', 'T187-T190', 're:^T2[0-9]{2,3}$']
+    assert bough.split_skip_rules(' T1 ,, T2 ') == ['T1', 'T2']
+
+
+def test_load_skip_rules(tmp_path):
+    path = tmp_path / 'skips.txt'
+    path.write_text('T56, T57  # the open ends\n'
+                    '\n'
+                    're:^T3[0-9]$, still the regex\n'
+                    '# T99\n')
+    assert bough.load_skip_rules(str(path)) == ['T56', 'T57', 're:^T3[0-9]$, still the regex']
+
+
+# ------------------------------------------------------------------------------
+# Single tables, ranges (also reversed and overlapping) and regexes, by sheet
+# name or by index entry number
+# ------------------------------------------------------------------------------
+def test_keep_tab():
+    compiled = bough.compile_skip_rules(['T56', '58', 'T190-T187', 'T100-T120', 'T110-T130', 're:^T2[0-9]{2}$'])
+    assert compiled['starts'] == [100, 187]
+    assert compiled['ends'] == [130, 190]
+
+    skipped = ['T56', 56, '58', 'T187', 'T188', 'T190', 'T100', 'T125', 'T130', 'T200', 'T299']
+    kept = ['T1', 'T55', 'T57', 'T99', 'T131', 'T186', 'T191', 'T2000', 'Index']
+    for tab in skipped:
+        assert not bough.keep_tab(tab, compiled), tab
+    for tab in kept:
+        assert bough.keep_tab(tab, compiled), tab
+
+
+# ------------------------------------------------------------------------------
+# The compiled rules give the same answer as the old comma separated lookup
+# ------------------------------------------------------------------------------
+def test_keep_tab_matches_skip_tabs():
+    tabdelim = 'T56, T113, T114, T126, T127, T158'
+    compiled = bough.compile_skip_rules(tabdelim)
+    for number in range(1, 200):
+        tab = 'T' + str(number)
+        assert bough.keep_tab(tab, compiled) == bough.skip_tabs(tab, tabdelim), tab
+
+
+@pytest.mark.parametrize('rule', ['T5-', 'Table five', 're:[unclosed'])
+def test_bad_rule(rule):
+    with pytest.raises(ValueError):
+        bough.compile_skip_rules([rule])
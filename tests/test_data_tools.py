@@ -0,0 +1,100 @@
+import os
+import sys
+from datetime import datetime
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'styles'))
+data_tools = pytest.importorskip('data_tools')
+
+
+# ------------------------------------------------------------------------------
+# A sample of dates is not the answer, a value further down can make it Alpha
+# ------------------------------------------------------------------------------
+def test_sampled_dates_still_scan_the_column():
+    values = [datetime(2020, 1, 1)] * 1000 + ['not a date']
+    assert data_tools.detect_data_type(values, sample=10) == "Alpha"
+    assert data_tools.detect_data_type(values[:-1], sample=10) == "Date"
+
+
+def test_sampled_alpha_exits_early():
+    values = ['a'] * 1000 + [1]
+    assert data_tools.detect_data_type(values, sample=10) == "Alpha"
+
+
+# ------------------------------------------------------------------------------
+# Comparing a list with itself never matches a string with itself
+# ------------------------------------------------------------------------------
+def test_jaccard_matrix_self_comparison_skips_diagonal():
+    strings = ['apple', 'apples', 'banana', 'apple']
+    scores = data_tools.jaccard_matrix(strings, block_size=3).toarray()
+    assert (scores.diagonal() == 0).all()
+    assert scores[0, 3] == 1.0
+    assert scores[0, 1] == pytest.approx(data_tools.jaccard_score_of_ngrams('apple', 'apples', 2))
+
+    best = data_tools.jaccard_matrix(strings, top_k=1, block_size=3)
+    assert best[0] == [(3, 1.0)]
+    assert best[3] == [(0, 1.0)]
+    assert best[2] == []
+    assert all(j != i for i, row in enumerate(best) for j, score in row)
+
+
+# ------------------------------------------------------------------------------
+# An empty input still gives a file to read back, with just the header
+# ------------------------------------------------------------------------------
+def test_verticalize_to_file_empty_input_writes_header(tmp_path):
+    import pandas as pd
+
+    path = str(tmp_path / 'empty.csv')
+    assert data_tools.verticalize_to_file(pd.DataFrame(columns=['id', 'Q1', 'Q2']), 'id', path) == 0
+    assert open(path).read().splitlines() == ['id,Question,Value']
+
+    path = str(tmp_path / 'nobatches.csv')
+    assert data_tools.verticalize_to_file(iter([]), 'id', path) == 0
+    assert list(pd.read_csv(path).columns) == ['id', 'Question', 'Value']
+
+
+# ------------------------------------------------------------------------------
+# A group given as a string is one letter, 'AB' is not the group A, B
+# ------------------------------------------------------------------------------
+def test_stat_test_pairs_string_group_is_one_letter():
+    import pandas as pd
+
+    datdf = pd.DataFrame([[0.9, 0.1, 0.5]], columns=['A', 'B', 'AB'])
+    effdf = [500, 500, 500]
+    assert data_tools.stat_test_pairs(datdf, effdf, groups=['AB']).iloc[0].tolist() == ['', '', '']
+    assert data_tools.stat_test_pairs(datdf, effdf, groups=['AB', ['A', 'B']]).iloc[0].tolist() == ['B', '', '']
+    assert data_tools.stat_test_pairs(datdf, effdf, groups=[['A', 'AB']]).iloc[0].tolist() == ['AB', '', '']
+    assert data_tools.stat_test_pairs(datdf, effdf, groups=['A', 'B']).iloc[0].tolist() == ['', '', '']
+
+
+# ------------------------------------------------------------------------------
+# The batch gives every pair the letters stat_test gives it, zero bases,
+# equal values, missing and mixed stddevs included
+# ------------------------------------------------------------------------------
+def test_stat_test_batch_matches_stat_test():
+    import random
+
+    rng = random.Random(7)
+    pairs = []
+    for i in range(400):
+        value1, value2 = rng.random(), rng.random()
+        ebase1, ebase2 = rng.choice([0, 5, 50, 500, 2000.5]), rng.choice([0, 5, 50, 500, 2000.5])
+        stddev1, stddev2 = rng.choice([('', ''), ('', ''), (rng.random(), rng.random()), ('', 0.3), (None, 0.3), (0.0, 0.0)])
+        if i % 25 == 0:
+            value2 = value1
+        pairs.append(({'value': value1, 'ebase': ebase1, 'stddev': stddev1, 'stat': []},
+                      {'value': value2, 'ebase': ebase2, 'stddev': stddev2, 'stat': []},
+                      'F' + str(i), 'G' + str(i)))
+
+    for confidence in [0.95, 0.8, 0.975]:
+        stats1, stats2 = data_tools.stat_test_batch([p[0]['value'] for p in pairs], [p[1]['value'] for p in pairs],
+                                                    [p[0]['ebase'] for p in pairs], [p[1]['ebase'] for p in pairs],
+                                                    [p[2] for p in pairs], [p[3] for p in pairs],
+                                                    [p[0]['stddev'] for p in pairs], [p[1]['stddev'] for p in pairs],
+                                                    confidence)
+        for pair, stat1, stat2 in zip(pairs, stats1, stats2):
+            field1dict, field2dict = dict(pair[0], stat=[]), dict(pair[1], stat=[])
+            data_tools.stat_test(field1dict, field2dict, pair[2], pair[3], confidence)
+            assert (stat1, stat2) == (field1dict['stat'], field2dict['stat']), pair
+        assert any(stats1) and any(stats2)
@@ -0,0 +1,82 @@
+import os
+import sys
+import sqlite3
+
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'styles'))
+dimensions_tools = pytest.importorskip('dimensions_tools')
+
+
+# ------------------------------------------------------------------------------
+# Smallest DDF parse_ddf takes: the version tables, Levels and one HDATA level
+# with every kind of declared type the cache has to get right
+# ------------------------------------------------------------------------------
+def make_ddf(path):
+    conn = sqlite3.connect(path)
+    conn.execute('CREATE TABLE SchemaVersion (Version TEXT)')
+    conn.execute("INSERT INTO SchemaVersion VALUES ('1.0')")
+    conn.execute('CREATE TABLE DataVersion (Version TEXT)')
+    conn.execute("INSERT INTO DataVersion VALUES ('2.0')")
+    conn.execute('CREATE TABLE Levels (TableName TEXT, TableNumber INTEGER, ParentName TEXT, DSCTableName TEXT)')
+    conn.execute("INSERT INTO Levels VALUES ('L1', 1, '', 'HDATA')")
+    conn.execute('CREATE TABLE L1 ([Respondent.Serial:L] INTEGER NOT NULL, [Wave:L] INTEGER, [Count:L] INTEGER, '
+                 '[Weight:D] REAL, [Flag:B] BOOLEAN, [Start:T] DATE, [Gender:C1] TEXT, [Name:X] TEXT, '
+                 'primary key ([Respondent.Serial:L]))')
+    conn.executemany('INSERT INTO L1 VALUES (?, ?, ?, ?, ?, ?, ?, ?)', [
+        (1, 1, 3, 0.5, 1, 43831.25, '{1}', 'Ann'),
+        (2, None, 4, 1.25, 0, 43832.5, '{2}', None),
+        (3, 2, 5, 0.1 + 0.2, None, None, None, 'Zoë'),
+    ])
+    conn.commit()
+    conn.close()
+
+
+def test_cache_matches_read_sql_query(tmp_path):
+    ddf_file = str(tmp_path / 'test.ddf')
+    make_ddf(ddf_file)
+
+    conn = sqlite3.connect(ddf_file)
+    expected = pd.read_sql_query('SELECT * FROM L1', conn)
+    conn.close()
+
+    cached = dimensions_tools.load_ddf_columns(ddf_file, 'L1', cache_dir=str(tmp_path / 'columns'))
+    pd.testing.assert_frame_equal(cached, expected)
+
+
+def test_default_cache_is_per_user(tmp_path, monkeypatch):
+    monkeypatch.setenv('XDG_CACHE_HOME', str(tmp_path / 'user_cache'))
+    monkeypatch.setenv('LOCALAPPDATA', str(tmp_path / 'user_cache'))
+    ddf_file = str(tmp_path / 'data' / 'test.ddf')
+    os.makedirs(os.path.dirname(ddf_file))
+    make_ddf(ddf_file)
+
+    cache_dir = dimensions_tools.ddf_column_cache_dir(ddf_file)
+    assert os.path.dirname(os.path.dirname(cache_dir)) == os.path.dirname(dimensions_tools.mdd_cache_file())
+
+    dimensions_tools.load_ddf_columns(ddf_file, 'L1')
+    assert os.path.isfile(os.path.join(cache_dir, 'manifest.json'))
+    assert os.listdir(os.path.dirname(ddf_file)) == ['test.ddf']
+
+
+# ------------------------------------------------------------------------------
+# A cache directory that can't be created (it would sit under a regular file)
+# means reading from the DDF, with the same result
+# ------------------------------------------------------------------------------
+def test_unwritable_cache_reads_the_ddf(tmp_path):
+    ddf_file = str(tmp_path / 'test.ddf')
+    make_ddf(ddf_file)
+    blocker = tmp_path / 'blocker'
+    blocker.write_text('')
+
+    conn = sqlite3.connect(ddf_file)
+    expected = pd.read_sql_query('SELECT * FROM L1', conn)
+    conn.close()
+
+    cache_dir = str(blocker / 'columns')
+    assert dimensions_tools.open_ddf_column_cache(ddf_file, cache_dir)['cache_dir'] is None
+    pd.testing.assert_frame_equal(dimensions_tools.load_ddf_columns(ddf_file, 'L1', cache_dir=cache_dir), expected)
+
+    arrays = dimensions_tools.load_ddf_column_arrays(ddf_file, 'L1', ['Gender:C1'], cache_dir, decode=False)
+    assert list(arrays['Gender:C1']) == [b'{1}', b'{2}', b'']
@@ -0,0 +1,67 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'styles'))
+dimensions_tools = pytest.importorskip('dimensions_tools')
+
+
+# ------------------------------------------------------------------------------
+# Labels in the list/info format retrieve_labels gives back
+# ------------------------------------------------------------------------------
+def labels(texts):
+    return {'list': list(texts), 'info': dict(texts)}
+
+
+question_labels = {
+    ('Question', 'en-US'): 'How old are you?',
+    ('Question', 'de-DE'): 'Wie alt sind Sie?',
+    ('Analysis', 'en-US'): 'Age',
+    ('Analysis', 'fr-FR'): 'Âge',
+}
+category_labels = {
+    ('Question', 'en-US'): ''.join(['Y', 'es']),
+    ('Question', 'de-DE'): 'Ja',
+}
+
+
+def make_master():
+    master = {}
+    master['list'] = ['Age', 'Agree']
+    master['info'] = {}
+    master['info']['Age'] = {'labels': labels(question_labels)}
+    master['info']['Agree'] = {'labels': labels({('Question', 'en-US'): 'Yes'}),
+                               'cats': {'list': ['yes'], 'info': {'yes': {'labels': labels(category_labels)}}}}
+    return master
+
+
+def test_lookup_every_context_and_language():
+    store = dimensions_tools.make_label_store(make_master())
+    assert store['languages'] == {'en-us', 'de-de', 'fr-fr'}
+
+    for (context, language), text in question_labels.items():
+        assert dimensions_tools.lookup_label(store, 'Age', context, language) == text
+        assert dimensions_tools.lookup_label(store, 'Age', context.upper(), language.lower()) == text
+    for (context, language), text in category_labels.items():
+        assert dimensions_tools.lookup_label(store, ('Agree', 'yes'), context, language) == text
+
+
+def test_lookup_fallbacks():
+    store = dimensions_tools.make_label_store(make_master())
+
+    # same context in another language, then the first label, then blank
+    assert dimensions_tools.lookup_label(store, 'Age', 'Analysis', 'de-DE') == 'Age'
+    assert dimensions_tools.lookup_label(store, 'Age', 'Web', 'de-DE') == 'How old are you?'
+    assert dimensions_tools.lookup_label(store, 'Missing') == ''
+
+
+def test_label_strings_are_interned():
+    master = make_master()
+    store = dimensions_tools.make_label_store(master)
+
+    yes_question = dimensions_tools.lookup_label(store, 'Agree')
+    yes_category = dimensions_tools.lookup_label(store, ('Agree', 'yes'))
+    assert yes_question == yes_category == 'Yes'
+    assert yes_question is yes_category
+    assert master['info']['Agree']['labels']['info'][('Question', 'en-US')] is yes_question
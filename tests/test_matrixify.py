@@ -0,0 +1,35 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'styles'))
+data_tools = pytest.importorskip('data_tools')
+
+
+# ------------------------------------------------------------------------------
+# The array has to hold the same rows as the list, blank-filled on the right
+# ------------------------------------------------------------------------------
+def check_array_matches_list(inputs, gutter, vertical):
+    rows = data_tools.matrixify(inputs, gutter, vertical)
+    array = data_tools.matrixify(inputs, gutter, vertical, as_array=True)
+    width = max([len(row) for row in rows] + [0])
+    assert array.shape == (len(rows), width)
+    for i, row in enumerate(rows):
+        assert list(array[i]) == row + [""]*(width-len(row))
+
+
+def test_vertical_ragged_later_row_wider():
+    inputs = [[['a'], ['b', 'c', 'd']], [['x', 'y']]]
+    assert data_tools.matrixify(inputs, 0, True) == [['a', 'x', 'y'], ['b', 'c', 'd', '', '']]
+    check_array_matches_list(inputs, 0, True)
+
+
+def test_vertical_ragged_with_gutter():
+    inputs = [[['a', 'b'], ['c']], [['x'], ['y', 'z', 'w'], ['v']], 7]
+    check_array_matches_list(inputs, 1, True)
+
+
+def test_horizontal_ragged():
+    inputs = [[['a'], ['b', 'c', 'd']], [], [('x', 'y')]]
+    check_array_matches_list(inputs, 2, False)
@@ -0,0 +1,50 @@
+import os
+import sys
+import sqlite3
+import zlib
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'styles'))
+dimensions_tools = pytest.importorskip('dimensions_tools')
+
+
+# ------------------------------------------------------------------------------
+# Stands in for parse_mdd_stream, counting how often the MDD really gets parsed
+# ------------------------------------------------------------------------------
+class CountingParser:
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self, mdd_file, languages=None):
+        self.calls += 1
+        return {'master': {'info': {'q1': {'labels': ('question', 'en-us', 'Q1')}}}, 'names': {'q1'}}
+
+
+@pytest.mark.parametrize('data', [
+    b'not zlib at all',
+    zlib.compress(b'\xff\xfe not utf-8'),
+    zlib.compress(b'{"truncated": '),
+    zlib.compress(b'{"__ref__": 7}'),
+], ids=['zlib', 'utf-8', 'json', 'reference'])
+def test_corrupt_entry_is_reparsed_and_replaced(tmp_path, data):
+    mdd_file = str(tmp_path / 'test.mdd')
+    with open(mdd_file, 'w') as f:
+        f.write('<xml/>')
+    cache_file = str(tmp_path / 'cache.sqlite')
+    parser = CountingParser()
+
+    expected = dimensions_tools.parse_mdd_cached(mdd_file, cache_file, parser)
+    assert parser.calls == 1
+
+    conn = sqlite3.connect(cache_file)
+    with conn:
+        conn.execute('UPDATE mdd_cache SET data = ?', (data,))
+    conn.close()
+
+    assert dimensions_tools.parse_mdd_cached(mdd_file, cache_file, parser) == expected
+    assert parser.calls == 2
+
+    # the entry got overwritten, the next call is a hit again
+    assert dimensions_tools.parse_mdd_cached(mdd_file, cache_file, parser) == expected
+    assert parser.calls == 2
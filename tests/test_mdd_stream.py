@@ -0,0 +1,68 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'styles'))
+dimensions_tools = pytest.importorskip('dimensions_tools')
+
+
+def labels(text, question=False):
+    contexts = ['LABEL', 'QUESTION'] if question else ['LABEL']
+    return ('<labels context="LABEL">'
+            + ''.join('<text context="%s" xml:lang="%s">%s %s</text>' % (context, lang, text, lang)
+                      for lang in ['en-US', 'fr-FR'] for context in contexts)
+            + '</labels>')
+
+
+def category(id, name):
+    return '<category id="%s" name="%s">%s</category>' % (id, name, labels('cat ' + name))
+
+
+# ------------------------------------------------------------------------------
+# Small MDD with the parts both parsers walk: a shared list, a list built on
+# it, inline and referenced categories, a loop, a class, the system block,
+# routing and save logs
+# ------------------------------------------------------------------------------
+MDD = ('<?xml version="1.0" encoding="utf-8"?><xml>'
+       '<mdm:metadata xmlns:mdm="http://www.spss.com/mr/dm/metadatamodel/Arc 3/2000-02-04" mdm_createversion="5.6">'
+       '<datasources default="x"/>'
+       '<languages base="en-US"><language name="en-US" id="0"/><language name="fr-FR" id="1"/></languages>'
+       '<categorymap><categoryid name="c1" value="1"/><categoryid name="c2" value="2"/>'
+       '<categoryid name="c3" value="3"/></categorymap>'
+       '<definition>'
+       '<categories id="_1" name="Brands">' + labels('brands') + category('_2', 'c1') + category('_3', 'c2') + '</categories>'
+       '<categories id="_4" name="MoreBrands"><categories id="_5" name="Brands" ref_name="\\.Brands"/>'
+       + category('_6', 'c3') + '</categories>'
+       '<variable id="_7" name="Q1" type="3" max="1">' + labels('question Q1', True)
+       + '<categories id="_8" global-name-space="-1">' + category('_9', 'c1') + category('_10', 'c2') + '</categories></variable>'
+       '<variable id="_11" name="Q2" type="3">' + labels('question Q2', True)
+       + '<categories id="_12" global-name-space="-1"><categories id="_13" name="MoreBrands" ref_name="MoreBrands"/>'
+       + '</categories></variable>'
+       '<variable id="_14" name="Q3" type="1">' + labels('question Q3', True) + '</variable>'
+       '<variable id="_15" name="Serial" type="1">' + labels('serial') + '</variable>'
+       '</definition>'
+       '<system><class id="_16" name="Respondent">' + labels('respondent')
+       + '<fields name="@fields"><variable id="_17" name="Serial" ref="_15"/></fields></class></system>'
+       '<design><fields name="@fields">'
+       '<variable id="_18" name="Q1" ref="_7"/>'
+       '<loop id="_19" name="Grid" iteratortype="2">' + labels('grid')
+       + '<categories id="_20">' + category('_21', 'c1') + category('_22', 'c2') + '</categories>'
+       + '<fields name="@fields"><variable id="_23" name="Q2" ref="_11"/></fields></loop>'
+       '<class id="_24" name="Blk">' + labels('block') + '<fields name="@fields"><variable id="_25" name="Q3" ref="_14"/></fields></class>'
+       '</fields><types/><pages/><routings><scripts><scripttype type="mrScriptBasic" context="PAPER" interviewmodes="0" usekeycodes="0">'
+       '<script name="PaperRouting">\nQ1.Ask()\nGrid.Ask()\n</script></scripttype></scripts></routings><properties/></design>'
+       '<savelogs><savelog date="2020-01-01" fileversion="1" versionset="" username="a" count="2"/></savelogs>'
+       '</mdm:metadata></xml>')
+
+
+@pytest.mark.parametrize('languages', [None, ['fr-FR']])
+def test_stream_matches_parse_mdd(tmp_path, languages):
+    mdd_file = str(tmp_path / 'test.mdd')
+    with open(mdd_file, 'w', encoding='utf-8') as f:
+        f.write(MDD)
+
+    expected = dimensions_tools.parse_mdd(mdd_file, languages=languages)
+    streamed = dimensions_tools.parse_mdd_stream(mdd_file, languages=languages)
+    assert streamed == expected
+    assert 'Grid' in str(streamed['master']['list'])
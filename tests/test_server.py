@@ -0,0 +1,74 @@
+import os
+import sys
+import json
+from concurrent.futures import Future
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import server
+
+
+# ------------------------------------------------------------------------------
+# Stands in for the process pool: jobs stay pending until the test moves them
+# ------------------------------------------------------------------------------
+class FakePool:
+    def __init__(self, max_workers = None):
+        self.submitted = []
+
+    def submit(self, fn, *args):
+        future = Future()
+        self.submitted.append((args, future))
+        return future
+
+    def shutdown(self, wait = True, cancel_futures = False):
+        pass
+
+
+@pytest.fixture
+def service(tmp_path, monkeypatch):
+    monkeypatch.setattr(server, 'ProcessPoolExecutor', FakePool)
+    return server.JobService(str(tmp_path / 'jobs'), workers = 1, max_queue = 1)
+
+
+def test_same_upload_is_one_job(service):
+    jobid, status = service.submit(b'workbook')
+    assert status == 'queued'
+    assert service.submit(b'workbook') == (jobid, 'queued')
+    assert len(service.pool.submitted) == 1
+
+    service.pool.submitted[0][1].set_running_or_notify_cancel()
+    assert service.submit(b'workbook') == (jobid, 'running')
+    assert service.status(jobid) == 'running'
+    assert len(service.pool.submitted) == 1
+
+    with open(service.paths(jobid)[0], 'rb') as f:
+        assert f.read() == b'workbook'
+
+
+def test_finished_job_comes_from_the_report(service):
+    jobid, status = service.submit(b'workbook')
+    with open(service.paths(jobid)[2], 'w') as f:
+        json.dump({'status': 'ok'}, f)
+    service.pool.submitted[0][1].set_result(None)
+
+    assert service.submit(b'workbook') == (jobid, 'done')
+    assert service.status(jobid) == 'done'
+    assert len(service.pool.submitted) == 1
+
+
+# ------------------------------------------------------------------------------
+# workers + max_queue jobs at once, the next one is refused until one is done
+# ------------------------------------------------------------------------------
+def test_full_queue_is_refused(service):
+    assert service.submit(b'first')[1] == 'queued'
+    assert service.submit(b'second')[1] == 'queued'
+
+    jobid, status = service.submit(b'third')
+    assert status is None
+    assert not os.path.exists(service.paths(jobid)[0])
+    assert service.status(jobid) is None
+
+    service.pool.submitted[0][1].set_result(None)
+    assert service.submit(b'third') == (jobid, 'queued')
+    assert len(service.pool.submitted) == 3
@@ -0,0 +1,83 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'styles'))
+import spill
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = spill.SpillStore(spill.sizeof({'T1': ['a', 'b']}) + 1, spilldir = str(tmp_path))
+    yield store
+    store.close()
+
+
+def test_parse_size():
+    assert spill.parse_size('2G') == 2 * 1024 ** 3
+    assert spill.parse_size('512mb') == 512 * 1024 ** 2
+    assert spill.parse_size('1.5k') == 1536
+    assert spill.parse_size(800) == 800
+
+
+# ------------------------------------------------------------------------------
+# Past the budget values go to disk, the dict still reads like a plain dict
+# ------------------------------------------------------------------------------
+def test_spilled_values_read_back_in_order(store):
+    tables = store.mapping('StubData')
+    expected = {}
+    for i in range(1, 6):
+        value = {'T' + str(i): ['stub ' + str(i), 'x' * i]}
+        tables['T' + str(i)] = value
+        expected['T' + str(i)] = value
+
+    assert store.spilled > 0
+    assert len(tables.memory) + store.spilled == 5
+    assert list(tables) == list(expected)
+    assert dict(tables.items()) == expected
+    assert 'T3' in tables and 'T9' not in tables
+    with pytest.raises(KeyError):
+        tables['T9']
+
+
+def test_overwrite_and_delete(store):
+    tables = store.mapping('StubData')
+    for i in range(1, 4):
+        tables['T' + str(i)] = ['stub ' + str(i), 'x' * 20]
+
+    # read the spilled one so it is the cached last value, then replace it
+    assert 'T3' not in tables.memory
+    assert tables['T3'] == ['stub 3', 'x' * 20]
+    tables['T3'] = ['new']
+    assert tables['T3'] == ['new']
+    assert list(tables) == ['T1', 'T2', 'T3']
+
+    used = store.used
+    del tables['T1']
+    assert store.used < used
+    del tables['T3']
+    with pytest.raises(KeyError):
+        tables['T3']
+    assert list(tables) == ['T2']
+
+
+def test_mappings_share_the_store(tmp_path):
+    store = spill.SpillStore(spill.sizeof(['a', 'b']) + 1, spilldir = str(tmp_path))
+    first = store.mapping('Stub')
+    second = store.mapping('StubData')
+    first['T1'] = ['a', 'b']
+    second['T1'] = ['c', 'd']
+    assert first['T1'] == ['a', 'b']
+    assert second['T1'] == ['c', 'd']
+    assert store.spilled == 1
+    store.close()
+
+
+def test_close_removes_the_file(tmp_path):
+    store = spill.SpillStore(0, spilldir = str(tmp_path))
+    store.mapping('Stub')['T1'] = ['a']
+    assert os.path.isfile(store.path)
+    store.close()
+    assert not os.path.exists(store.path)
+    store.close()
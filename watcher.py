@@ -0,0 +1,199 @@
+import os
+import sys
+import json
+import time
+import argparse
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+
+from main import run_pipeline
+
+# =============================================================================
+# Watch folder worker. Polls an input directory for LRW tab workbooks and runs
+# each one through aggr -> scraper -> makeup in a pool of long-lived worker
+# processes, so pandas/openpyxl are imported once instead of once per delivery.
+#
+#   python watcher.py datasets --workers 2 --interval 5
+# =============================================================================
+
+suffix = '_TotalTabsPlus'
+reportsuffix = suffix + '_report.json'
+
+
+# =============================================================================
+# Output and report sit next to the input, named like aggron names its output
+# =============================================================================
+def output_paths(inputfile):
+    base = os.path.splitext(inputfile)[0]
+    return base + suffix + '.xlsx', base + reportsuffix
+
+
+# =============================================================================
+# Only plain workbooks are jobs. Skips our own outputs and the "~$" lock files
+# Excel leaves behind while a workbook is open
+# =============================================================================
+def is_candidate(fname):
+    if not fname.lower().endswith('.xlsx'):
+        return False
+    if fname.startswith('~$') or fname.startswith('.'):
+        return False
+    if os.path.splitext(fname)[0].endswith(suffix):
+        return False
+    return True
+
+
+# =============================================================================
+# A report left by an earlier run for this exact size/mtime means the workbook
+# was already processed, even if this process has just started
+# =============================================================================
+def already_done(inputfile, signature):
+    reportfile = output_paths(inputfile)[1]
+    if not os.path.isfile(reportfile):
+        return False
+    try:
+        with open(reportfile, 'r') as f:
+            report = json.load(f)
+    except (OSError, ValueError):
+        return False
+    return report.get('status') == 'ok' and report.get('signature') == list(signature)
+
+
+# =============================================================================
+# Runs in the worker process. Any failure is written to the report instead of
+# being raised so one bad workbook never takes the worker down
+# =============================================================================
+def process_job(inputfile, signature, maxmemory = None):
+    outputfile, reportfile = output_paths(inputfile)
+    try:
+        report = run_pipeline(inputfile, outputfile, maxmemory)
+        report['status'] = 'ok'
+    except Exception:
+        report = {}
+        report['input'] = inputfile
+        report['status'] = 'error'
+        report['error'] = traceback.format_exc()
+    report['signature'] = list(signature)
+
+    with open(reportfile, 'w') as f:
+        json.dump(report, f, indent = 4)
+
+    return report
+
+
+class Watcher:
+    """
+    Polls `inputdir` every `interval` seconds. A workbook is queued once its
+    (size, mtime) has not changed for `settle` consecutive polls, which keeps
+    half-copied files out of the pipeline. Each (path, size, mtime) is only
+    ever queued once, and at most `workers` jobs run at the same time.
+    """
+
+    def __init__(self, inputdir, workers = 1, interval = 5.0, settle = 2, maxmemory = None):
+        self.inputdir = inputdir
+        self.maxmemory = maxmemory
+        self.workers = workers
+        self.interval = interval
+        self.settle = settle
+        self.pending = {}
+        self.queue = []
+        self.running = {}
+        self.seen = set()
+
+    # =========================================================================
+    # One poll of the directory. Returns the paths that became stable
+    # =========================================================================
+    def scan(self):
+        stable = []
+        present = set()
+        for entry in os.scandir(self.inputdir):
+            if not entry.is_file() or not is_candidate(entry.name):
+                continue
+
+            stat = entry.stat()
+            signature = (stat.st_size, stat.st_mtime_ns)
+            present.add(entry.path)
+
+            if (entry.path, signature) in self.seen:
+                continue
+
+            # =================================================================
+            # New file or still growing -> (re)start the stability count
+            # =================================================================
+            last = self.pending.get(entry.path)
+            if last is None or last[0] != signature:
+                self.pending[entry.path] = (signature, 0)
+                continue
+
+            count = last[1] + 1
+            if count < self.settle:
+                self.pending[entry.path] = (signature, count)
+                continue
+
+            del self.pending[entry.path]
+            self.seen.add((entry.path, signature))
+            if already_done(entry.path, signature):
+                print('Skipping ' + entry.path + ', already processed')
+                continue
+            stable.append((entry.path, signature))
+
+        # =====================================================================
+        # Forget files that were removed before they settled
+        # =====================================================================
+        for path in list(self.pending):
+            if path not in present:
+                del self.pending[path]
+
+        return stable
+
+    # =========================================================================
+    # Collects finished jobs and tops the pool back up from the queue
+    # =========================================================================
+    def dispatch(self, pool):
+        for future, path in list(self.running.items()):
+            if not future.done():
+                continue
+            del self.running[future]
+            try:
+                report = future.result()
+                print('Finished ' + path + ' [' + report['status'] + ']')
+            except Exception:
+                print('Worker failed on ' + path)
+                traceback.print_exc()
+
+        while self.queue and len(self.running) < self.workers:
+            path, signature = self.queue.pop(0)
+            print('Starting ' + path)
+            self.running[pool.submit(process_job, path, signature, self.maxmemory)] = path
+
+    def run(self, once = False):
+        with ProcessPoolExecutor(max_workers = self.workers) as pool:
+            while True:
+                self.queue.extend(self.scan())
+                self.dispatch(pool)
+                if once and not self.pending and not self.queue and not self.running:
+                    break
+                time.sleep(self.interval)
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = 'Watch a folder for LRW tab workbooks and run TotalTabPlus on each.')
+    parser.add_argument('inputdir', help = 'directory to watch')
+    parser.add_argument('--workers', type = int, default = 1, help = 'workbooks processed at the same time')
+    parser.add_argument('--interval', type = float, default = 5.0, help = 'seconds between polls')
+    parser.add_argument('--settle', type = int, default = 2, help = 'unchanged polls before a file counts as fully copied')
+    parser.add_argument('--max-memory', help = "memory budget per workbook for the parsed tables, e.g. '2G'")
+    parser.add_argument('--once', action = 'store_true', help = 'exit once everything present has been processed')
+    args = parser.parse_args(argv)
+
+    if not os.path.isdir(args.inputdir):
+        parser.error('not a directory: ' + args.inputdir)
+
+    watcher = Watcher(args.inputdir, args.workers, args.interval, args.settle, args.max_memory)
+    try:
+        watcher.run(args.once)
+    except KeyboardInterrupt:
+        print('Stopped')
+
+
+if __name__ == "__main__":
+    sys.exit(main())